@@ -2,11 +2,63 @@
 Michal Dudka ADC v2 python 3 class. Single-shot-based module.
 Type: AD7734
 Tested on Python 3.7.1.
+
+Continuous mode (background reader thread, per-channel ring buffers):
+X.start_stream([1, 2])
+sleep(1)
+times, voltages = X.get_newest(1, 100)
+times, voltages, index = X.get_since(2, 0)  # next call: X.get_since(2, index)
+X.stop_stream()
+print(X.get_stream_stats())
 """
 
+import threading
+import numpy as np
 import serial
 from time import sleep, time
 
+MAX_LINE = 16  # longest valid "ch,value" line without terminator
+
+
+def parse_stream(buffer):
+    """
+    Vectorized parser of "ch,value\r\n" messages.
+    Args:
+        buffer: bytes, may end with an incomplete line
+    Returns:
+        channels: int64 ndarray of parsed channels (1 to 8)
+        values: int64 ndarray of ADC values
+        consumed: number of bytes of complete lines
+        invalid: number of complete lines which are not numeric
+            messages (e.g. "OK", "??" or corrupted ones)
+    """
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    ends = np.flatnonzero(raw == 10)  # "\n"
+    empty = np.zeros(0, dtype=np.int64)
+    if ends.size == 0:
+        return empty, empty, 0, 0
+    consumed = int(ends[-1]) + 1
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    stops = ends - (raw[np.maximum(ends - 1, 0)] == 13)  # strip "\r"
+    length = stops - starts
+    ok = (length >= 3) & (length <= MAX_LINE)
+    first = raw[np.minimum(starts, consumed - 1)].astype(np.int64) - 48
+    comma = raw[np.minimum(starts + 1, consumed - 1)]
+    ok &= (first >= 1) & (first <= 8) & (comma == 44)
+
+    # digits of all lines, weighted by their decimal order
+    idx = np.arange(consumed)
+    line = np.searchsorted(starts, idx, side='right') - 1
+    in_value = (idx >= starts[line] + 2) & (idx < stops[line])
+    digits = raw[:consumed].astype(np.int64) - 48
+    bad_digit = in_value & ((digits < 0) | (digits > 9))
+    exponent = np.clip(stops[line] - 1 - idx, 0, 18)
+    contrib = np.where(in_value & ~bad_digit, digits*10**exponent, 0)
+    values = np.bincount(line, weights=contrib, minlength=ends.size)
+    ok &= np.bincount(line, weights=bad_digit, minlength=ends.size) == 0
+    return first[ok], values[ok].astype(np.int64), consumed, int(np.count_nonzero(~ok))
+
+
 class MD_ADC_v2():
     def __init__(self, port=None, settings=None):
         self.channels = [1, 2, 3, 4, 5, 6, 7, 8]
@@ -28,7 +80,12 @@ class MD_ADC_v2():
             [5, 2**24, 0]
         ]
         self.delay = 0.025  # sec
+        self.latency = 0.02  # sec, allowance for USB-serial latency in single reads
         self.clk = 2.5  # MHz
+        self.streaming = False
+        self.stream_thread = None
+        self.stream_lock = threading.Lock()
+        self._reset_stream([], 0)
         try:
             self.port = serial.Serial(
                 port, baudrate=921600, bytesize=8, parity='N', xonxoff=False,  timeout=1)
@@ -62,6 +119,10 @@ class MD_ADC_v2():
         """
         Close port.
         """
+        if self.port is None:
+            return
+        if self.streaming:
+            self.stop_stream()
         if self.port.isOpen():
             self.port.close()
         
@@ -189,38 +250,239 @@ class MD_ADC_v2():
         check = (str(msgs, encoding='ascii').count("OK") == len(commands))
         return msgs, check
 
-    def read_singles(self, channels=None):
+    def single_deadline(self, channels):
+        """
+        Longest expected duration of single reads of channels.
+        Sum of conversion times, transfer of commands and answers
+        (about 12 bytes each way per channel) and self.latency.
+        Returns:
+            seconds (float)
+        """
+        conversion = sum(self.conversion_time_calc(ch, self.settings[ch]['time'])
+                         for ch in channels)*1e-6
+        transfer = len(channels)*2*12*10/self.port.baudrate
+        return conversion + transfer + self.latency
+
+    def read_singles(self, channels=None, pipelined=True):
         """
         Single read of ADC voltage.
+        Commands for all channels are sent at once and the answers are
+        parsed as they come, until all arrived or the deadline given by
+        single_deadline() expired.
         Args:
             channels: list of channels to be read (integers from 1 to 8)
+            pipelined: if False, next command is sent after the answer
+                to the previous one (each with its own deadline)
         Returns:
             results: dictionary with channels as keys
         """
+        if self.streaming:
+            raise Exception('MD_ADC_v2: Single read is not possible while streaming.')
         if channels is None:
             channels = self.channels
-        cmds = [bytes(f"single{ch}\n", encoding='ascii') for ch in channels]
-        msgs = b''
+        batches = [list(channels)] if pipelined else [[ch] for ch in channels]
+        self.port.read(self.port.inWaiting())  # discard what remains
         results = {}
-        for cmd in cmds:
-            self.port.write(cmd)
-            sleep(self.delay)
-            msg = self.port.read(self.port.inWaiting())
-            msgs = msgs+msg
-        msgs = str(msgs, encoding='ascii')
-        for msg in msgs.split("\r\n"):
-            if len(msg) > 0:
-                try:
-                    a, b = msg.split(',')
-                    ch = int(a)
-                    val = int(b)
-                    V = self.voltage_calc(ch, val)
-                    results[int(a)] = V
-                except:
-                    print(f"MD_ADC_v2: Parsing {msg} as single count failed.")
-                    pass
+        for batch in batches:
+            cmds = b''.join(bytes(f"single{ch}\n", encoding='ascii') for ch in batch)
+            deadline = time() + self.single_deadline(batch)
+            self.port.write(cmds)
+            pending = list(batch)
+            msgs = b''
+            while pending and time() < deadline:
+                n = self.port.inWaiting()
+                if n == 0:
+                    sleep(0.0002)
+                    continue
+                msgs = msgs + self.port.read(n)
+                *lines, msgs = msgs.split(b"\r\n")
+                for msg in lines:
+                    msg = str(msg, encoding='ascii', errors='replace')
+                    if len(msg) == 0 or msg == "OK":
+                        continue
+                    try:
+                        a, b = msg.split(',')
+                        ch = int(a)
+                        val = int(b)
+                        V = self.voltage_calc(ch, val)
+                        results[ch] = V
+                        if ch in pending:
+                            pending.remove(ch)
+                    except:
+                        print(f"MD_ADC_v2: Parsing {msg} as single count failed.")
+            if pending:
+                print(f"MD_ADC_v2: No answer from channels {pending} before deadline.")
         return results
 
+    def start_stream(self, channels=None, capacity=1 << 16):
+        """
+        Start continuous conversion and background reading of the stream.
+        Args:
+            channels: list of channels to be converted (integers from 1 to 8)
+            capacity: number of kept samples per channel
+        """
+        if self.streaming:
+            self.stop_stream()
+        if channels is None:
+            channels = self.channels
+        self._reset_stream(channels, capacity)
+        self.port.read(self.port.inWaiting())  # discard what remains
+        for ch in self.stream_channels:
+            self.port.write(bytes(f"on_cont{ch}\n", encoding='ascii'))
+            self.settings[ch]['cont'] = True
+        self.streaming = True
+        self.stream_started = time()
+        self.stream_thread = threading.Thread(target=self._stream_loop, daemon=True)
+        self.stream_thread.start()
+
+    def _reset_stream(self, channels, capacity):
+        """Empty ring buffers and counters for channels."""
+        with self.stream_lock:
+            self.stream_channels = sorted(channels)
+            self.stream_capacity = capacity
+            self.stream_times = np.zeros((9, capacity), dtype=np.float64)
+            self.stream_values = np.zeros((9, capacity), dtype=np.float64)
+            self.stream_counts = np.zeros(9, dtype=np.int64)  # written per channel
+            self.stream_missed = 0
+            self.stream_invalid = 0
+            self.stream_bytes = 0
+            self.stream_started = None
+            self.stream_stopped = None
+        # order of channels in the conversion cycle, -1 for others
+        self._cycle = np.full(9, -1, dtype=np.int64)
+        self._cycle[self.stream_channels] = np.arange(len(self.stream_channels))
+        self._last_pos = -1
+        # voltage formula A*(val/B) + C per channel
+        self._voltage_coefs = np.zeros((9, 3))
+        for ch in self.channels:
+            self._voltage_coefs[ch] = self.voltage_table[self.settings[ch]['range']]
+
+    def stop_stream(self):
+        """
+        Stop continuous conversion and the reader thread.
+        """
+        if not self.streaming:
+            return
+        for ch in self.stream_channels:
+            self.port.write(bytes(f"off_cont{ch}\n", encoding='ascii'))
+            self.settings[ch]['cont'] = False
+        sleep(self.delay)
+        self.streaming = False
+        self.stream_stopped = time()
+        self.stream_thread.join()
+        sleep(self.delay)
+        self.port.read(self.port.inWaiting())  # discard the rest of the stream
+
+    def _stream_loop(self):
+        buffer = b''
+        t_last = time()
+        while self.streaming:
+            try:
+                data = self.port.read(max(1, self.port.inWaiting()))
+            except (serial.SerialException, OSError, TypeError):
+                break
+            if not data:
+                continue
+            now = time()
+            buffer += data
+            self.stream_bytes += len(data)
+            channels, values, consumed, invalid = parse_stream(buffer)
+            buffer = buffer[consumed:]
+            self.stream_invalid += invalid
+            if channels.size:
+                # host times spread over the interval since the last read
+                times = t_last + (now - t_last)*np.arange(1, channels.size + 1)/channels.size
+                self._store(channels, values, times)
+            t_last = now
+
+    def _store(self, channels, values, times):
+        """
+        Append parsed samples to the ring buffers, count missed conversions.
+        The device sends no sequence number, a lost conversion is seen only
+        as a gap in the cyclic order of the channels. With one streamed
+        channel lost conversions cannot be detected.
+        """
+        pos = self._cycle[channels]
+        known = pos >= 0
+        channels, values, times, pos = channels[known], values[known], times[known], pos[known]
+        if channels.size == 0:
+            return
+        # channels come in cyclic order, a skipped position is a lost conversion
+        n = len(self.stream_channels)
+        previous = np.concatenate(([self._last_pos], pos[:-1]))
+        steps = (pos - previous - 1) % n
+        if self._last_pos < 0:
+            steps[0] = 0
+        self.stream_missed += int(steps.sum())
+        self._last_pos = int(pos[-1])
+
+        A, B, C = self._voltage_coefs[channels].T
+        voltages = A*(values/B) + C
+        capacity = self.stream_capacity
+        with self.stream_lock:
+            for ch in np.unique(channels):
+                sel = channels == ch
+                count = self.stream_counts[ch]
+                idx = (count + np.arange(np.count_nonzero(sel))) % capacity
+                self.stream_times[ch, idx] = times[sel]
+                self.stream_values[ch, idx] = voltages[sel]
+                self.stream_counts[ch] = count + idx.size
+
+    def get_since(self, ch, index=0):
+        """
+        Stream samples of channel ch from sample number index on.
+        Samples older than the buffer capacity are lost.
+        Args:
+            ch: channel number
+            index: number of the first requested sample (counted since start_stream)
+        Returns:
+            times: host times (s) of the samples
+            voltages: voltages of the samples
+            index: number of the next sample, use in the next call
+        """
+        with self.stream_lock:
+            return self._since(ch, index)
+
+    def _since(self, ch, index):
+        """get_since() without the lock."""
+        count = int(self.stream_counts[ch])
+        start = max(index, count - self.stream_capacity, 0)
+        idx = np.arange(start, count) % max(self.stream_capacity, 1)
+        return self.stream_times[ch, idx], self.stream_values[ch, idx], count
+
+    def get_newest(self, ch, n):
+        """
+        Newest n stream samples of channel ch.
+        Returns:
+            times: host times (s) of the samples
+            voltages: voltages of the samples
+        """
+        with self.stream_lock:
+            times, voltages, _ = self._since(ch, int(self.stream_counts[ch]) - n)
+        return times, voltages
+
+    def get_stream_stats(self):
+        """
+        Returns:
+            dictionary with numbers of samples per channel, detected missed
+            conversions (always 0 with one channel, see _store()),
+            non-numeric lines and rate (conversions/s)
+        """
+        with self.stream_lock:
+            samples = {ch: int(self.stream_counts[ch]) for ch in self.stream_channels}
+        if self.stream_started is None:
+            duration = 0.0
+        else:
+            end = time() if self.stream_stopped is None else self.stream_stopped
+            duration = end - self.stream_started
+        return {
+            "samples": samples,
+            "missed": self.stream_missed,
+            "invalid": self.stream_invalid,
+            "bytes": self.stream_bytes,
+            "rate": sum(samples.values())/duration if duration > 0 else 0.0
+        }
+
 
 ## Example use
 ##DefaulSettings = {
@@ -0,0 +1,102 @@
+import re
+from time import time
+import numpy as np
+import pytest
+import MDADCv2
+from MDADCv2 import MD_ADC_v2, parse_stream
+
+
+class FakeADC():
+    """Serial port answering single reads, in pieces of chunk bytes."""
+    baudrate = 921600
+
+    def __init__(self, values, chunk=5):
+        self.values = values  # channel: ADC value, missing channels are silent
+        self.chunk = chunk
+        self.output = b""
+        self.commands = []
+
+    def write(self, data):
+        for ch in re.findall(rb"single(\d)\n", data):
+            self.commands.append(int(ch))
+            if int(ch) in self.values:
+                self.output += b"%d,%d\r\n" % (int(ch), self.values[int(ch)])
+
+    def inWaiting(self):
+        return min(len(self.output), self.chunk)
+
+    def read(self, n):
+        data, self.output = self.output[:n], self.output[n:]
+        return data
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def adc(monkeypatch):
+    port = FakeADC({1: 2**23, 2: 2**24, 3: 0})
+    monkeypatch.setattr(MDADCv2.serial, "Serial", lambda *args, **kwargs: port)
+    adc = MD_ADC_v2("fake")
+    adc.latency = 0.05
+    return adc, port
+
+
+def test_pipelined_single_reads(adc):
+    adc, port = adc
+    assert adc.read_singles([1, 2, 3]) == {1: 0.0, 2: 10.0, 3: -10.0}
+    assert port.commands == [1, 2, 3]
+
+
+def test_silent_channel_ends_at_deadline(adc):
+    adc, port = adc
+    t0 = time()
+    results = adc.read_singles([1, 4])
+    elapsed = time() - t0
+    assert results == {1: 0.0}
+    deadline = adc.single_deadline([1, 4])
+    assert deadline - 0.01 <= elapsed < deadline + 0.05
+
+
+def test_sequential_single_reads(adc):
+    adc, port = adc
+    assert adc.read_singles([3, 1], pipelined=False) == {3: -10.0, 1: 0.0}
+
+
+def test_stream_stats_before_start(adc):
+    adc, port = adc
+    assert adc.get_stream_stats()["samples"] == {}
+    times, voltages = adc.get_newest(1, 10)
+    assert times.size == voltages.size == 0
+
+
+def test_parse_stream():
+    buffer = b"1,123\r\n2,8388608\r\nOK\r\n9,1\r\n3,1x3\r\n4,77\r\n5,12"
+    channels, values, consumed, invalid = parse_stream(buffer)
+    np.testing.assert_array_equal(channels, [1, 2, 4])
+    np.testing.assert_array_equal(values, [123, 8388608, 77])
+    assert buffer[consumed:] == b"5,12"
+    assert invalid == 3  # "OK", channel 9 and the corrupted value
+
+
+def test_parse_stream_without_complete_line():
+    channels, values, consumed, invalid = parse_stream(b"1,12")
+    assert channels.size == values.size == consumed == invalid == 0
+
+
+def test_parse_stream_bare_newlines():
+    channels, values, consumed, invalid = parse_stream(b"6,16777215\n7,0\n")
+    np.testing.assert_array_equal(channels, [6, 7])
+    np.testing.assert_array_equal(values, [16777215, 0])
+    assert consumed == 15 and invalid == 0
+
+
+def test_missed_conversions_in_channel_cycle(adc):
+    adc, port = adc
+    adc._reset_stream([1, 2, 3], 16)
+    adc._store(np.array([1, 2, 3, 1, 3, 1]), np.zeros(6), np.arange(6.0))
+    assert adc.stream_missed == 1  # channel 2 of the second cycle
+    assert adc.get_stream_stats()["samples"] == {1: 3, 2: 1, 3: 2}
@@ -0,0 +1,189 @@
+import threading
+import numpy as np
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from time import sleep, monotonic
+
+"""
+Position streaming of one SMC100CC axis during a continuous (fly) scan.
+
+PositionStream starts a move and samples TP as fast as the controller
+answers from a background thread. Samples (host monotonic time in the
+middle of the request, position in degrees without correction) are
+stored in a preallocated ring. The helpers map any host time, e.g. the
+time-slice boundaries of a coincidence measurement, to the stage angle.
+
+Example:
+    M = SMC100CC(SMC100Bus('COM3'), 1)
+    Stream = PositionStream(M)
+    t0 = monotonic()  # host time of the tagger measurement start
+    Stream.start(90)  # sweep to 90 deg
+    Stream.wait()
+    edges = t0 + np.arange(0, 5e12, 1e11)*1e-12  # tagger slices (ps) -> host time
+    angles = Stream.slice_positions(edges)  # mean angle in every slice
+"""
+
+SAMPLE_DTYPE = np.dtype([("time", np.float64), ("pos", np.float64)])
+
+
+class PositionStream():
+    """
+    Background TP sampling of one axis into a ring buffer.
+    """
+
+    def __init__(self, motor, capacity=1 << 16, tolerance=1e-3, settle_samples=3,
+                 timeout=600.0, max_errors=20):
+        """
+        Args:
+            motor - SMC100CC, framed mode gives the highest rate
+            capacity - number of kept samples, the oldest are overwritten
+            tolerance - distance (deg) from the target considered arrived
+            settle_samples - number of samples at the target to stop
+            timeout - longest time (s) of sampling
+            max_errors - number of failed reads in a row to stop sampling
+        """
+        self.motor = motor
+        self.buffer = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.tolerance = tolerance
+        self.settle_samples = settle_samples
+        self.timeout = timeout
+        self.max_errors = max_errors
+        self.count = 0
+        self.errors = 0  # failed reads in a row
+        self.error = None  # exception which stopped sampling
+        self.target = None
+        self.thread = None
+        self.running = False
+
+    def _read_pos(self):
+        """
+        One TP round trip without fixed listen delay. The response is
+        parsed here, the cache of the motor is not touched from the
+        sampling thread.
+        """
+        motor = self.motor
+        if motor.bus is not None:
+            response = motor.bus.wait(motor.bus.query(motor.address, "TP"))
+            return float(motor.response_value(response))
+        port = motor.port
+        port.read(port.inWaiting())  # drop stale input
+        motor.send_command("TP", "")
+        response = b""
+        t0 = monotonic()
+        while not response.endswith(b"\r\n"):
+            if monotonic() - t0 > 1.0:
+                raise TimeoutError(f"{motor.label}: no TP response")
+            sleep(0.0005)
+            response += port.read(port.inWaiting())
+        return float(motor.response_value(str(response, encoding='ascii')))
+
+    def _loop(self):
+        capacity = self.buffer.size
+        at_target = 0
+        t_stop = monotonic() + self.timeout
+        while self.running and monotonic() < t_stop:
+            t_send = monotonic()
+            try:
+                x = self._read_pos()
+            except (ValueError, TimeoutError, FutureTimeoutError) as exc:
+                self.errors += 1
+                if self.errors >= self.max_errors:
+                    self.error = exc
+                    print(f"PositionStream: {self.motor.label}: stopped after "
+                          f"{self.errors} failed reads ({exc})")
+                    break
+                sleep(min(0.1, 0.001*2**self.errors))  # back off
+                continue
+            self.errors = 0
+            t_recv = monotonic()
+            sample = self.buffer[self.count % capacity]
+            sample["time"] = 0.5*(t_send + t_recv)
+            sample["pos"] = x - self.motor.correction
+            self.count += 1
+            if self.target is not None:
+                if abs(sample["pos"] - self.target) <= self.tolerance:
+                    at_target += 1
+                    if at_target >= self.settle_samples:
+                        break
+                else:
+                    at_target = 0
+        self.running = False
+
+    def start(self, target=None):
+        """
+        Clear the buffer, start the move to target (degrees without
+        correction) and sampling. Sampling stops at the target, or on
+        stop() when target is None (e.g. move started elsewhere).
+        Raises:
+            RuntimeError when the motor does not accept the move
+        """
+        self.stop()
+        self.count = 0
+        self.errors = 0
+        self.error = None
+        self.target = target
+        if target is not None:
+            if not self.motor.move_abs_noblock(target + self.motor.correction):
+                raise RuntimeError(f"PositionStream: {self.motor.label} did not accept "
+                                   f"the move to {target}")
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+    def wait(self, timeout=None):
+        """Wait until sampling ends."""
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def samples(self):
+        """
+        Returns:
+            structured array (time, pos) of kept samples in time order
+        """
+        capacity = self.buffer.size
+        if self.count <= capacity:
+            return self.buffer[:self.count].copy()
+        start = self.count % capacity
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
+
+    def rate(self):
+        """Mean sampling rate (Hz) of the kept samples."""
+        samples = self.samples()
+        if samples.size < 2:
+            return 0.0
+        return (samples.size - 1)/(samples["time"][-1] - samples["time"][0])
+
+    def position_at(self, times):
+        """
+        Stage angle (deg) at host monotonic times by linear interpolation,
+        nan outside the sampled interval.
+        """
+        samples = self.samples()
+        times = np.asarray(times, dtype=np.float64)
+        if samples.size == 0:
+            return np.full(times.shape, np.nan)
+        return np.interp(times, samples["time"], samples["pos"],
+                         left=np.nan, right=np.nan)
+
+    def slice_positions(self, edges):
+        """
+        Mean stage angle (deg) in each interval between consecutive edges
+        (host monotonic times), exact for the piecewise linear path.
+        Returns:
+            ndarray of len(edges)-1 values, nan where not sampled
+        """
+        samples = self.samples()
+        edges = np.asarray(edges, dtype=np.float64)
+        if samples.size < 2:
+            return np.full(edges.size - 1, np.nan)
+        t, x = samples["time"], samples["pos"]
+        inside = (edges >= t[0]) & (edges <= t[-1])
+        grid = np.union1d(t, edges[inside])
+        path = np.interp(grid, t, x)
+        integral = np.concatenate(([0.0], np.cumsum(np.diff(grid)*(path[1:] + path[:-1])/2)))
+        at_edges = np.full(edges.size, np.nan)
+        at_edges[inside] = integral[np.searchsorted(grid, edges[inside])]
+        return np.diff(at_edges)/np.diff(edges)
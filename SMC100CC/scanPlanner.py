@@ -0,0 +1,238 @@
+import numpy as np
+from time import time
+
+"""
+Travel-optimized ordering of SMCStack move sequences.
+
+The time of one step of a scan is the time of the slowest axis.
+The planner builds the matrix of step times between all target
+positions from a motion-time model and reorders the targets by
+nearest neighbour followed by 2-opt improvement (open path starting
+at the current position). Ordering constraints are given by groups,
+the groups are executed in ascending order and the targets are
+reordered only within a group.
+
+Example:
+    Ms = SMCStack('COM3', ConstructionDict, 1)
+    Planner = ScanPlanner(Ms)  # local kinematic model of the stack
+    #Planner = ScanPlanner(Ms, MotionTimeTable.from_stack(Ms))  # sampled PT
+    Targets = [{1: a, 2: b} for a in range(0, 180, 10) for b in (0, 45)]
+    Plan = Planner.plan(Targets)
+    print(Plan["predicted_total"], Plan["original_total"])
+    Report = Planner.execute(Plan, on_step=lambda i, PosDict: measure())
+    print(Report["predicted_total"], Report["actual_total"])  # moves only
+"""
+
+# distances (deg) sampled by the controllers' PT command
+DEFAULT_DISTANCES = (0.1, 0.3, 1, 3, 10, 30, 90, 180, 360)
+
+
+class MotionTimeTable():
+    """
+    Move time as a function of distance for each axis, interpolated from
+    a table and linearly extrapolated beyond it (constant velocity).
+    """
+
+    def __init__(self, distances, times):
+        """
+        Args:
+            distances - dictionary key: increasing distances (deg)
+            times - dictionary key: move times (s) for the distances
+        """
+        self.distances = {}
+        self.times = {}
+        for key in distances:
+            # zero distance takes no time
+            self.distances[key] = np.concatenate(([0.0], np.asarray(distances[key], dtype=float)))
+            self.times[key] = np.concatenate(([0.0], np.asarray(times[key], dtype=float)))
+
+    @classmethod
+    def from_stack(cls, stack, keys=None, distances=DEFAULT_DISTANCES):
+        """
+        Sample the controllers' own estimate (PT command) of each axis.
+        """
+        if keys is None:
+            keys = sorted(stack.Motors.keys())
+        times = {key: [stack[key].get_mr_time(d) for d in distances] for key in keys}
+        return cls({key: distances for key in keys}, times)
+
+    def move_time(self, key, distance):
+        """
+        Move time (s) of axis key over distance (deg), distance may be ndarray.
+        """
+        d, t = self.distances[key], self.times[key]
+        distance = np.abs(distance)
+        slope = (t[-1] - t[-2])/(d[-1] - d[-2])
+        return np.where(distance <= d[-1], np.interp(distance, d, t),
+                        t[-1] + (distance - d[-1])*slope)
+
+
+def _path_cost(cost, path):
+    return cost[path[:-1], path[1:]].sum()
+
+
+def nearest_neighbour(cost, start, nodes):
+    """
+    Greedy open path from start through nodes.
+    Args:
+        cost - square matrix of step times
+        start - index of the first node
+        nodes - indices to visit
+    Returns:
+        list of indices starting with start
+    """
+    path = [start]
+    left = np.array(nodes, dtype=np.int64)
+    while left.size:
+        best = np.argmin(cost[path[-1], left])
+        path.append(int(left[best]))
+        left = np.delete(left, best)
+    return path
+
+
+def two_opt(cost, path, max_sweeps=100):
+    """
+    Improve open path with fixed first node by 2-opt segment reversals.
+    Cost matrix has to be symmetric.
+    Returns:
+        improved path as list
+    """
+    path = np.array(path, dtype=np.int64)
+    n = path.size
+    if n < 4:
+        return list(path)
+    for _ in range(max_sweeps):
+        improved = False
+        for i in range(1, n - 1):
+            a, first = path[i - 1], path[i]
+            j = np.arange(i + 1, n)
+            last = path[j]
+            # reverse path[i:j+1]
+            delta = cost[a, last] - cost[a, first]
+            inner = j < n - 1
+            b = path[j[inner] + 1]
+            delta[inner] += cost[first, b] - cost[last[inner], b]
+            best = np.argmin(delta)
+            if delta[best] < -1e-9:
+                jb = j[best]
+                path[i:jb + 1] = path[i:jb + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return list(path)
+
+
+class ScanPlanner():
+    """
+    Reorder and execute list of PosDicts with SMCStack.
+    """
+
+    def __init__(self, stack, model=None, overhead=0.0):
+        """
+        Args:
+            stack - SMCStack
+            model - object with move_time(key, distance), by default
+              the stack itself (local kinematic model of each motor)
+            overhead - fixed time (s) added to each move (communication,
+              settling), it does not change the order
+        """
+        self.stack = stack
+        self.model = stack if model is None else model
+        self.overhead = overhead
+
+    def cost_matrix(self, positions, keys):
+        """
+        Step times between all rows of positions.
+        Args:
+            positions - ndarray (n, len(keys)) of positions (deg)
+            keys - motor keys of the columns
+        Returns:
+            ndarray (n, n), time of the slowest axis for each step
+        """
+        cost = np.zeros((len(positions), len(positions)))
+        for col, key in enumerate(keys):
+            distance = positions[:, col][:, None] - positions[:, col][None, :]
+            np.maximum(cost, self.model.move_time(key, distance), out=cost)
+        return cost
+
+    def plan(self, PosDicts, groups=None, start=None, optimize=True):
+        """
+        Find fast order of targets.
+        Args:
+            PosDicts - list of dictionaries key: absolute position (deg),
+              missing axes are filled with the start position
+            groups - optional list of group numbers of the targets,
+              groups are kept in ascending order
+            start - PosDict of the initial position, current position
+              of the stack by default
+            optimize - False keeps original order (only predicts time)
+        Returns:
+            dictionary with order (indices into PosDicts), steps
+            (complete PosDicts in order), predicted step times,
+            predicted_total and original_total (s)
+        """
+        keys = sorted(set().union(*PosDicts))
+        if start is None:
+            start = self.stack.GetPos(keys)
+        positions = np.array([[start[key] for key in keys]] +
+                             [[PosDict.get(key, start[key]) for key in keys]
+                              for PosDict in PosDicts], dtype=float)
+        cost = self.cost_matrix(positions, keys)
+        groups = np.zeros(len(PosDicts), dtype=np.int64) if groups is None else np.asarray(groups)
+
+        path = [0]
+        for group in np.unique(groups):
+            nodes = np.flatnonzero(groups == group) + 1
+            if optimize:
+                segment = nearest_neighbour(cost, path[-1], nodes)
+                segment = two_opt(cost, segment)
+            else:
+                segment = [path[-1]] + list(nodes)
+            path.extend(segment[1:])
+
+        path = np.array(path)
+        predicted = cost[path[:-1], path[1:]] + self.overhead
+        original = np.arange(len(PosDicts) + 1)
+        order = path[1:] - 1
+        return {
+            "keys": keys,
+            "order": order,
+            "steps": [dict(zip(keys, positions[i].tolist())) for i in path[1:]],
+            "predicted": predicted,
+            "predicted_total": predicted.sum(),
+            "original_total": _path_cost(cost, original) + self.overhead*len(order)
+        }
+
+    def execute(self, plan, on_step=None):
+        """
+        Perform the planned steps by SMCStack.CollectiveMove.
+        Args:
+            plan - result of plan()
+            on_step - optional function(index, PosDict) called after
+              each step, index points to the original PosDicts list
+        Returns:
+            dictionary with predicted and actual move times and totals (s)
+            and times spent in on_step (acquisition, acquisition_total)
+        """
+        actual = np.zeros(len(plan["steps"]))
+        acquisition = np.zeros(len(plan["steps"]))
+        for n, (index, PosDict) in enumerate(zip(plan["order"], plan["steps"])):
+            t0 = time()
+            self.stack.CollectiveMove(PosDict)
+            t1 = time()
+            actual[n] = t1 - t0
+            if on_step is not None:
+                on_step(int(index), PosDict)
+                acquisition[n] = time() - t1
+        report = {
+            "predicted": plan["predicted"],
+            "actual": actual,
+            "acquisition": acquisition,
+            "predicted_total": plan["predicted_total"],
+            "actual_total": actual.sum(),
+            "acquisition_total": acquisition.sum()
+        }
+        print(f"ScanPlanner: {len(actual)} steps, predicted {report['predicted_total']:.2f} s, "
+              f"actual {report['actual_total']:.2f} s "
+              f"(+ {report['acquisition_total']:.2f} s in on_step)")
+        return report
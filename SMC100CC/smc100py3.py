@@ -1,5 +1,10 @@
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import numpy as np
 import serial
-from time import sleep, localtime, strftime
+from time import sleep, localtime, strftime, monotonic
 
 """
 Motor controller class for Newport SMC100cc
@@ -14,17 +19,447 @@ send_command() method.
 Examples use:
 M = SMC100CC('COM3', 1) #construct object, init serial communication
 M(45) #move to 45 deg
+
+Framed mode (responses are read until CR+LF and matched by address,
+no fixed listen delays, requests can be pipelined):
+Bus = SMC100Bus('COM3')
+M1 = SMC100CC(Bus, 1)
+M2 = SMC100CC(Bus, 2)
+f1, f2 = M1.get_pos_async(), M2.get_pos_async() #both requests sent at once
+print(f1.result(), f2.result())
+#in asyncio code: pos = await asyncio.wrap_future(M1.get_pos_async())
+Bus.close()
+
+Move time predicted locally (velocity and acceleration are read once):
+M.predict_move_time(30) #seconds, no serial traffic after first call
+M.model.validate(M) #compare with the controller's own PT estimate
+
+Cached state (every response and commanded move updates it):
+M.get_pos(max_age=0.5) #no query if position is known from last 0.5 s
+M.get_state(max_age=0.1)
+
+Move futures (resolved by one background poller when the axis is ready):
+Poller = MotionPoller()
+done = M1.move_future(30, Poller) #returns immediately
+#... acquisition meanwhile
+print(done.result()) #["33", "33 Ready from moving"]
+Poller.close()
 """
 
+RESPONSE_PATTERN = re.compile(r"^(\d{1,2})([A-Za-z]{2})(.*)$")
+
+
+def _chain(future, parser):
+    """
+    New future resolved with parser(result) of the given future.
+    Cancelling the new future cancels the original one.
+    """
+    chained = Future()
+
+    def resolve(done):
+        if chained.done():
+            return
+        try:
+            chained.set_result(parser(done.result()))
+        except Exception as exc:
+            chained.set_exception(exc)
+
+    def propagate_cancel(done):
+        if done.cancelled():
+            future.cancel()
+
+    chained.add_done_callback(propagate_cancel)
+    future.add_done_callback(resolve)
+    return chained
+
+
+def _completed(function, *args):
+    """Run function now and return its result as a completed future."""
+    future = Future()
+    try:
+        future.set_result(function(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+class MotionModel:
+    """
+    Trapezoidal velocity profile of one axis.
+
+    Move time over distance d with velocity v and acceleration a is
+    d/v + v/a, or 2*sqrt(d/a) when the axis does not reach v. The offset
+    (command latency, settling) is refined from observed move durations.
+    """
+
+    def __init__(self, velocity, acceleration, offset=0.0, gain=0.2):
+        """
+        Args:
+            velocity - deg/s (VA)
+            acceleration - deg/s^2 (AC)
+            offset - time (s) added to each move
+            gain - weight of a new observation in the offset average
+        """
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.offset = offset
+        self.gain = gain
+        self.n_observed = 0
+        self.pt_error = None
+
+    def kinematic_time(self, distance):
+        """Duration (s) of the profile, distance may be ndarray."""
+        distance = np.abs(distance)
+        v, a = self.velocity, self.acceleration
+        return np.where(distance >= v*v/a, distance/v + v/a,
+                        2*np.sqrt(distance/a))
+
+    def move_time(self, distance):
+        """Predicted move time (s) including offset, zero for zero distance."""
+        t = self.kinematic_time(distance)
+        t = np.where(np.abs(distance) > 0, t + self.offset, 0.0)
+        return float(t) if t.ndim == 0 else t
+
+    def observe(self, distance, duration):
+        """
+        Refine offset by observed duration (s) of a move over distance.
+        """
+        residual = duration - float(self.kinematic_time(distance))
+        self.offset += self.gain*(residual - self.offset)
+        self.n_observed += 1
+
+    def validate(self, motor, distances=(0.5, 2, 10, 45, 180), tolerance=0.05):
+        """
+        Compare the profile with the controller's PT answers.
+        Args:
+            motor - SMC100CC of this axis
+            distances - tested distances (deg)
+            tolerance - relative difference reported as mismatch
+        Returns:
+            list of (distance, model time, PT time)
+        """
+        result = [(d, float(self.kinematic_time(d)), motor.get_mr_time(d))
+                  for d in distances]
+        self.pt_error = max(abs(model - pt)/pt for d, model, pt in result)
+        if self.pt_error > tolerance:
+            print(f"MotionModel: {motor.label} differs from PT by {self.pt_error*100:.1f} %")
+        return result
+
+
+class MotionPoller:
+    """
+    One background thread watching moving axes and resolving their
+    futures when the controller reports a ready state.
+
+    Each axis is polled sparsely while far from its predicted arrival and
+    densely near and after it (interval is half of the remaining time,
+    limited by min_interval and max_interval). Axes on a framed bus are
+    polled in parallel. With a legacy port, do not talk to the same port
+    from another thread while the poller is busy.
+    """
+    READY = ("32", "33", "34", "35")
+    BUSY = ("28", "1E", "1F", "")  # "" - lost response, ask again
+
+    def __init__(self, min_interval=0.01, max_interval=0.25, timeout=30.0):
+        """
+        Args:
+            min_interval - shortest time (s) between polls of one axis
+            max_interval - longest time (s) between polls of one axis
+            timeout - time (s) after the predicted arrival to give up
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.watched = []  # [motor, future, t_end, t_next, t_deadline]
+        self.polls = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _interval(self, t_end, now):
+        return min(self.max_interval, max(self.min_interval, (t_end - now)/2))
+
+    def watch(self, motor, duration=None):
+        """
+        Future resolved with [state code, description] when motor is ready.
+        It fails with RuntimeError when the motor ends in another state
+        (e.g. disabled or not referenced) and with TimeoutError when it
+        moves timeout seconds longer than predicted.
+        Args:
+            motor - SMC100CC which has just been commanded to move
+            duration - predicted move time (s)
+        """
+        now = monotonic()
+        t_end = now + (0.0 if duration is None else duration)
+        future = Future()
+        entry = [motor, future, t_end, now + self._interval(t_end, now),
+                 t_end + self.timeout]
+        with self.condition:
+            self.watched.append(entry)
+            self.condition.notify()
+        return future
+
+    def _poll(self, motors):
+        """States of motors, exception instead of state on failure."""
+        futures = [motor.get_state_async() for motor in motors]
+        states = []
+        for motor, future in zip(motors, futures):
+            try:
+                states.append(future.result(motor.bus.timeout if motor.bus else None))
+            except Exception as exc:
+                future.cancel()
+                states.append(exc)
+        self.polls += len(motors)
+        return states
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.watched:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                now = monotonic()
+                t_next = min(entry[3] for entry in self.watched)
+                if t_next > now:
+                    self.condition.wait(t_next - now)
+                    continue
+                due = [entry for entry in self.watched if entry[3] <= now]
+            states = self._poll([entry[0] for entry in due])
+            now = monotonic()
+            finished = []
+            for entry, state in zip(due, states):
+                motor, future, t_end, _, t_deadline = entry
+                if future.cancelled():
+                    finished.append(entry)
+                elif isinstance(state, Exception):
+                    future.set_exception(state)
+                    finished.append(entry)
+                elif state[0] in self.READY:
+                    future.set_result(state)
+                    finished.append(entry)
+                elif state[0] in self.BUSY and now < t_deadline:
+                    entry[3] = now + self._interval(t_end, now)
+                elif state[0] in self.BUSY:
+                    future.set_exception(TimeoutError(f"{motor.label}: still {state[1]}"))
+                    finished.append(entry)
+                else:
+                    future.set_exception(RuntimeError(f"{motor.label}: {state[1]}"))
+                    finished.append(entry)
+            with self.condition:
+                for entry in finished:
+                    self.watched.remove(entry)
+
+    def close(self):
+        """Stop the thread, pending futures are cancelled."""
+        with self.condition:
+            self.running = False
+            for entry in self.watched:
+                entry[1].cancel()
+            self.watched.clear()
+            self.condition.notify()
+        self.thread.join(1)
+
+
+class SMC100Bus:
+    """
+    Framed access to SMC100 controllers sharing one serial port.
+
+    A reader thread splits incoming data at the CR+LF terminators and
+    resolves pending requests by the address and command prefix of the
+    response. Requests to several controllers can thus be sent back to
+    back and each one completes after the real serial round trip.
+
+    Responses with the same prefix are matched in order. A request
+    abandoned after timeout (cancelled future) keeps its place in the
+    queue for late_timeout seconds. The first response arriving in this
+    time is either its late response or, when it was lost, the response
+    of the next request. It is held by the next request: if another
+    response comes, the held one was late and is dropped, if the next
+    request times out without another response, it gets the held one.
+    """
+
+    def __init__(self, port, timeout=1.0, late_timeout=None):
+        """
+        Args:
+            port - name of the serial port or opened pyserial port
+            timeout - default time (s) to wait for a response
+            late_timeout - time (s) after cancelling a request during
+              which its response is still expected, 2*timeout by default
+        """
+        if isinstance(port, str):
+            self.port = serial.Serial(port, 57600, xonxoff=True, timeout=0.05)
+        else:
+            self.port = port
+            self.port.timeout = 0.05
+        self.timeout = timeout
+        self.late_timeout = 2*timeout if late_timeout is None else late_timeout
+        self.pending = {}  # (address, command): deque of [future, expiry, held]
+        self.requests = {}  # future: ((address, command), entry) until done
+        self.unmatched = 0
+        self.late = 0
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._read_loop, daemon=True)
+        self.thread.start()
+
+    def _read_loop(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = self.port.read(max(1, self.port.in_waiting))
+            except (serial.SerialException, OSError, TypeError, AttributeError):
+                break
+            if not data:
+                continue
+            buffer += data
+            while b"\r\n" in buffer:
+                line, buffer = buffer.split(b"\r\n", 1)
+                if line:
+                    self._dispatch(str(line, encoding='ascii', errors='replace'))
+
+    def _dispatch(self, line):
+        match = RESPONSE_PATTERN.match(line.strip())
+        if match is None:
+            self.unmatched += 1
+            return
+        key = (int(match.group(1)), match.group(2).upper())
+        future = None
+        now = monotonic()
+        with self.lock:
+            queue = self.pending.get(key)
+            while queue:
+                candidate, expiry, _ = queue.popleft()
+                if candidate.set_running_or_notify_cancel():
+                    future = candidate
+                    break
+                if now < expiry:
+                    # late response of the abandoned request or response
+                    # of the next one when it was lost, see wait()
+                    if queue:
+                        queue[0][2] = line + "\r\n"
+                    self.late += 1
+                    return
+                # response of the abandoned request was lost
+        if future is None:
+            self.unmatched += 1
+            return
+        future.set_result(line + "\r\n")
+
+    def _finish(self, future, entry):
+        """Done callback of a request, start expiry when cancelled."""
+        if future.cancelled():
+            entry[1] = monotonic() + self.late_timeout
+        with self.lock:
+            self.requests.pop(future, None)
+
+    def _take_held(self, future):
+        """
+        Resolve a timed out request by the response held for it, which
+        belongs to it when no other response came after. Returns True
+        when resolved.
+        """
+        with self.lock:
+            key, entry = self.requests.get(future, (None, None))
+            if entry is None or entry[2] is None:
+                return False
+            if not future.set_running_or_notify_cancel():
+                return False
+            self.pending[key].remove(entry)
+        future.set_result(entry[2])
+        return True
+
+    def _write(self, cmd):
+        self.port.write(bytes(cmd, encoding='ascii'))
+
+    def send(self, address, command, value=""):
+        """
+        Send command without response. Returns the sent string.
+        """
+        cmd = f"{int(address):02d}{command:s}{value:s}\r\n"
+        with self.lock:
+            self._write(cmd)
+        return cmd
+
+    def broadcast(self, command, value=""):
+        """
+        Send command without address (executed by all controllers).
+        """
+        cmd = f"{command:s}{value:s}\r\n"
+        with self.lock:
+            self._write(cmd)
+        return cmd
+
+    def query(self, address, command, value=""):
+        """
+        Send request and return future resolved with the response
+        string (including terminator).
+        """
+        future = Future()
+        entry = [future, float("inf"), None]
+        key = (int(address), command.upper())
+        cmd = f"{int(address):02d}{command:s}{value:s}\r\n"
+        now = monotonic()
+        with self.lock:
+            queue = self.pending.setdefault(key, deque())
+            # drop abandoned requests whose response will not come
+            while queue and queue[0][0].cancelled() and queue[0][1] <= now:
+                queue.popleft()
+            queue.append(entry)
+            self.requests[future] = (key, entry)
+            self._write(cmd)
+        future.add_done_callback(lambda done: self._finish(done, entry))
+        return future
+
+    def wait(self, future, timeout=None):
+        """
+        Result of the future, abandon the request when it times out.
+        """
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            if self._take_held(future) or not future.cancel():
+                # the response was held or arrived meanwhile
+                return future.result()
+            raise
+
+    def close(self):
+        """Stop the reader, fail pending requests and close the port."""
+        self.running = False
+        self.thread.join(1)
+        with self.lock:
+            futures = [future for queue in self.pending.values() for future, *_ in queue]
+            self.pending.clear()
+        # outside the lock, done callbacks take it
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError("SMC100Bus closed."))
+        self.port.close()
+
 
 class SMC100CC:
     port = None
+    bus = None
     address = None
     label = None
     DEBUG = False
     pos = None
     state = None
     correction = 0.0
+    model = None
+    firmware = None  # VE response, identifies the controller in SMCStack state file
+    # cache: monotonic times of the last TS and TP information
+    max_age = 1.0  # s, staleness accepted by __call__ and move_abs_noblock
+    state_time = float("-inf")
+    pos_time = float("-inf")  # in the future while a commanded move lasts
+    move_end = float("-inf")
+    move_start = float("-inf")
+    move_target = None
+    move_seen = False  # "28 Moving" read since the last move command
+    moving = False
+    dT = 0.02  # s, READY read sooner after a move command may predate it
+    configured = None
     state_code_table = {"0A": "0A Not referenced from reset",
                         "0B": "0B Not referenced from homing",
                         "0C": "0C not referenced from config",
@@ -51,11 +486,22 @@ class SMC100CC:
     # *** Methods *** (aka functions)
     # **Special methods**
 
-    def __init__(self, port, address=1, label=None, correction=0.0):
+    def __init__(self, port, address=1, label=None, correction=0.0, framed=False, query=True):
         # Takes name of port or already created ports
         # If input parameter is string, use it as port address.
         # If given parameter is instance of pyserial.serial (port), assign it as motor port.
-        if isinstance(port, str):
+        # If given parameter is SMC100Bus, use the framed mode.
+        # If framed is True, the string port is opened as SMC100Bus.
+        # If query is False, state and position are not read (SMCStack reads them in batch).
+        self.owns_bus = False
+        if isinstance(port, SMC100Bus):
+            self.bus = port
+            self.port = port.port
+        elif isinstance(port, str) and framed:
+            self.bus = SMC100Bus(port)
+            self.port = self.bus.port
+            self.owns_bus = True
+        elif isinstance(port, str):
             # Create connection
             self.port = serial.Serial(port, 57600, xonxoff=True, timeout=0)
             # baudrate = 57 600 bit/s, data bits - 8, parity = none, stopbits = 1, term = cr+lf
@@ -64,6 +510,9 @@ class SMC100CC:
         # Set address.
         self.address = f"{address:02d}"
         self.label = f"Motor{address:02d}" if label == None else label
+        self.correction = correction
+        if not query:
+            return
 
         try:
             self.get_state()
@@ -71,7 +520,6 @@ class SMC100CC:
         except:
             self.state = "0A Not referenced from reset"
 
-        self.correction = correction
         try:
             self.get_pos()
         except:
@@ -81,16 +529,21 @@ class SMC100CC:
     def __del__(self):
         if self.DEBUG:
             print("Closing port.")
-        self.port.close()  # Close port
+        if self.bus is None:
+            self.port.close()  # Close port
+        elif self.owns_bus:
+            self.bus.close()
 
     def __call__(self, pos):
         """
         Send motor to given position plus its offset (degrees).
         Returns True is command succeeded.
         """
+        if self.moving and self.move_target == pos:
+            return True  # already on the way
+        self.get_pos(self.max_age)
         if not (self.pos == pos):
             self.move_abs_noblock(pos+self.correction)
-            self.pos = pos
         return True
 
     def __str__(self):
@@ -111,10 +564,13 @@ class SMC100CC:
         Send command to motor. Terminators are already included.
         command and value are strings.
         """
-        cmd = f"{self.address:s}{command:s}{value:s}\r\n"
+        if self.bus is not None:
+            cmd = self.bus.send(self.address, command, value)
+        else:
+            cmd = f"{self.address:s}{command:s}{value:s}\r\n"
+            self.port.write(bytes(cmd, encoding='ascii'))
         if self.DEBUG:
             print(self.label, "SC:", cmd)
-        self.port.write(bytes(cmd, encoding='ascii'))
         return cmd
 
     # Send command to port and wait a while (time), the return response
@@ -122,7 +578,15 @@ class SMC100CC:
         """
         Send command to motor and wait (time) for response, which
         is returned with command in a list.
+        In the framed mode, time is not used, the response is returned
+        as soon as it arrives.
         """
+        if self.bus is not None:
+            future = self.bus.query(self.address, command, value)
+            response = self.bus.wait(future)
+            if self.DEBUG:
+                print(self.label, "SCL:", response)
+            return [response, f"{self.address:s}{command:s}{value:s}\r\n"]
         cmd = self.send_command(command, value)
         sleep(time)
         #response = str(self.port.read(20), encoding='ascii')
@@ -134,16 +598,105 @@ class SMC100CC:
     # **Main methods**
     # Get position of motor.
 
-    def get_pos(self):
-        """Get position of motor."""
-        x = (self.send_command_listen("TP", "", 0.1))
-        if len(str(self.address)) == 1:
-            x = float(x[0][3:-2])
-        if len(str(self.address)) == 2:
-            x = float(x[0][4:-2])
+    @staticmethod
+    def response_value(response):
+        """
+        Strip address, command and terminator from the response.
+        Returns "" for invalid response.
+        """
+        match = RESPONSE_PATTERN.match(response.strip())
+        if match is None:
+            return ""
+        return match.group(3)
+
+    def _parse_pos(self, response):
+        x = float(self.response_value(response))
         self.pos = x - self.correction
+        self.pos_time = monotonic()
         return x
 
+    def _parse_state(self, response):
+        state_code = self.response_value(response)[-2:]  # two last chars of string
+        state_descr = self.state_code_table[state_code]
+        now = monotonic()
+        if self.moving and state_code == "28":
+            self.move_seen = True
+        elif self.moving and state_code in MotionPoller.READY:
+            if not self.move_seen and now - self.move_start < self.dT:
+                # may be answered before the move started, keep the prediction
+                return [state_code, state_descr]
+            # commanded move finished, position equals its target
+            self.moving = False
+            self.pos = self.move_target
+            self.pos_time = now
+        self.state = state_descr
+        self.state_time = now
+        return [state_code, state_descr]
+
+    def _state_fresh(self, max_age):
+        now = monotonic()
+        if max_age is None or now - self.state_time > max_age or self.state is None:
+            return False
+        # predicted moving state expires at predicted arrival
+        return not (self.state == "28 Moving" and now >= self.move_end)
+
+    def _pos_fresh(self, max_age):
+        # the target of a commanded move is trusted only after READY was read
+        return (max_age is not None and not self.moving
+                and 0 <= monotonic() - self.pos_time <= max_age)
+
+    def _cached_state(self):
+        code = [key for key, descr in self.state_code_table.items() if descr == self.state]
+        return [code[0] if code else "", self.state]
+
+    def mark_moving(self, x):
+        """
+        Update the cache after a move to x (degrees, without correction)
+        was commanded: state is "28 Moving" until the predicted arrival,
+        from which the position is expected to be x. The position is
+        used as cached only after a ready state was read.
+        """
+        duration = 0.0
+        if self.pos is not None:
+            duration = self.predict_move_time(x - self.correction - self.pos)
+        now = monotonic()
+        self.state = "28 Moving"
+        self.state_time = now
+        self.move_start = now
+        self.move_end = now + duration
+        self.pos = self.move_target = float(x) - self.correction
+        self.pos_time = self.move_end
+        self.move_seen = False
+        self.moving = True
+        return duration
+
+    def _query_async(self, command, value, time, parser):
+        """
+        Future of parsed response. In the framed mode it is resolved by
+        the bus reader, otherwise the query is done now (blocking).
+        """
+        if self.bus is None:
+            return _completed(
+                lambda: parser(self.send_command_listen(command, value, time)[0]))
+        return _chain(self.bus.query(self.address, command, value), parser)
+
+    def get_pos(self, max_age=None):
+        """
+        Get position of motor.
+        If max_age (s) is given, position known not longer than max_age
+        ago is returned without query.
+        """
+        if self._pos_fresh(max_age):
+            return self.pos + self.correction
+        x = (self.send_command_listen("TP", "", 0.1))
+        return self._parse_pos(x[0])
+
+    def get_pos_async(self, max_age=None):
+        """Future of get_pos()."""
+        if self._pos_fresh(max_age):
+            return _completed(lambda: self.pos + self.correction)
+        return self._query_async("TP", "", 0.1, self._parse_pos)
+
     # Get relative move time estimation.
     def get_mr_time(self, x):
         """"
@@ -155,26 +708,56 @@ class SMC100CC:
             return 0.1
 
         x = (self.send_command_listen("PT", str(x), 0.1))
-        if len(str(self.address)) == 1:
-            x = float(x[0][3:-2])
-        if len(str(self.address)) == 2:
-            x = float(x[0][4:-2])
-        return x
+        return float(self.response_value(x[0]))
+
+    def get_kinematics(self):
+        """
+        Read velocity (VA) and acceleration (AC) of the controller
+        and cache them in the motion model.
+        Returns:
+            MotionModel
+        """
+        v = float(self.response_value(self.send_command_listen("VA", "?", 0.1)[0]))
+        a = float(self.response_value(self.send_command_listen("AC", "?", 0.1)[0]))
+        if self.model is None:
+            self.model = MotionModel(v, a)
+        else:
+            self.model.velocity, self.model.acceleration = v, a
+        return self.model
+
+    def predict_move_time(self, x):
+        """
+        Move time (s) over distance x predicted by the cached motion model.
+        Only the first call communicates with the controller.
+        """
+        if self.model is None:
+            self.get_kinematics()
+        return self.model.move_time(x)
+
+    def get_mr_time_async(self, x):
+        """Future of get_mr_time(x)."""
+        if abs(x) < 0.1:
+            return _completed(lambda: 0.1)
+        return self._query_async(
+            "PT", str(x), 0.1, lambda response: float(self.response_value(response)))
 
     # Get state code and state name
-    def get_state(self):
+    def get_state(self, max_age=None):
         """
         Ask about controllers state.
+        If max_age (s) is given, state known not longer than max_age
+        ago is returned without query.
         """
+        if self._state_fresh(max_age):
+            return self._cached_state()
         result = (self.send_command_listen("TS", "", 0.05))[0]
-        if len(str(self.address)) == 1:
-            state_code = result[7:-2]  # two last chars of string
-        if len(str(self.address)) == 2:
-            state_code = result[8:-2]  # two last chars of string
-        # state_code = "" #test
-        state_descr = self.state_code_table[state_code]
-        self.state = state_descr
-        return [state_code, state_descr]
+        return self._parse_state(result)
+
+    def get_state_async(self, max_age=None):
+        """Future of get_state()."""
+        if self._state_fresh(max_age):
+            return _completed(self._cached_state)
+        return self._query_async("TS", "", 0.05, self._parse_state)
 
     def reset(self):
         """
@@ -225,15 +808,17 @@ class SMC100CC:
         Stop motors, even when moving.
         """
         self.send_command("ST", "")
+        self.moving = False
         sleep(0.1)
-        self.pos = self.get_pos()-self.correction
+        self.get_pos()
         return (self.get_state())[1]
 
-    def move_abs_noblock(self, x):
+    def move_abs_noblock(self, x, max_age=None):
         """
         Execute absolute movement to position x (degrees) but without blocking the program.
+        The state before the move may be max_age (s) old, self.max_age by default.
         """
-        self.get_state()
+        self.get_state(self.max_age if max_age is None else max_age)
         if not(self.state == "28 Moving"):
             if self.DEBUG == True:
                 print("--- \n")
@@ -241,9 +826,47 @@ class SMC100CC:
                 print("Moving motor", self.label, " to position:", str(x))
                 print("Without program freeze")
             self.send_command("PA", str(x))  # Position absolute
-            sleep(0.017)
-            self.get_state()
+            self.mark_moving(x)
             return True
         else:
             print("Error ... moving")
             return False
+
+    def move_abs_async(self, x):
+        """
+        Send absolute move to position x (degrees, without correction).
+        Returns future of the controller state right after the command,
+        i.e. ["28", "28 Moving"] when the move was accepted.
+        """
+        self.send_command("PA", str(x))
+        self.mark_moving(x)
+        return self.get_state_async()
+
+    def configure_move(self, pos):
+        """
+        Preload move to given position plus its offset (degrees), the
+        motion starts with "SE" sent without address to all controllers
+        (see SMCStack.StartConfigured()).
+        """
+        self.send_command("SE", str(pos + self.correction))
+        self.configured = pos + self.correction
+
+    def move_future(self, pos, poller):
+        """
+        Send motor to given position plus its offset (degrees) without
+        blocking. Returns future resolved by the MotionPoller when the
+        motor is ready, see MotionPoller.watch().
+        """
+        self.send_command("PA", str(pos + self.correction))
+        duration = self.mark_moving(pos + self.correction)
+        return poller.watch(self, duration)
+
+    def move_rel_async(self, dx):
+        """
+        Send relative move by dx (degrees).
+        Returns future of the controller state right after the command.
+        """
+        self.send_command("PR", str(dx))
+        if self.pos is not None:
+            self.mark_moving(self.pos + self.correction + dx)
+        return self.get_state_async()
@@ -0,0 +1,287 @@
+import os
+import re
+import threading
+import tty
+from time import sleep, monotonic
+
+"""
+Simulator of Newport SMC100CC controllers on a pseudo-terminal.
+
+It makes it possible to run smc100py3.py and smcStack.py code without
+the real hardware (Linux only). Several controllers share one line like
+on the RS-485 daisy chain. Implemented commands:
+TP, TS, PT, PA, PR, OR, RS, MM, ST, VA, AC, VE, ID, SE, TE.
+Motion follows trapezoidal velocity profile.
+
+Example:
+    Sim = SMC100Simulator([1, 2, 3], latency=0.002)
+    Ms = SMCStack(Sim.port_name, {1: (1, None, 0), 2: (2, None, 0)}, 1)
+    ...
+    Ms.Close()
+    Sim.close()
+"""
+
+READY_STATES = ("32", "33", "34", "35")
+
+
+class SimulatedAxis():
+    """
+    State and kinematics of one simulated controller.
+    """
+
+    def __init__(self, address, velocity=20.0, acceleration=80.0,
+                 position=0.0, state="0A", stage_id="SR50CC_SIM", firmware="SMC_CC simulator 1.0"):
+        self.address = address
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.state = state
+        self.stage_id = stage_id
+        self.firmware = firmware
+        self.start_pos = position
+        self.target = position
+        self.t_start = monotonic()
+        self.duration = 0.0
+        self.configured_target = None
+        self.error = "@"
+
+    def move_time(self, distance):
+        """Duration of trapezoidal move over distance."""
+        distance = abs(distance)
+        v, a = self.velocity, self.acceleration
+        if distance >= v*v/a:
+            return distance/v + v/a
+        return 2*(distance/a)**0.5
+
+    def position(self, now=None):
+        """Current position from the motion profile."""
+        now = monotonic() if now is None else now
+        t = now - self.t_start
+        if t >= self.duration:
+            return self.target
+        distance = self.target - self.start_pos
+        sign = 1.0 if distance >= 0 else -1.0
+        v, a = self.velocity, self.acceleration
+        t_acc = min(v/a, self.duration/2)
+        v_peak = a*t_acc
+        if t < t_acc:
+            travelled = 0.5*a*t*t
+        elif t < self.duration - t_acc:
+            travelled = 0.5*a*t_acc*t_acc + v_peak*(t - t_acc)
+        else:
+            t_left = self.duration - t
+            travelled = abs(distance) - 0.5*a*t_left*t_left
+        return self.start_pos + sign*travelled
+
+    def update(self, now=None):
+        """Finish motion or homing when its time has elapsed."""
+        now = monotonic() if now is None else now
+        if self.state in ("28", "1E") and now - self.t_start >= self.duration:
+            self.state = "33" if self.state == "28" else "32"
+
+    def start_move(self, target, state="28"):
+        now = monotonic()
+        self.start_pos = self.position(now)
+        self.target = target
+        self.t_start = now
+        self.duration = self.move_time(target - self.start_pos)
+        self.state = state
+
+
+class SMC100Simulator():
+    """
+    Pseudo-terminal answering the SMC100 ASCII protocol for several
+    addresses. Open port_name with pyserial like a real COM port.
+    """
+    LINE = re.compile(r"^(\d{0,2})([A-Za-z]{2})(.*)$")
+
+    def __init__(self, addresses=(1,), latency=0.002, home_time=1.0,
+                 axis_kwargs=None):
+        """
+        Args:
+            addresses : controller addresses on the line
+            latency : delay (s) before each response
+            home_time : duration (s) of homing
+            axis_kwargs : optional dict address: kwargs of SimulatedAxis
+        """
+        axis_kwargs = {} if axis_kwargs is None else axis_kwargs
+        self.axes = {addr: SimulatedAxis(addr, **axis_kwargs.get(addr, {}))
+                     for addr in addresses}
+        self.latency = latency
+        self.home_time = home_time
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+        self.lock = threading.Lock()
+        self.running = True
+        self.received = 0
+        self.reply_delays = {}  # (address, command): list of extra delays
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def delay_reply(self, address, command, delay):
+        """
+        Delay the next response of address to command by delay (s)
+        on top of the latency, None drops the response. The line is
+        blocked meanwhile, like by a slow controller.
+        """
+        with self.lock:
+            self.reply_delays.setdefault((int(address), command.upper()), []).append(delay)
+
+    def _reply_delay(self, line):
+        """Extra delay of the response to line, None to drop it."""
+        match = self.LINE.match(line.strip())
+        if match is None or match.group(1) == "":
+            return 0.0
+        with self.lock:
+            delays = self.reply_delays.get((int(match.group(1)), match.group(2).upper()))
+            return delays.pop(0) if delays else 0.0
+
+    def close(self):
+        self.running = False
+        try:
+            os.write(self.slave, b"\r\n")
+        except OSError:
+            pass
+        self.thread.join(1)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _serve(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            buffer += data
+            while b"\r\n" in buffer:
+                line, buffer = buffer.split(b"\r\n", 1)
+                if not line:
+                    continue
+                self.received += 1
+                line = line.decode("ascii", "replace")
+                response = self.handle(line)
+                if response is not None:
+                    delay = self._reply_delay(line)
+                    if delay is None:
+                        continue
+                    if self.latency + delay > 0:
+                        sleep(self.latency + delay)
+                    os.write(self.master, response.encode("ascii") + b"\r\n")
+
+    def handle(self, line):
+        """
+        Execute one command line.
+        Returns:
+            response string without terminator or None
+        """
+        match = self.LINE.match(line.strip())
+        if match is None:
+            return None
+        addr_str, command, value = match.groups()
+        command = command.upper()
+        with self.lock:
+            if addr_str == "":
+                if command == "SE":
+                    # start all configured moves at once
+                    for axis in self.axes.values():
+                        if axis.configured_target is not None:
+                            axis.update()
+                            axis.start_move(axis.configured_target)
+                            axis.configured_target = None
+                return None
+            axis = self.axes.get(int(addr_str))
+            if axis is None:
+                return None
+            axis.update()
+            prefix = f"{addr_str}{command}"
+            if command == "TP":
+                return f"{prefix}{axis.position():.6f}"
+            if command == "TS":
+                return f"{prefix}0000{axis.state}"
+            if command == "TE":
+                error, axis.error = axis.error, "@"
+                return f"{prefix}{error}"
+            if command == "PT":
+                return f"{prefix}{axis.move_time(float(value)):.6f}"
+            if command == "VE":
+                return f"{prefix} {axis.firmware}"
+            if command == "ID":
+                return f"{prefix}{axis.stage_id}"
+            if command in ("VA", "AC"):
+                attr = "velocity" if command == "VA" else "acceleration"
+                if value == "?":
+                    return f"{prefix}{getattr(axis, attr):g}"
+                setattr(axis, attr, float(value))
+                return None
+            if command in ("PA", "PR"):
+                if axis.state in READY_STATES + ("28",):
+                    target = float(value)
+                    if command == "PR":
+                        target += axis.target
+                    axis.start_move(target)
+                else:
+                    axis.error = "H"
+                return None
+            if command == "SE":
+                if axis.state in READY_STATES:
+                    axis.configured_target = float(value)
+                else:
+                    axis.error = "H"
+                return None
+            if command == "OR":
+                if axis.state.startswith("0"):
+                    axis.start_move(0.0, "1E")
+                    axis.duration = self.home_time
+                return None
+            if command == "RS":
+                axis.__init__(axis.address, axis.velocity, axis.acceleration,
+                              axis.position(), "0A", axis.stage_id, axis.firmware)
+                return None
+            if command == "MM":
+                if value == "0" and axis.state in READY_STATES:
+                    axis.state = "3C"
+                elif value == "1" and axis.state.startswith("3C"):
+                    axis.state = "34"
+                return None
+            if command == "ST":
+                if axis.state == "28":
+                    now = monotonic()
+                    axis.target = axis.position(now)
+                    axis.start_pos = axis.target
+                    axis.duration = 0.0
+                    axis.state = "33"
+                return None
+        return None
+
+
+if __name__ == "__main__":
+    # benchmark of the drivers against the simulator
+    from time import perf_counter
+    from smcStack import SMCStack
+
+    Sim = SMC100Simulator([1, 2, 3, 4, 5, 6], latency=0.002, home_time=0.2)
+    ConstructionDict = {key: (key, None, 0) for key in range(1, 7)}
+    for framed in (False, True):
+        Ms = SMCStack(Sim.port_name, ConstructionDict, 1, framed=framed)
+        t0 = perf_counter()
+        for _ in range(10):
+            Ms[1].get_pos()
+        t_single = (perf_counter() - t0)/10
+        t0 = perf_counter()
+        for _ in range(10):
+            Ms.GetPos()
+        t_stack = (perf_counter() - t0)/10
+        for key in Ms.Motors:
+            Ms[key].home()
+        sleep(0.3)
+        t0 = perf_counter()
+        Ms({1: 10, 2: 20, 3: 30})
+        t_move = perf_counter() - t0
+        print(f"framed={framed}: get_pos {t_single*1e3:.1f} ms, "
+              f"stack GetPos {t_stack*1e3:.1f} ms, CollectiveMove {t_move:.3f} s "
+              f"(motion {Ms[3].get_mr_time(30):.3f} s)")
+        Ms({1: 0, 2: 0, 3: 0})
+        Ms.Close()
+    Sim.close()
@@ -1,6 +1,8 @@
-import serial
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from time import sleep, localtime, strftime, time
-from smc100py3 import SMC100CC
+from smc100py3 import SMC100CC, SMC100Bus, MotionModel, MotionPoller, RESPONSE_PATTERN
 
 """
 Controller class for stack of SMC100CC drivers.
@@ -19,37 +21,161 @@ Example:
     #...
     Ms.Close() #close port at the end
 
+    Ms = SMCStack('COM3', ConstructionDict, 1, framed=True) #framed mode
+    print(Ms.GetPos(), Ms.GetStates()) #whole stack polled in one round trip
+    Done = Ms.MoveAsync({1: 20, 2: 30}) #dictionary of futures
+    Done[1].result() #wait only for motor 1
+    Ms.CollectiveMove({1: 0, 2: 0}, simultaneous=True) #axes start together
+
+    #state file keeps firmware versions, last positions and motion models
+    #between sessions, reconnecting to unchanged rig needs only batched VE
+    Ms = SMCStack('COM3', ConstructionDict, 1, framed=True, state_file="stack.json")
+
+    #motors on several serial chains, each port served by its own thread
+    MultiDict = {
+        1 : ('COM3', 1, None, 0),
+        2 : ('COM3', 2, None, 0),
+        3 : ('COM4', 1, "My motor", 0)
+    }
+    Ms = SMCMultiStack(MultiDict, framed=True)
+    Ms({1: 20, 3: 30}) #both chains move concurrently
+    Ms.Close()
 
 """
 
 
 class SMCStack():
     dT = 0.02
+    PollTimeout = 0.5  # s, waiting for responses of batched poll
+    Retries = 2  # repeated polls of motors whose response was lost
+    MaxAge = 1.0  # s, accepted age of cached positions in CollectiveMove
     DEBUG = False
+    bus = None
+    Poller = None
 
-    def __init__(self, port, ConstructionDict, MasterKey=None):
+    def __init__(self, port, ConstructionDict, MasterKey=None, framed=False, poller=None,
+                 state_file=None):
         """
         Args:
-            port - string path to used serial port
+            port - string path to used serial port or SMC100Bus
             ConstructionDict - dictionary with keys, addresses, labels and correction
             MasterKey - selected key to be the constructed first, if none, first from keys is selected
+            framed - open the port as SMC100Bus (responses read until CR+LF)
+            poller - shared MotionPoller for MoveAsync, own one is created if None
+            state_file - JSON file with last known state of the stack, see Startup()
         """
         self.Motors = {}
+        self.state_file = state_file
+        self.Poller = poller
+        self.owns_poller = poller is None
         if not(MasterKey in ConstructionDict.keys()):
             MasterKey = sorted(ConstructionDict.keys())[0]
+        if isinstance(port, SMC100Bus):
+            self.bus = port
+        elif framed:
+            self.bus = SMC100Bus(port)
+        if self.bus is not None:
+            port = self.bus
 
         # Init first motor
-        self.Motors[MasterKey] = SMC100CC(port, *ConstructionDict[MasterKey])
+        self.Motors[MasterKey] = SMC100CC(port, *ConstructionDict[MasterKey], query=False)
         self.Motors[MasterKey].DEBUG = self.DEBUG
         self.port = self.Motors[MasterKey].port
-        sleep(self.dT)
 
         # Init remaining motors
         for key in sorted([key for key in ConstructionDict if key != MasterKey]):
             addr, label, corr = ConstructionDict[key]
-            self.Motors[key] = SMC100CC(self.port, addr, label, corr)
+            self.Motors[key] = SMC100CC(port if self.bus else self.port, addr, label, corr,
+                                        query=False)
             self.Motors[key].DEBUG = self.DEBUG
 
+        self.Startup()
+
+    def Startup(self):
+        """
+        Discover the motors in batched exchanges.
+
+        With a state file, one batched VE query validates its entries.
+        When the address and firmware version of a motor match, its last
+        known state, position and motion model are taken from the file
+        without further queries. They are not considered fresh, so the
+        first get_state() or get_pos() with max_age reads them again.
+        States and positions of the other motors are read in one batched
+        exchange each, a silent motor is left "0A Not referenced from
+        reset" like in SMC100CC.__init__(). The state file is rewritten
+        afterwards.
+        Returns:
+            list of keys whose cached entry was missing or invalid
+        """
+        keys = sorted(self.Motors.keys())
+        Cache = {}
+        if self.state_file is not None and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    Cache = json.load(f)["motors"]
+            except (ValueError, KeyError, OSError):
+                print(f"SMCStack: ignoring invalid state file {self.state_file}")
+
+        Invalid = keys
+        if self.state_file is not None:
+            for key, response in self._query_all("VE", keys).items():
+                self.Motors[key].firmware = SMC100CC.response_value(response).strip() or None
+            Invalid = []
+            for key in keys:
+                motor = self.Motors[key]
+                entry = Cache.get(str(key))
+                if (entry is None or motor.firmware is None
+                        or entry.get("address") != motor.address
+                        or entry.get("firmware") != motor.firmware):
+                    Invalid.append(key)
+                    continue
+                motor.state = entry["state"]
+                motor.pos = entry["pos"]
+                if entry["velocity"] is not None:
+                    motor.model = MotionModel(entry["velocity"], entry["acceleration"],
+                                              entry["offset"])
+
+        for key, state in self._poll_states(Invalid).items():
+            if state[0] == "":
+                self.Motors[key].state = "0A Not referenced from reset"
+        self._poll_positions(Invalid)
+
+        if self.state_file is not None:
+            Present = [key for key in Invalid if self.Motors[key].firmware is not None]
+            Velocity = self._query_all("VA", Present, "?")
+            Acceleration = self._query_all("AC", Present, "?")
+            for key in Present:
+                try:
+                    self.Motors[key].model = MotionModel(
+                        float(SMC100CC.response_value(Velocity[key])),
+                        float(SMC100CC.response_value(Acceleration[key])))
+                except ValueError:
+                    pass  # read later by predict_move_time()
+            self.SaveState()
+        return Invalid
+
+    def SaveState(self):
+        """
+        Write last known states, positions, firmware versions and motion
+        models to the state file.
+        """
+        if self.state_file is None:
+            return
+        Motors = {}
+        for key, motor in self.Motors.items():
+            Motors[str(key)] = {
+                "address": motor.address,
+                "firmware": motor.firmware,
+                "state": motor.state,
+                "pos": motor.pos,
+                "velocity": motor.model.velocity if motor.model else None,
+                "acceleration": motor.model.acceleration if motor.model else None,
+                "offset": motor.model.offset if motor.model else 0.0
+            }
+        with open(self.state_file, "w") as f:
+            json.dump({"time": strftime("%Y-%m-%d %H:%M:%S", localtime()),
+                       "motors": Motors}, f, indent=1)
+
     def __call__(self, PosDict):
         """
         Perform CollectiveMode().
@@ -57,65 +183,239 @@ class SMCStack():
         self.CollectiveMove(PosDict)
 
     def __del__(self):
-        self.port.close()
+        self.Close()
 
     def __getitem__(self, key):
         return self.Motors.get(key, None)
 
-    def GetPos(self, keys=None):
+    def _query_all(self, command, keys, value=""):
+        """
+        Send command to all selected motors back to back and collect
+        the responses by address (one round trip for the whole stack).
+        Returns:
+            dictionary key: response string ("" if not received)
+        """
+        motors = {key: self.Motors[key] for key in keys if key in self.Motors}
+        if not motors:
+            return {}
+        if self.bus is not None:
+            futures = {key: self.bus.query(motor.address, command, value)
+                       for key, motor in motors.items()}
+            responses = {}
+            for key, future in futures.items():
+                try:
+                    responses[key] = self.bus.wait(future, self.PollTimeout)
+                except FutureTimeoutError:
+                    responses[key] = ""
+            return responses
+
+        by_address = {int(motor.address): key for key, motor in motors.items()}
+        responses = {key: "" for key in motors}
+        self.port.read(self.port.inWaiting())  # drop stale input
+        cmd = "".join(f"{motor.address:s}{command:s}{value:s}\r\n" for motor in motors.values())
+        self.port.write(bytes(cmd, encoding='ascii'))
+        buffer = ""
+        missing = set(by_address)
+        t0 = time()
+        while missing and time()-t0 < self.PollTimeout:
+            sleep(self.dT/4)
+            buffer += str(self.port.read(self.port.inWaiting()), encoding='ascii')
+            lines = buffer.split("\r\n")
+            buffer = lines.pop()  # incomplete line
+            for line in lines:
+                match = RESPONSE_PATTERN.match(line.strip())
+                if match is None or match.group(2).upper() != command:
+                    continue
+                address = int(match.group(1))
+                if address in missing:
+                    responses[by_address[address]] = line + "\r\n"
+                    missing.discard(address)
+        if self.DEBUG:
+            print("SMCStack poll:", responses)
+        return responses
+
+    def MoveAsync(self, PosDict):
+        """
+        Start absolute moves without blocking.
+        Args:
+            PosDict: dictionary of key: absolute position (deg)
+        Returns:
+            dictionary key: future resolved when the motor is ready
+        """
+        if self.Poller is None:
+            self.Poller = MotionPoller()
+        keys = [key for key in PosDict if key in self.Motors]
+        for key in keys:
+            # read motion models before the poller starts using the port
+            self.Motors[key].predict_move_time(0)
+        return {key: self.Motors[key].move_future(PosDict[key], self.Poller)
+                for key in keys}
+
+    def GetPos(self, keys=None, max_age=None):
+        """
+        Positions of selected motors (all by default) polled at once.
+        Positions known not longer than max_age (s) ago are not polled.
+        Returns:
+            dictionary key: position (deg)
+        """
         Position = {}
         if keys == None:
             keys = sorted(self.Motors.keys())
+        keys = [key for key in keys if key in self.Motors]
+        if max_age is not None:
+            for key in keys:
+                if self.Motors[key]._pos_fresh(max_age):
+                    Position[key] = self.Motors[key].pos + self.Motors[key].correction
+            keys = [key for key in keys if key not in Position]
 
-        for key in self.Motors:
-            if key in self.Motors:
+        for key, response in self._query_all("TP", keys).items():
+            try:
+                Position[key] = self.Motors[key]._parse_pos(response)
+            except ValueError:
+                # lost in the batch, ask again alone
                 Position[key] = self.Motors[key].get_pos()
-                sleep(self.dT)
 
         return Position
 
-    def Home(self, keys=None):
+    def _poll_states(self, keys):
+        """
+        States of motors polled at once, the motors whose response was
+        lost are polled again up to Retries times.
+        Returns:
+            dictionary key: [state code, state description], code is ""
+            for the motors which did not answer
+        """
+        States = {}
+        missing = [key for key in keys if key in self.Motors]
+        for _ in range(self.Retries + 1):
+            if not missing:
+                break
+            for key, response in self._query_all("TS", missing).items():
+                if SMC100CC.response_value(response) != "":
+                    States[key] = self.Motors[key]._parse_state(response)
+            missing = [key for key in missing if key not in States]
+        for key in missing:
+            States[key] = ["", SMC100CC.state_code_table[""]]
+        return States
+
+    def _poll_positions(self, keys):
+        """
+        Positions of motors polled at once, silent motors are left out.
+        Returns:
+            dictionary key: position (deg)
+        """
+        Position = {}
+        for key, response in self._query_all("TP", keys).items():
+            try:
+                Position[key] = self.Motors[key]._parse_pos(response)
+            except ValueError:
+                pass
+        return Position
+
+    def GetStates(self, keys=None):
         """
-        Untested collective home.
+        States of selected motors (all by default) polled at once.
+        Returns:
+            dictionary key: [state code, state description]
+        Raises:
+            TimeoutError when a motor does not answer after Retries polls
         """
         if keys == None:
-            keys = self.Motors.keys()
+            keys = sorted(self.Motors.keys())
+        States = self._poll_states(keys)
+        missing = [self.Motors[key].label for key, state in States.items() if state[0] == ""]
+        if missing:
+            raise TimeoutError(f"SMCStack: no state response from {', '.join(missing)}")
+        return States
+
+    def Home(self, keys=None, timeout=60.0):
+        """
+        Home selected motors (all by default) concurrently: send OR to
+        all of them and poll their states together until ready.
+        Args:
+            keys: list with keys to selected motors
+            timeout: seconds per axis, number or dictionary key: seconds
+        Returns:
+            dictionary key: last state description of the failed motors
+            (empty if all motors are ready)
+        """
+        if keys == None:
+            keys = sorted(self.Motors.keys())
+        keys = [key for key in keys if key in self.Motors]
+        if not isinstance(timeout, dict):
+            timeout = {key: timeout for key in keys}
         for key in keys:
-            if key in self.Motors.keys():
-                self.Motors[key].home()
+            self.Motors[key].send_command("OR", "")
+
+        t0 = time()
+        pending = set(keys)
+        Failed = {}
+        while pending:
+            sleep(5*self.dT)
+            # silent motors keep homing state "" until their timeout
+            for key, state in self._poll_states(sorted(pending)).items():
+                if state[0] in MotionPoller.READY:
+                    self.Motors[key].pos = 0 - self.Motors[key].correction
+                    pending.discard(key)
+                elif state[0] in ("1E", "1F", "") or state[0].startswith("0"):
+                    if time()-t0 > timeout.get(key, 60.0):
+                        Failed[key] = state[1]
+                        pending.discard(key)
+                else:
+                    Failed[key] = state[1]
+                    pending.discard(key)
+
+        for key, state in Failed.items():
+            print(f"Homing of {self.Motors[key].label} failed: {state}")
+        return Failed
 
     def WaitForMovement(self, keys):
         """
         Wait for selected motor to finish movement.
         Args:
             keys: list with keys to selected motor
+        Returns:
+            estimated time (time()) of arrival, middle between the last
+            poll with a moving motor (or the call) and the first poll
+            with all motors stopped
         """
 
-        is_moving = []
         t0 = time()
-        for key in keys:
-            sleep(self.dT)
-            val = self.Motors[key].get_state()[0] == "28"
-            is_moving.append(val)
+        t_moving = t0
+        t_poll = time()
+        is_moving = [state[0] == "28" for state in self.GetStates(keys).values()]
+        t_poll = (t_poll + time())/2
 
         while any(is_moving) and time()-t0 < 100:
+            t_moving = t_poll
             sleep(self.dT)
-            is_moving = []
-            for key in keys:
-                val = self.Motors[key].get_state()[0] == "28"
-                sleep(self.dT)
-                is_moving.append(val)
+            t_poll = time()
+            is_moving = [state[0] == "28" for state in self.GetStates(keys).values()]
+            t_poll = (t_poll + time())/2
+        return (t_moving + t_poll)/2
 
-    def CollectiveMove(self, PosDict):
+    def StartConfigured(self):
+        """
+        Start all moves configured by SMC100CC.configure_move() at once
+        (SE command without address).
+        """
+        if self.bus is not None:
+            self.bus.broadcast("SE")
+        else:
+            self.port.write(b"SE\r\n")
+
+    def CollectiveMove(self, PosDict, simultaneous=False):
         """
         Efficient absolute move of multiplate motors.
         Wait only for one who is travelling the most.
         Start with the one with longest distance.
         Args:
             PosDict: dictionary of key: absolute position (deg)
+            simultaneous: preload targets in all controllers and start
+                them by one broadcast command (all axes start together)
 
         """
-        Current = self.GetPos()
+        Current = self.GetPos(max_age=self.MaxAge)
         target_keys = set(PosDict.keys())
         my_keys = set(self.Motors.keys())
         keys = target_keys.intersection(my_keys)
@@ -125,18 +425,179 @@ class SMCStack():
 
         longest_dist = distance[-1]  # key of longest-travelling motor
         dist_value = abs(Current[longest_dist] - PosDict[longest_dist])
-        time_estim = self.Motors[longest_dist].get_mr_time(dist_value)
-        sleep(self.dT)
+        self.Motors[longest_dist].predict_move_time(0)  # read the model
+        # without the offset, so the observed arrival does not depend on it
+        time_estim = float(self.Motors[longest_dist].model.kinematic_time(dist_value))
 
         t0 = time()
-        for key in distance[::-1]:
-            self.Motors[key](PosDict[key])
-            sleep(self.dT)
+        if simultaneous:
+            for key in distance[::-1]:
+                self.Motors[key].configure_move(PosDict[key])
+            self.StartConfigured()
+            t0 = time()
+            for key in distance:
+                self.Motors[key].mark_moving(self.Motors[key].configured)
+        else:
+            for key in distance[::-1]:
+                self.Motors[key](PosDict[key])
+                if key == longest_dist:
+                    t0 = time()
+                sleep(self.dT)
+
+        # sleep until the kinematic end of the longest move, then poll
+        if time_estim > 0:
+            sleep(max(0, min(time_estim, 100) - (time() - t0)))
+
+        t_arrival = self.WaitForMovement(distance)
+        if dist_value > 0:
+            self.Motors[longest_dist].model.observe(dist_value, t_arrival - t0)
+
+    def move_time(self, key, distance):
+        """
+        Predicted move time (s) of motor key over distance (deg, may be ndarray).
+        """
+        return self.Motors[key].predict_move_time(distance)
+
+    def Close(self):
+        if self.state_file is not None and self.port.is_open:
+            try:
+                self._poll_positions(sorted(self.Motors.keys()))
+                self.SaveState()
+            except Exception:
+                pass
+        if self.Poller is not None and self.owns_poller:
+            self.Poller.close()
+        if self.bus is not None:
+            if self.bus.running:
+                self.bus.close()
+        else:
+            self.port.close()
+
+
+class SMCMultiStack():
+    """
+    Stack of motors on several serial ports. Each port has its own
+    SMCStack and one worker thread, collective operations are sent to
+    all ports concurrently and joined at the end.
+    """
+
+    def __init__(self, ConstructionDict, framed=False):
+        """
+        Args:
+            ConstructionDict - dictionary with keys: port, address, label and correction
+            framed - open the ports as SMC100Bus
+        """
+        by_port = {}
+        for key, (port, addr, label, corr) in ConstructionDict.items():
+            by_port.setdefault(port, {})[key] = (addr, label, corr)
+        self.Stacks = {}
+        self.Workers = {}
+        self.PortOf = {}
+        self.Poller = MotionPoller()  # one poller serves all ports
+        for port, Dict in by_port.items():
+            self.Stacks[port] = SMCStack(port, Dict, framed=framed, poller=self.Poller)
+            self.Workers[port] = ThreadPoolExecutor(max_workers=1)
+            for key in Dict:
+                self.PortOf[key] = port
+        self.Motors = {key: self.Stacks[port].Motors[key]
+                       for key, port in self.PortOf.items()}
+
+    def __call__(self, PosDict):
+        """
+        Perform CollectiveMove().
+        """
+        self.CollectiveMove(PosDict)
+
+    def __del__(self):
+        self.Close()
+
+    def __getitem__(self, key):
+        return self.Motors.get(key, None)
+
+    def _dispatch(self, method, keys, *args):
+        """
+        Call SMCStack method with its own keys on every involved port
+        concurrently and collect the results.
+        Returns:
+            dictionary port: result
+        """
+        if keys == None:
+            keys = self.Motors.keys()
+        by_port = {}
+        for key in keys:
+            if key in self.PortOf:
+                by_port.setdefault(self.PortOf[key], []).append(key)
+        futures = {port: self.Workers[port].submit(
+                       getattr(self.Stacks[port], method), sorted(port_keys), *args)
+                   for port, port_keys in by_port.items()}
+        return {port: future.result() for port, future in futures.items()}
+
+    def MoveAsync(self, PosDict):
+        """
+        Start absolute moves on all ports without blocking. The commands
+        are sent by the worker of each port, after its queued operations.
+        Returns:
+            dictionary key: future resolved when the motor is ready
+        """
+        by_port = {}
+        for key, pos in PosDict.items():
+            if key in self.PortOf:
+                by_port.setdefault(self.PortOf[key], {})[key] = pos
+        started = [self.Workers[port].submit(self.Stacks[port].MoveAsync, PortDict)
+                   for port, PortDict in by_port.items()]
+        Futures = {}
+        for future in started:
+            Futures.update(future.result())
+        return Futures
 
-        while time()-t0 < time_estim and time()-t0 < 100:  # upper limit for waiting
-            sleep(2*self.dT)
+    def GetPos(self, keys=None):
+        Position = {}
+        for result in self._dispatch("GetPos", keys).values():
+            Position.update(result)
+        return Position
+
+    def GetStates(self, keys=None):
+        States = {}
+        for result in self._dispatch("GetStates", keys).values():
+            States.update(result)
+        return States
+
+    def Home(self, keys=None, timeout=60.0):
+        Failed = {}
+        for result in self._dispatch("Home", keys, timeout).values():
+            Failed.update(result)
+        return Failed
+
+    def WaitForMovement(self, keys):
+        """
+        Wait for motors on all ports.
+        Returns:
+            the latest arrival estimate of the ports, see SMCStack.WaitForMovement()
+        """
+        return max(self._dispatch("WaitForMovement", keys).values(), default=time())
+
+    def move_time(self, key, distance):
+        return self.Motors[key].predict_move_time(distance)
+
+    def CollectiveMove(self, PosDict, simultaneous=False):
+        """
+        CollectiveMove on all involved ports at once, returns when the
+        slowest chain has finished.
+        """
+        def move(stack, keys, PosDict):
+            stack.CollectiveMove({key: PosDict[key] for key in keys}, simultaneous)
 
-        self.WaitForMovement(distance)
+        by_port = {}
+        for key in PosDict:
+            if key in self.PortOf:
+                by_port.setdefault(self.PortOf[key], []).append(key)
+        futures = [self.Workers[port].submit(move, self.Stacks[port], keys, PosDict)
+                   for port, keys in by_port.items()]
+        for future in futures:
+            future.result()
 
     def Close(self):
-        self.port.close()
+        self.Poller.close()
+        for port in self.Stacks:
+            self.Workers[port].shutdown()
+            self.Stacks[port].Close()
@@ -0,0 +1,160 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, monotonic
+
+"""
+Step scan overlapping motion and acquisition.
+
+For every point the engine waits for the motors, lets them settle, runs
+the acquisition windows of all devices concurrently and, as soon as all
+windows are closed, starts the move to the next point. Device readouts
+of the finished point run while the motors travel. Wall time per point
+then approaches max(move, acquisition) instead of their sum.
+
+An acquisition is a callable. If it returns a value, the whole call is
+the acquisition window. If it returns another callable, the first call
+is the window and the returned one is the readout, which is called
+while the motors already move to the next point. The value has to be
+a number, a sequence or an array of fixed shape, or a dictionary of
+them; a dictionary is stored as one field per key (<name>_<key>).
+
+Example:
+    Ms = SMCStack('COM3', ConstructionDict, 1, framed=True)
+    ADC = MD_ADC_v2('COM5')
+    Meter = TTiMinimal('COM6')
+    cc_meas = CustomCoincidenceOrder(tagger, [1, 2, 3, 4], 1000)
+
+    def coincidences():
+        cc_meas.startFor(int(1e12))
+        cc_meas.waitUntilFinished()
+        return cc_meas.getData  # readout overlaps with the next move
+
+    Scan = StepScan(Ms, {"adc": lambda: ADC.read_singles()[1],
+                         "meter": Meter.read,
+                         "cc": coincidences}, settle=0.05)
+    Results = Scan.run([{1: a, 2: a/2} for a in range(0, 90, 5)])
+    Results["cc"], Results["pos_1"], Results["t_acquired"]
+    #ADC.read_singles as acquisition stores one field per channel (adc_1, adc_2...)
+"""
+
+
+class StepScan():
+    """
+    Pipelined step scan with SMCStack and several acquisition devices.
+    """
+
+    def __init__(self, stack, acquisitions, settle=0.0):
+        """
+        Args:
+            stack - SMCStack or SMCMultiStack
+            acquisitions - dictionary name: acquisition callable
+            settle - time (s) waited after the motors report ready
+        """
+        self.stack = stack
+        self.acquisitions = dict(acquisitions)
+        self.settle = settle
+        # one more worker for the task collecting the readouts
+        self.workers = ThreadPoolExecutor(max_workers=len(self.acquisitions) + 1)
+        self.results = None
+
+    @staticmethod
+    def _flatten(values):
+        """Dictionary results of acquisitions split to fields <name>_<key>."""
+        fields = {}
+        for name, value in values.items():
+            if isinstance(value, dict):
+                fields.update((f"{name}_{key}", item) for key, item in value.items())
+            else:
+                fields[name] = value
+        return fields
+
+    def _allocate(self, PosDicts, keys, values):
+        """Structured array for all points, value shapes from the first point."""
+        fields = [("index", np.int64)]
+        fields += [(f"pos_{key}", np.float64) for key in keys]
+        fields += [("t_start", np.float64), ("t_ready", np.float64),
+                   ("t_acquired", np.float64), ("t_done", np.float64)]
+        for name, value in values.items():
+            value = np.asarray(value)
+            dtype = value.dtype if value.dtype.kind in "biuf" else np.float64
+            fields.append((name, dtype, value.shape))
+        return np.zeros(len(PosDicts), dtype=fields)
+
+    def _acquire(self):
+        """Run acquisition windows concurrently, returns name: value or readout."""
+        futures = {name: self.workers.submit(acquire)
+                   for name, acquire in self.acquisitions.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _readout(self, windows):
+        """Call pending readouts concurrently."""
+        futures = {name: self.workers.submit(value) if callable(value) else None
+                   for name, value in windows.items()}
+        return {name: windows[name] if future is None else future.result()
+                for name, future in futures.items()}
+
+    def run(self, PosDicts):
+        """
+        Perform the scan.
+        Args:
+            PosDicts - list of dictionaries key: absolute position (deg)
+        Returns:
+            structured array with index, target positions (pos_<key>),
+            host monotonic times of move start, motors ready, windows
+            closed and readouts done, and one field per acquisition
+            (per key of dictionary results)
+        """
+        keys = sorted(set().union(*PosDicts))
+        t_scan = monotonic()
+        results = None
+        pending = None  # (index, windows) of the point being read out
+        t_start = monotonic()
+        moving = self.stack.MoveAsync(PosDicts[0]) if PosDicts else {}
+        for n, PosDict in enumerate(PosDicts):
+            for future in moving.values():
+                future.result()
+            t_ready = monotonic()
+            if pending is not None:
+                # readouts of the previous point run during the move and settling
+                results = self._store(results, PosDicts, keys, *pending)
+                pending = None
+            settle = self.settle - (monotonic() - t_ready)
+            if settle > 0:
+                sleep(settle)
+
+            windows = self._acquire()
+            t_acquired = monotonic()
+            t_next = monotonic()
+            if n + 1 < len(PosDicts):
+                moving = self.stack.MoveAsync(PosDicts[n + 1])
+            readouts = self.workers.submit(self._readout, windows)
+            pending = (n, readouts, t_start, t_ready, t_acquired)
+            t_start = t_next
+
+        if pending is not None:
+            results = self._store(results, PosDicts, keys, *pending)
+        self.results = results
+        if results is not None:
+            t_total = monotonic() - t_scan
+            print(f"StepScan: {len(PosDicts)} points in {t_total:.2f} s "
+                  f"({t_total/len(PosDicts):.3f} s/point)")
+        return results
+
+    def _store(self, results, PosDicts, keys, n, readouts, t_start, t_ready, t_acquired):
+        values = self._flatten(readouts.result())
+        if results is None:
+            results = self._allocate(PosDicts, keys, values)
+        row = results[n]
+        row["index"] = n
+        for key in keys:
+            row[f"pos_{key}"] = PosDicts[n].get(key, np.nan)
+        row["t_start"] = t_start
+        row["t_ready"] = t_ready
+        row["t_acquired"] = t_acquired
+        row["t_done"] = monotonic()
+        for name, value in values.items():
+            row[name] = value
+        return results
+
+    def close(self):
+        self.workers.shutdown()
@@ -0,0 +1,48 @@
+import sys
+import pytest
+
+if not sys.platform.startswith("linux"):
+    pytest.skip("the simulator needs a pseudo-terminal", allow_module_level=True)
+from smc100py3 import SMC100CC, SMC100Bus
+from smcSimulator import SMC100Simulator
+from flyScan import PositionStream
+
+
+@pytest.fixture
+def motor():
+    sim = SMC100Simulator([1], latency=0.001, axis_kwargs={1: {"state": "33"}})
+    bus = SMC100Bus(sim.port_name, timeout=0.05)
+    motor = SMC100CC(bus, 1, query=False)
+    yield sim, motor
+    bus.close()
+    sim.close()
+
+
+def test_stream_follows_move_without_touching_cache(motor):
+    sim, motor = motor
+    stream = PositionStream(motor, timeout=10.0)
+    stream.start(2.0)
+    stream.wait(10.0)
+    samples = stream.samples()
+    assert samples.size > 3 and abs(samples["pos"][-1] - 2.0) <= stream.tolerance
+    # the cache keeps the commanded target until READY is read
+    assert motor.moving and motor.pos == 2.0
+
+
+def test_start_raises_when_move_is_refused(motor):
+    sim, motor = motor
+    motor.mark_moving(5.0)  # cached as moving
+    with pytest.raises(RuntimeError):
+        PositionStream(motor).start(1.0)
+
+
+def test_stream_stops_after_failed_reads(motor):
+    sim, motor = motor
+    for _ in range(3):
+        sim.delay_reply(1, "TP", None)
+    stream = PositionStream(motor, max_errors=3)
+    stream.start()
+    stream.wait(5.0)
+    assert not stream.running
+    assert isinstance(stream.error, TimeoutError)
+    assert stream.count == 0
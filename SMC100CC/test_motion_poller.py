@@ -0,0 +1,61 @@
+import sys
+import pytest
+
+if not sys.platform.startswith("linux"):
+    pytest.skip("the simulator needs a pseudo-terminal", allow_module_level=True)
+from smc100py3 import SMC100CC, SMC100Bus, MotionPoller
+from smcSimulator import SMC100Simulator
+
+
+@pytest.fixture
+def motors():
+    fast = {"state": "33", "velocity": 100.0, "acceleration": 1000.0}
+    sim = SMC100Simulator([1, 2], latency=0.001, axis_kwargs={1: fast, 2: fast})
+    bus = SMC100Bus(sim.port_name, timeout=0.2)
+    poller = MotionPoller(min_interval=0.01, max_interval=0.1, timeout=0.3)
+    yield sim, [SMC100CC(bus, addr, query=False) for addr in (1, 2)], poller
+    poller.close()
+    bus.close()
+    sim.close()
+
+
+def test_futures_resolve_when_ready(motors):
+    sim, motors, poller = motors
+    for motor in motors:
+        motor.get_pos()
+    futures = [motor.move_future(target, poller) for motor, target in zip(motors, (5.0, 20.0))]
+    for future in futures:
+        assert future.result(5.0)[0] == "33"
+    assert sim.axes[1].position() == 5.0 and sim.axes[2].position() == 20.0
+    # sparse polling far from the predicted arrival (0.3 s for 20 deg)
+    assert poller.polls < 0.3/poller.min_interval
+
+
+def test_future_fails_in_other_state(motors):
+    sim, motors, poller = motors
+    motors[0].get_pos()
+    future = motors[0].move_future(50.0, poller)
+    with sim.lock:
+        sim.axes[1].state = "3C"  # disabled during the move
+    with pytest.raises(RuntimeError):
+        future.result(5.0)
+
+
+def test_future_times_out_after_predicted_arrival(motors):
+    sim, motors, poller = motors
+    motors[0].get_pos()
+    future = motors[0].move_future(5.0, poller)
+    with sim.lock:
+        sim.axes[1].duration = 1e6  # never arrives
+    with pytest.raises(TimeoutError):
+        future.result(5.0)
+
+
+def test_close_cancels_watched(motors):
+    sim, motors, poller = motors
+    motors[0].get_pos()
+    with sim.lock:
+        sim.axes[1].velocity = 1.0
+    future = motors[0].move_future(50.0, poller)
+    poller.close()
+    assert future.cancelled()
@@ -0,0 +1,70 @@
+from time import sleep
+import numpy as np
+import pytest
+from scanPlanner import ScanPlanner, MotionTimeTable, two_opt
+
+
+class LinearStack():
+    """Axes moving at 100 deg/s, moves take no real time."""
+
+    def __init__(self, position):
+        self.position = dict(position)
+        self.moves = []
+
+    def move_time(self, key, distance):
+        return np.abs(distance)/100.0
+
+    def GetPos(self, keys=None):
+        return {key: self.position[key] for key in keys}
+
+    def CollectiveMove(self, PosDict):
+        self.moves.append(dict(PosDict))
+        self.position.update(PosDict)
+
+
+def test_plan_orders_targets_by_travel():
+    stack = LinearStack({1: 0.0})
+    targets = [{1: a} for a in (50, 10, 40, 20, 30)]
+    plan = ScanPlanner(stack).plan(targets)
+    assert list(plan["order"]) == [1, 3, 4, 2, 0]
+    assert plan["predicted_total"] == pytest.approx(0.5)
+    assert plan["original_total"] == pytest.approx(0.5 + 0.4 + 0.3 + 0.2 + 0.1)
+
+
+def test_plan_keeps_group_order():
+    stack = LinearStack({1: 0.0, 2: 0.0})
+    targets = [{1: 60}, {1: 10}, {1: 20, 2: 10}, {1: 0, 2: 0}]
+    plan = ScanPlanner(stack).plan(targets, groups=[1, 1, 0, 0])
+    assert list(plan["order"][:2]) == [3, 2]
+    assert list(plan["order"][2:]) == [1, 0]
+    # the missing axis keeps the start position
+    assert plan["steps"][-1] == {1: 60.0, 2: 0.0}
+
+
+def test_two_opt_removes_crossing():
+    x = np.array([0.0, 1.0, 2.0, 3.0])
+    cost = np.abs(x[:, None] - x[None, :])
+    assert two_opt(cost, [0, 2, 1, 3]) == [0, 1, 2, 3]
+
+
+def test_execute_reports_moves_without_acquisition():
+    stack = LinearStack({1: 0.0})
+    planner = ScanPlanner(stack)
+    plan = planner.plan([{1: 20}, {1: 10}])
+    visited = []
+
+    def on_step(index, PosDict):
+        visited.append(index)
+        sleep(0.05)
+
+    report = planner.execute(plan, on_step)
+    assert visited == [1, 0]
+    assert stack.moves == [{1: 10.0}, {1: 20.0}]
+    assert report["actual_total"] < 0.05
+    assert np.all(report["acquisition"] >= 0.05)
+
+
+def test_time_table_extrapolates_linearly():
+    table = MotionTimeTable({1: [1, 10]}, {1: [0.5, 1.4]})
+    np.testing.assert_allclose(table.move_time(1, np.array([0, -1, 5.5, 20])),
+                               [0, 0.5, 0.95, 2.4])
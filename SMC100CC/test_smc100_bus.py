@@ -0,0 +1,94 @@
+import sys
+from time import sleep
+import pytest
+
+if not sys.platform.startswith("linux"):
+    pytest.skip("the simulator needs a pseudo-terminal", allow_module_level=True)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from smc100py3 import SMC100CC, SMC100Bus
+from smcSimulator import SMC100Simulator
+
+
+@pytest.fixture
+def sim():
+    sim = SMC100Simulator([1, 2], latency=0.001,
+                          axis_kwargs={1: {"state": "33"}, 2: {"state": "33"}})
+    yield sim
+    sim.close()
+
+
+def place(sim, address, position):
+    axis = sim.axes[address]
+    with sim.lock:
+        axis.start_pos = axis.target = position
+        axis.duration = 0.0
+
+
+def test_late_reply_is_not_paired_with_next_request(sim):
+    bus = SMC100Bus(sim.port_name, timeout=0.1)
+    motor = SMC100CC(bus, 1, query=False)
+    try:
+        sim.delay_reply(1, "TP", 0.25)
+        with pytest.raises(FutureTimeoutError):
+            motor.get_pos()
+        place(sim, 1, 5.0)
+        # the late response (0.0) arrives first and has to be dropped,
+        # the line is blocked until then
+        assert motor.get_pos_async().result(1.0) == pytest.approx(5.0)
+        assert bus.late == 1
+        # other keys are not affected
+        assert SMC100CC(bus, 2, query=False).get_state()[0] == "33"
+        assert motor.get_pos() == pytest.approx(5.0)
+        assert bus.unmatched == 0
+    finally:
+        bus.close()
+
+
+def test_lost_reply_expires(sim):
+    bus = SMC100Bus(sim.port_name, timeout=0.1, late_timeout=0.2)
+    motor = SMC100CC(bus, 1, query=False)
+    try:
+        sim.delay_reply(1, "TS", None)
+        with pytest.raises(FutureTimeoutError):
+            motor.get_state()
+        sleep(0.25)
+        assert motor.get_state()[0] == "33"
+        assert bus.late == 0
+    finally:
+        bus.close()
+
+
+def test_send_command_listen_returns_command(sim):
+    bus = SMC100Bus(sim.port_name)
+    try:
+        framed = SMC100CC(bus, 1, query=False).send_command_listen("TS", "", 0.05)
+    finally:
+        bus.close()
+    legacy_motor = SMC100CC(sim.port_name, 1, query=False)
+    legacy = legacy_motor.send_command_listen("TS", "", 0.05)
+    del legacy_motor  # closes the port
+    assert framed == legacy == ["01TS000033\r\n", "01TS\r\n"]
+
+
+def test_lost_reply_is_recovered_by_next_request(sim):
+    bus = SMC100Bus(sim.port_name, timeout=0.1)
+    motor = SMC100CC(bus, 1, query=False)
+    try:
+        sim.delay_reply(1, "TP", None)
+        with pytest.raises(FutureTimeoutError):
+            motor.get_pos()
+        place(sim, 1, 7.0)
+        # the only response is held and given to the retry after timeout
+        assert motor.get_pos() == pytest.approx(7.0)
+        assert motor.get_pos() == pytest.approx(7.0)
+    finally:
+        bus.close()
+
+
+def test_close_fails_pending_requests(sim):
+    bus = SMC100Bus(sim.port_name)
+    sim.delay_reply(1, "TS", None)
+    future = bus.query(1, "TS")
+    bus.close()
+    with pytest.raises(ConnectionError):
+        future.result(1.0)
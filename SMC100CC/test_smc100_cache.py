@@ -0,0 +1,50 @@
+from time import sleep
+from smc100py3 import SMC100CC
+
+
+class ClosedPort():
+    """No communication, the tests feed responses to the parsers."""
+
+    def close(self):
+        pass
+
+
+def make_motor():
+    motor = SMC100CC(ClosedPort(), 1, query=False)
+    motor.pos = 0.0
+    motor.pos_time = float("-inf")
+    motor.predict_move_time = lambda x: 0.0  # arrival predicted at once
+    return motor
+
+
+def test_target_is_not_fresh_before_ready():
+    motor = make_motor()
+    motor.mark_moving(10.0)
+    sleep(0.001)
+    assert not motor._pos_fresh(1.0)
+    motor._parse_state("01TS000028\r\n")
+    assert not motor._pos_fresh(1.0)
+    motor._parse_state("01TS000033\r\n")
+    assert motor._pos_fresh(1.0)
+    assert motor.pos == 10.0
+
+
+def test_ready_right_after_command_is_ignored():
+    motor = make_motor()
+    motor.mark_moving(10.0)
+    assert motor._parse_state("01TS000033\r\n")[0] == "33"
+    assert motor.moving and motor.state == "28 Moving"
+    assert not motor._pos_fresh(1.0)
+    sleep(motor.dT)
+    motor._parse_state("01TS000033\r\n")
+    assert not motor.moving and motor._pos_fresh(1.0)
+
+
+def test_position_read_during_move_keeps_target():
+    motor = make_motor()
+    motor.mark_moving(10.0)
+    motor._parse_state("01TS000028\r\n")
+    motor._parse_pos("01TP4.5\r\n")
+    assert not motor._pos_fresh(1.0)
+    motor._parse_state("01TS000033\r\n")
+    assert motor.pos == 10.0
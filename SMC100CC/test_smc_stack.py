@@ -0,0 +1,201 @@
+import sys
+from time import time
+import pytest
+
+if not sys.platform.startswith("linux"):
+    pytest.skip("the simulator needs a pseudo-terminal", allow_module_level=True)
+from smcStack import SMCStack, SMCMultiStack
+from smcSimulator import SMC100Simulator
+
+ADDRESSES = (1, 2, 3)
+CONSTRUCTION = {key: (key, None, 0) for key in ADDRESSES}
+
+
+@pytest.fixture
+def sim():
+    sim = SMC100Simulator(ADDRESSES, latency=0.001,
+                          axis_kwargs={addr: {"state": "33"} for addr in ADDRESSES})
+    yield sim
+    sim.close()
+
+
+@pytest.fixture(params=[False, True], ids=["legacy", "framed"])
+def framed(request):
+    return request.param
+
+
+def make_stack(sim, framed, **kwargs):
+    stack = SMCStack(sim.port_name, CONSTRUCTION, 1, framed=framed, **kwargs)
+    stack.PollTimeout = 0.1
+    return stack
+
+
+def test_lost_state_response_is_polled_again(sim, framed):
+    stack = make_stack(sim, framed)
+    try:
+        sim.delay_reply(2, "TS", None)
+        states = stack.GetStates()
+        assert {key: state[0] for key, state in states.items()} == {1: "33", 2: "33", 3: "33"}
+    finally:
+        stack.Close()
+
+
+def test_silent_motor_raises(sim, framed):
+    stack = make_stack(sim, framed)
+    try:
+        for _ in range(stack.Retries + 1):
+            sim.delay_reply(3, "TS", None)
+        with pytest.raises(TimeoutError):
+            stack.WaitForMovement([1, 2, 3])
+    finally:
+        stack.Close()
+
+
+def test_repeated_moves_keep_stable_offset(framed):
+    fast = {"state": "33", "velocity": 100.0, "acceleration": 1000.0}
+    sim = SMC100Simulator((1,), latency=0.001, axis_kwargs={1: fast})
+    stack = SMCStack(sim.port_name, {1: (1, None, 0)}, 1, framed=framed)
+    try:
+        offsets = []
+        for n in range(12):
+            stack.CollectiveMove({1: 2.0*((n + 1) % 2)})
+            offsets.append(stack[1].model.offset)
+        assert stack[1].model.n_observed == 12
+        # the simulator moves exactly by the kinematic profile, the offset
+        # is the polling resolution and must not grow move after move
+        assert max(abs(x) for x in offsets) < 2*stack.dT
+        assert abs(offsets[-1] - offsets[5]) < stack.dT/2
+    finally:
+        stack.Close()
+        sim.close()
+
+
+def test_startup_from_state_file(sim, framed, tmp_path):
+    state_file = str(tmp_path / "stack.json")
+    stack = make_stack(sim, framed, state_file=state_file)
+    stack.CollectiveMove({1: 1.0, 2: 2.0, 3: 3.0})
+    stack.Close()
+
+    sim.axes[3].firmware = "SMC_CC simulator 2.0"  # controller replaced
+    received = sim.received
+    stack = make_stack(sim, framed, state_file=state_file)
+    try:
+        # one VE per axis, TS, TP, VA and AC only for the replaced one
+        assert sim.received - received == 3 + 4
+        assert stack.Motors[1].pos == 1.0 and stack.Motors[2].pos == 2.0
+        assert stack.Motors[1].model is not None
+        # seeded values are confirmed by the first query with max_age
+        assert not stack.Motors[1]._pos_fresh(1.0)
+        received = sim.received
+        assert stack.GetPos([1, 2], max_age=1.0) == {1: 1.0, 2: 2.0}
+        assert sim.received - received == 2
+    finally:
+        stack.Close()
+
+
+def test_startup_tolerates_silent_motor(sim, framed, tmp_path, monkeypatch):
+    monkeypatch.setattr(SMCStack, "PollTimeout", 0.1)
+    construction = dict(CONSTRUCTION)
+    construction[4] = (4, None, 0)  # no controller at address 4
+    stack = SMCStack(sim.port_name, construction, 1, framed=framed,
+                     state_file=str(tmp_path / "stack.json"))
+    try:
+        assert stack.Motors[4].state == "0A Not referenced from reset"
+        assert stack.Motors[4].pos is None
+        assert stack.Motors[1].pos == 0.0
+    finally:
+        stack.Close()
+
+
+@pytest.fixture
+def chains():
+    sims = [SMC100Simulator((1, 2), latency=0.001,
+                            axis_kwargs={addr: {"state": "33"} for addr in (1, 2)})
+            for _ in range(2)]
+    yield sims
+    for sim in sims:
+        sim.close()
+
+
+def make_multistack(chains, framed):
+    construction = {1: (chains[0].port_name, 1, None, 0), 2: (chains[0].port_name, 2, None, 0),
+                    3: (chains[1].port_name, 1, None, 0)}
+    return SMCMultiStack(construction, framed=framed)
+
+
+def test_multistack_moves_on_all_ports(chains, framed):
+    stack = make_multistack(chains, framed)
+    try:
+        futures = stack.MoveAsync({1: 1.0, 3: 2.0})
+        assert sorted(futures) == [1, 3]
+        for future in futures.values():
+            assert future.result(10.0)[0] in ("32", "33", "34", "35")
+        assert chains[0].axes[1].position() == pytest.approx(1.0)
+        assert chains[1].axes[1].position() == pytest.approx(2.0)
+        stack.CollectiveMove({2: 0.5, 3: 0.0})
+        assert stack.GetPos() == pytest.approx({1: 1.0, 2: 0.5, 3: 0.0})
+    finally:
+        stack.Close()
+
+
+def test_multistack_wait_returns_arrival(sim, chains, framed):
+    stack = make_multistack(chains, framed)
+    single = make_stack(sim, framed)
+    try:
+        # both classes return the arrival time and can be swapped
+        for s in (stack, single):
+            t0 = time()
+            s[1].move_abs_noblock(1.0)
+            t_arrival = s.WaitForMovement([1, 2])
+            assert isinstance(t_arrival, float) and t0 <= t_arrival <= time()
+    finally:
+        single.Close()
+        stack.Close()
+
+
+def test_configured_moves_start_together(sim, framed):
+    stack = make_stack(sim, framed)
+    try:
+        for key, target in ((1, 3.0), (2, 6.0)):
+            stack[key].configure_move(target)
+        stack.GetStates()  # the configured moves wait for SE
+        assert sim.axes[1].position() == 0.0 and sim.axes[2].position() == 0.0
+        stack.StartConfigured()
+        stack.GetStates()
+        assert abs(sim.axes[1].t_start - sim.axes[2].t_start) < 1e-3
+        assert sim.axes[3].configured_target is None and sim.axes[3].state == "33"
+        stack.WaitForMovement([1, 2])
+        stack.CollectiveMove({1: 1.0, 2: 2.0, 3: 3.0}, simultaneous=True)
+        assert [sim.axes[addr].position() for addr in ADDRESSES] == [1.0, 2.0, 3.0]
+    finally:
+        stack.Close()
+
+
+def test_home_is_concurrent(framed):
+    sim = SMC100Simulator(ADDRESSES, latency=0.001, home_time=0.3)
+    stack = make_stack(sim, framed)
+    try:
+        t0 = time()
+        assert stack.Home() == {}
+        # the axes home together, not one after another
+        assert time() - t0 < 2*sim.home_time
+        assert all(sim.axes[addr].state == "32" for addr in ADDRESSES)
+        assert stack.GetPos() == {1: 0.0, 2: 0.0, 3: 0.0}
+    finally:
+        stack.Close()
+        sim.close()
+
+
+def test_home_timeout_per_axis(framed, monkeypatch):
+    monkeypatch.setattr(SMCStack, "PollTimeout", 0.1)
+    sim = SMC100Simulator(ADDRESSES, latency=0.001, home_time=0.2)
+    construction = dict(CONSTRUCTION)
+    construction[4] = (4, None, 0)  # no controller at address 4
+    stack = SMCStack(sim.port_name, construction, 1, framed=framed)
+    try:
+        Failed = stack.Home(timeout={1: 5.0, 2: 5.0, 3: 5.0, 4: 0.3})
+        assert list(Failed) == [4]
+        assert all(sim.axes[addr].state == "32" for addr in ADDRESSES)
+    finally:
+        stack.Close()
+        sim.close()
@@ -0,0 +1,50 @@
+from concurrent.futures import Future
+from time import sleep
+import numpy as np
+from stepScan import StepScan
+
+
+class InstantStack():
+    """Motors which arrive at once."""
+
+    def MoveAsync(self, PosDict):
+        futures = {}
+        for key in PosDict:
+            futures[key] = Future()
+            futures[key].set_result(["33", "33 Ready from moving"])
+        return futures
+
+
+def test_dictionary_results_are_split_to_fields():
+    counter = iter(range(100))
+
+    def singles():
+        n = next(counter)
+        return {1: 0.5*n, 2: -0.5*n}
+
+    scan = StepScan(InstantStack(), {"adc": singles, "spectrum": lambda: np.arange(3)})
+    try:
+        results = scan.run([{1: a} for a in range(4)])
+    finally:
+        scan.close()
+    assert list(results["adc_1"]) == [0.0, 0.5, 1.0, 1.5]
+    assert list(results["adc_2"]) == [0.0, -0.5, -1.0, -1.5]
+    assert results["spectrum"].shape == (4, 3)
+    assert list(results["pos_1"]) == [0, 1, 2, 3]
+
+
+def test_readouts_overlap_settling():
+    def window():
+        def readout():
+            sleep(0.1)
+            return 1.0
+        return readout
+
+    scan = StepScan(InstantStack(), {"slow": window}, settle=0.1)
+    try:
+        results = scan.run([{1: a} for a in range(5)])
+    finally:
+        scan.close()
+    # the readout of the previous point fills the settling time
+    steps = np.diff(results["t_acquired"])
+    assert np.all(steps < 0.17)
@@ -8,9 +8,11 @@ starek.robert@gmail.com
 v1.1
 """
 
+import os
+import timeit
+import zlib
 import numpy as np
 import numba as nb
-#import timeit
 
 # Timetagger format
 TAGFORMAT = np.dtype([
@@ -19,6 +21,25 @@ TAGFORMAT = np.dtype([
     ('time', np.dtype('int64'))
 ])
 
+# record types, low byte of the overflow field (the upper 16 bits hold
+# the number of missed events of MissedEvents records)
+TAG_TIME = 0
+TAG_ERROR = 1
+TAG_OVERFLOW_BEGIN = 2
+TAG_OVERFLOW_END = 3
+TAG_MISSED_EVENTS = 4
+# fields of the overflow_state array used by the kernels
+OVF_ACTIVE = 0  # 1 while inside overflow region
+OVF_BEGIN = 1  # time of the last OverflowBegin
+OVF_DEAD_TIME = 2  # total time spent in overflow regions
+OVF_MISSED = 3  # total number of missed events
+OVF_REGIONS = 4  # number of overflow regions
+OVF_DISCARDED = 5  # coincidence windows dropped due to overflow
+OVF_SIZE = 6
+
+# number of records identifying the file of a sidecar time index
+HEADER_RECORDS = 64
+
 # constant 8-bit (256 lines) LUT for Hamming weight
 HAMMING_LUT = np.array([bin(i).count("1")
                         for i in range(2**8)], dtype=np.uint8)
@@ -39,10 +60,55 @@ def numba_ham32(i):
 
 
 @nb.jit(nopython=True)
-def _nb_make_histogram(tc_array, binwidth, channels,
+def _nb_overflow_record(record, timestamp, overflow_state, valids,
+                        coincidence_registers, channels):
+    """
+    Account record of other type than time tag (overflow field > 0).
+    OverflowBegin opens overflow region and discards the open coincidence
+    windows, OverflowEnd closes it, MissedEvents adds its missed events.
+    """
+    tag_type = record & 0xff
+    if tag_type == TAG_OVERFLOW_BEGIN:
+        if overflow_state[OVF_ACTIVE] == 0:
+            overflow_state[OVF_ACTIVE] = 1
+            overflow_state[OVF_BEGIN] = timestamp
+            overflow_state[OVF_REGIONS] += 1
+            for j in range(channels):
+                if valids[j]:
+                    overflow_state[OVF_DISCARDED] += 1
+                    valids[j] = False
+                    coincidence_registers[j] = 0
+    elif tag_type == TAG_OVERFLOW_END:
+        if overflow_state[OVF_ACTIVE] == 1:
+            overflow_state[OVF_ACTIVE] = 0
+            overflow_state[OVF_DEAD_TIME] += timestamp - overflow_state[OVF_BEGIN]
+    elif tag_type == TAG_MISSED_EVENTS:
+        overflow_state[OVF_MISSED] += record >> 16
+
+
+def overflow_summary(overflow_state):
+    """
+    Readable form of the overflow_state array, the same as in
+    swabian_on_the_fly_coincidence_counting.
+    Returns:
+        dictionary with dead time, number of missed events, number of
+        overflow regions, number of discarded windows and whether the
+        data ended in overflow
+    """
+    return {
+        "dead_time": int(overflow_state[OVF_DEAD_TIME]),
+        "missed_events": int(overflow_state[OVF_MISSED]),
+        "overflow_regions": int(overflow_state[OVF_REGIONS]),
+        "discarded_windows": int(overflow_state[OVF_DISCARDED]),
+        "in_overflow": bool(overflow_state[OVF_ACTIVE])
+    }
+
+
+@nb.jit(nopython=True)
+def _nb_make_histogram(tc_array, binwidths, channels,
                        coincidence_registers, t0s, t1s, valids,
                        histogram, coincidence_registers_filtered,
-                       closed
+                       closed, overflow_state
                        ):
     """
     Build coincidence order histogram from
@@ -52,12 +118,15 @@ def _nb_make_histogram(tc_array, binwidth, channels,
 
     Args:
         TAGFORMAT: ndarray of tagformat dtype holding timestamps
+        binwidths : int64 ndarray, window length opened by a tag of
+          each channel
         coincidence_registers : uint32 ndarray holding coincidence marks
         t0s, t1s : int64 ndarray holding register times
         valids : bool ndarray
         histogram : uint32 ndarray
         coincidence_registers_filtered : int32
         closed : int32
+        overflow_state : int64 ndarray with overflow accounting (OVF_*)
     Returns:
         None
     """
@@ -66,6 +135,11 @@ def _nb_make_histogram(tc_array, binwidth, channels,
         channel_id = element['channel'] - 1
         ovf = element['overflow']
         if ovf > 0:
+            _nb_overflow_record(ovf, timestamp, overflow_state, valids,
+                                coincidence_registers, channels)
+            continue
+        if overflow_state[OVF_ACTIVE]:
+            # tags inside overflow region are incomplete
             continue
         coincidence_registers_filtered = 0
         closed = 0
@@ -85,17 +159,17 @@ def _nb_make_histogram(tc_array, binwidth, channels,
             if idx > 0:
                 histogram[idx] += 1
         t0s[channel_id] = timestamp
-        t1s[channel_id] = timestamp + binwidth
+        t1s[channel_id] = timestamp + binwidths[channel_id]
         coincidence_registers[channel_id] = (1 << channel_id)
         valids[channel_id] = True
     return 0
 
 
 @nb.jit(nopython=True)
-def _nb_make_cp_histogram(tc_array, binwidth, channels,
+def _nb_make_cp_histogram(tc_array, binwidths, channels,
                           coincidence_registers, t0s, t1s, valids,
                           histogram, coincidence_registers_filtered,
-                          closed
+                          closed, overflow_state
                           ):
     """
     Build coincidence pattern histogram from
@@ -105,12 +179,15 @@ def _nb_make_cp_histogram(tc_array, binwidth, channels,
 
     Args:
         TAGFORMAT: ndarray of tagformat dtype holding timestamps
+        binwidths : int64 ndarray, window length opened by a tag of
+          each channel
         coincidence_registers : uint32 ndarray holding coincidence marks
         t0s, t1s : int64 ndarray holding register times
         valids : bool ndarray
         histogram : uint32 ndarray
         coincidence_registers_filtered : int32
         closed : int32
+        overflow_state : int64 ndarray with overflow accounting (OVF_*)
     Returns:
         None
     """
@@ -119,6 +196,11 @@ def _nb_make_cp_histogram(tc_array, binwidth, channels,
         channel_id = element['channel'] - 1
         ovf = element['overflow']
         if ovf > 0:
+            _nb_overflow_record(ovf, timestamp, overflow_state, valids,
+                                coincidence_registers, channels)
+            continue
+        if overflow_state[OVF_ACTIVE]:
+            # tags inside overflow region are incomplete
             continue
         coincidence_registers_filtered = 0
         closed = 0
@@ -138,24 +220,161 @@ def _nb_make_cp_histogram(tc_array, binwidth, channels,
             if idx > 0:
                 histogram[idx] += 1
         t0s[channel_id] = timestamp
-        t1s[channel_id] = timestamp + binwidth
+        t1s[channel_id] = timestamp + binwidths[channel_id]
         coincidence_registers[channel_id] = (1 << channel_id)
         valids[channel_id] = True
     return 0
 
 
-def make_histogram(tc_iterable, binwidth, channels):
+@nb.jit(nopython=True)
+def _nb_anchor_clusters(times, starts, ends, long, binwidth):
+    """
+    Split segments longer than binwidth into clusters anchored at their
+    first tag. To be used from _cluster_segment().
+    Args:
+        times : int64 ndarray of timestamps
+        starts, ends : int64 ndarrays with segment boundaries
+        long : bool ndarray, True for segments to be split
+        binwidth : window length
+    Returns:
+        int64 ndarray of cluster starts
+    """
+    new_starts = np.empty(times.size, dtype=np.int64)
+    n = 0
+    for k in range(starts.size):
+        new_starts[n] = starts[k]
+        n += 1
+        if not long[k]:
+            continue
+        anchor = times[starts[k]]
+        for i in range(starts[k] + 1, ends[k]):
+            if times[i] - anchor > binwidth:
+                new_starts[n] = i
+                n += 1
+                anchor = times[i]
+    return new_starts[:n]
+
+
+def _cluster_segment(segment, binwidth, carry_times, carry_masks):
+    """
+    Find clusters in a segment of regular records. Tags within binwidth
+    from the first tag of the cluster form one event. Boundaries are
+    found with np.diff, only segments longer than binwidth are split
+    sequentially. The last cluster may continue in the next chunk, so
+    it is returned as carry.
+    Returns:
+        patterns of closed clusters (uint32 ndarray), carry_times, carry_masks
+    """
+    times = np.concatenate((carry_times, segment['time']))
+    masks = np.concatenate((
+        carry_masks,
+        np.left_shift(np.uint32(1), (segment['channel'] - 1).astype(np.uint32))))
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(times) > binwidth) + 1))
+    ends = np.append(starts[1:], times.size)
+    long = (times[ends - 1] - times[starts]) > binwidth
+    if long.any():
+        starts = _nb_anchor_clusters(times, starts, ends, long, binwidth)
+    last = starts[-1]
+    if last > 0:
+        patterns = np.bitwise_or.reduceat(masks[:last], starts[:-1])
+    else:
+        patterns = np.zeros(0, dtype=np.uint32)
+    return patterns, times[last:], masks[last:]
+
+
+def _iterate_cluster_patterns(tc_iterable, binwidth, overflow_state):
+    """
+    Yield ndarrays of click patterns of the clusters, chunk by chunk.
+    Records of other types than time tag split the data, the cluster
+    open at OverflowBegin and the tags until OverflowEnd are discarded
+    (see overflow_summary()).
+    """
+    carry_times = np.zeros(0, dtype=np.int64)
+    carry_masks = np.zeros(0, dtype=np.uint32)
+    for data_chunk in tc_iterable:
+        if data_chunk.size == 0:
+            continue
+        flagged = data_chunk['overflow'] > 0
+        bounds = np.concatenate((
+            [0], np.flatnonzero(np.diff(flagged)) + 1, [flagged.size]))
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if flagged[a]:
+                for record in data_chunk[a:b]:
+                    tag_type = int(record['overflow']) & 0xff
+                    if tag_type == TAG_OVERFLOW_BEGIN and overflow_state[OVF_ACTIVE] == 0:
+                        overflow_state[OVF_ACTIVE] = 1
+                        overflow_state[OVF_BEGIN] = record['time']
+                        overflow_state[OVF_REGIONS] += 1
+                        if carry_times.size > 0:
+                            overflow_state[OVF_DISCARDED] += 1
+                            carry_times = carry_times[:0]
+                            carry_masks = carry_masks[:0]
+                    elif tag_type == TAG_OVERFLOW_END and overflow_state[OVF_ACTIVE] == 1:
+                        overflow_state[OVF_ACTIVE] = 0
+                        overflow_state[OVF_DEAD_TIME] += record['time'] - overflow_state[OVF_BEGIN]
+                    elif tag_type == TAG_MISSED_EVENTS:
+                        overflow_state[OVF_MISSED] += int(record['overflow']) >> 16
+                continue
+            if overflow_state[OVF_ACTIVE]:
+                continue  # tags inside overflow region are incomplete
+            segment = data_chunk[a:b]
+            patterns, carry_times, carry_masks = _cluster_segment(
+                segment, binwidth, carry_times, carry_masks)
+            yield patterns
+    if carry_masks.size > 0:
+        yield np.bitwise_or.reduce(carry_masks, keepdims=True)
+
+
+def _make_cluster_histogram(tc_iterable, binwidth, channels, patterns, return_stats):
+    """
+    Cluster engine of make_histogram() and make_pattern_histogram().
+    Patterns are always bincounted, the order histogram is obtained
+    from the pattern one at the end.
+    """
+    overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+    pattern_histogram = np.zeros(2**channels, dtype=np.int64)
+    for chunk_patterns in _iterate_cluster_patterns(tc_iterable, binwidth, overflow_state):
+        pattern_histogram += np.bincount(chunk_patterns, minlength=2**channels)
+    if patterns:
+        histogram = pattern_histogram.astype(np.uint32)
+    else:
+        orders = HAMMING_LUT[np.arange(2**channels) & 0xff] \
+            + HAMMING_LUT[(np.arange(2**channels) >> 8) & 0xff]
+        histogram = np.bincount(orders, weights=pattern_histogram,
+                                minlength=channels+1).astype(np.uint32)
+    if return_stats:
+        return histogram, overflow_summary(overflow_state)
+    return histogram
+
+
+def make_histogram(tc_iterable, binwidth, channels, return_stats=False,
+                   engine='state'):
     """
     Build coincidence-order histogram from timestamp data.
 
     Args:
         tc_iterable : object capable of iterating throughs chunks of
           TAGFORMATh yielded element should be ndarray of tagformat dtype.
-        binwidth : window length in the timestamp units
+        binwidth : window length in the timestamp units, either one for
+          all channels or a sequence with window of each channel
         channels : number of detection channels
+        return_stats : return also overflow_summary() dictionary
+        engine : 'state' - per-channel windows evaluated tag by tag,
+                 'cluster' - tags within binwidth from the first tag of
+                 the cluster form one event, vectorized per chunk,
+                 supports only single binwidth
     Returns:
         histogram (ndarray, uint32)
+        (histogram, stats) if return_stats
     """
+    if engine == 'cluster':
+        if np.ndim(binwidth) > 0:
+            raise ValueError("Cluster engine supports only single binwidth.")
+        return _make_cluster_histogram(tc_iterable, binwidth, channels,
+                                       False, return_stats)
+    if engine != 'state':
+        raise ValueError(f"Unknown engine {engine}.")
+    binwidths = np.zeros(channels, dtype=np.int64) + np.asarray(binwidth, dtype=np.int64)
     coincidence_registers = np.zeros(channels, dtype=np.uint32)
     t0s = np.zeros(channels, dtype=TAGFORMAT['time'])
     t1s = np.zeros(channels, dtype=TAGFORMAT['time'])
@@ -163,31 +382,49 @@ def make_histogram(tc_iterable, binwidth, channels):
     histogram = np.zeros(channels+1, dtype=np.uint32)
     coincidence_registers_filtered = 0
     closed = 0
+    overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
     # iterate through array chunks
     i = -1
     for i, data_chunk in enumerate(tc_iterable):
-        _nb_make_histogram(data_chunk, binwidth, channels, coincidence_registers, t0s,
-                           t1s, valids, histogram, coincidence_registers_filtered, closed)
+        _nb_make_histogram(data_chunk, binwidths, channels, coincidence_registers, t0s,
+                           t1s, valids, histogram, coincidence_registers_filtered, closed,
+                           overflow_state)
     # at the end, flush the results using virtual tag
     if i > -1:
         data_chunk_end = np.array(
-            [(0, 1, data_chunk[-1]['time']+10*binwidth)], dtype=TAGFORMAT)
-        _nb_make_histogram(data_chunk_end, binwidth, channels, coincidence_registers, t0s,
-                           t1s, valids, histogram, coincidence_registers_filtered, closed)
+            [(0, 1, data_chunk[-1]['time']+10*binwidths.max())], dtype=TAGFORMAT)
+        _nb_make_histogram(data_chunk_end, binwidths, channels, coincidence_registers, t0s,
+                           t1s, valids, histogram, coincidence_registers_filtered, closed,
+                           overflow_state)
+    if return_stats:
+        return histogram, overflow_summary(overflow_state)
     return histogram
 
 
-def make_pattern_histogram(tc_iterable, binwidth, channels):
+def make_pattern_histogram(tc_iterable, binwidth, channels, return_stats=False,
+                           engine='state'):
     """
     Build coincidence-pattern histogram from timestamp data.
     Args:
         tc_iterable : object capable of iterating throughs chunks of
           TAGFORMATh yielded element should be ndarray of tagformat dtype.
-        binwidth : window length in the timestamp units
+        binwidth : window length in the timestamp units, either one for
+          all channels or a sequence with window of each channel
         channels : number of detection channels
+        return_stats : return also overflow_summary() dictionary
+        engine : 'state' or 'cluster', see make_histogram()
     Returns:
         histogram (ndarray, uint32)
+        (histogram, stats) if return_stats
     """
+    if engine == 'cluster':
+        if np.ndim(binwidth) > 0:
+            raise ValueError("Cluster engine supports only single binwidth.")
+        return _make_cluster_histogram(tc_iterable, binwidth, channels,
+                                       True, return_stats)
+    if engine != 'state':
+        raise ValueError(f"Unknown engine {engine}.")
+    binwidths = np.zeros(channels, dtype=np.int64) + np.asarray(binwidth, dtype=np.int64)
     coincidence_registers = np.zeros(channels, dtype=np.uint32)
     t0s = np.zeros(channels, dtype=TAGFORMAT['time'])
     t1s = np.zeros(channels, dtype=TAGFORMAT['time'])
@@ -195,21 +432,47 @@ def make_pattern_histogram(tc_iterable, binwidth, channels):
     histogram = np.zeros(2**channels, dtype=np.uint32)
     coincidence_registers_filtered = 0
     closed = 0
+    overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
 
     # iterate through array chunks
     i = -1
     for i, data_chunk in enumerate(tc_iterable):
-        _nb_make_cp_histogram(data_chunk, binwidth, channels, coincidence_registers, t0s,
-                              t1s, valids, histogram, coincidence_registers_filtered, closed)
+        _nb_make_cp_histogram(data_chunk, binwidths, channels, coincidence_registers, t0s,
+                              t1s, valids, histogram, coincidence_registers_filtered, closed,
+                              overflow_state)
     # at the end, flush the results using virtual tag
     if i > -1:
         data_chunk_end = np.array(
-            [(0, 1, data_chunk[-1]['time']+10*binwidth)], dtype=TAGFORMAT)
-        _nb_make_cp_histogram(data_chunk_end, binwidth, channels, coincidence_registers, t0s,
-                              t1s, valids, histogram, coincidence_registers_filtered, closed)
+            [(0, 1, data_chunk[-1]['time']+10*binwidths.max())], dtype=TAGFORMAT)
+        _nb_make_cp_histogram(data_chunk_end, binwidths, channels, coincidence_registers, t0s,
+                              t1s, valids, histogram, coincidence_registers_filtered, closed,
+                              overflow_state)
+    if return_stats:
+        return histogram, overflow_summary(overflow_state)
     return histogram
 
 
+def benchmark_engines(n_tags=10_000_000, channels=4, binwidth=1000,
+                      mean_spacing=1000, chunk_size=1 << 20, repeat=3):
+    """
+    Compare speed of the 'state' and 'cluster' engines on random tags.
+    Returns:
+        dictionary engine: best time (s) of make_histogram()
+    """
+    rng = np.random.default_rng(0)
+    data = np.zeros(n_tags, dtype=TAGFORMAT)
+    data['channel'] = rng.integers(1, channels+1, n_tags)
+    data['time'] = np.cumsum(rng.exponential(mean_spacing, n_tags).astype(np.int64))
+    chunks = [data[i:i+chunk_size] for i in range(0, n_tags, chunk_size)]
+    results = {}
+    for engine in ('state', 'cluster'):
+        make_histogram(chunks[:1], binwidth, channels, engine=engine)  # compile
+        results[engine] = min(timeit.repeat(
+            lambda: make_histogram(chunks, binwidth, channels, engine=engine),
+            number=1, repeat=repeat))
+    return results
+
+
 def get_pattern_description(channels):
     """
     Returns click pattern decsription for each entry in the histogram.
@@ -246,14 +509,206 @@ def iterate_chunks_filereader(file_reader_object, chunksize=1024):
         data = file_reader_object.getData(chunksize)
         actual_chunksize = data.size
         chunk = np.empty((actual_chunksize,), dtype=TAGFORMAT)
-        chunk['overflow'] = data.getOverflows()
+        # type in the low byte, missed events in the upper 16 bits
+        chunk['overflow'] = data.getEventTypes().astype(np.uint32) \
+            | (data.getMissedEvents().astype(np.uint32) << 16)
         chunk['time'] = data.getTimestamps()
         chunk['channel'] = data.getChannels()
         yield chunk
 
+
+def _next_shifted_chunk(iterator, channel_offset, time_offset):
+    """Next non-empty chunk of the source with applied offsets, None at the end."""
+    for data_chunk in iterator:
+        if data_chunk.size == 0:
+            continue
+        chunk = data_chunk.copy()
+        chunk['channel'] += channel_offset
+        chunk['time'] += time_offset
+        return chunk
+    return None
+
+
+def iterate_merged_chunks(sources, channel_offsets=None, time_offsets=None):
+    """
+    Merge several chronologically sorted tag sources (e.g. dumps of
+    synchronized Timetaggers) into one chronological stream of TAGFORMAT
+    chunks. Only one chunk per source is held in memory: every step emits
+    all tags up to the smallest last timestamp of the buffered chunks and
+    refills the exhausted buffer.
+
+    Args:
+        sources : list of iterables of TAGFORMAT chunks, such as
+          iterate_chunks() or iterate_chunks_filereader() generators
+        channel_offsets : list of numbers added to the channels of each
+          source, e.g. [0, 4] to map channels 1-4 of the second tagger to 5-8
+        time_offsets : list of numbers added to the timestamps of each source
+    Example:
+        sources = [iterate_chunks(fn1, 1 << 20), iterate_chunks(fn2, 1 << 20)]
+        merged = iterate_merged_chunks(sources, [0, 4], [0, 1250])
+        histogram = make_histogram(merged, 1000, 8)
+    """
+    n_sources = len(sources)
+    if channel_offsets is None:
+        channel_offsets = [0]*n_sources
+    if time_offsets is None:
+        time_offsets = [0]*n_sources
+    iterators = [iter(source) for source in sources]
+    buffers = [_next_shifted_chunk(iterators[i], channel_offsets[i], time_offsets[i])
+               for i in range(n_sources)]
+    while True:
+        live = [i for i in range(n_sources) if buffers[i] is not None]
+        if not live:
+            return
+        horizon = min(buffers[i][-1]['time'] for i in live)
+        pieces = []
+        for i in live:
+            n_ready = np.searchsorted(buffers[i]['time'], horizon, side='right')
+            pieces.append(buffers[i][:n_ready])
+            buffers[i] = buffers[i][n_ready:]
+            if buffers[i].size == 0:
+                buffers[i] = _next_shifted_chunk(
+                    iterators[i], channel_offsets[i], time_offsets[i])
+        if len(pieces) == 1:
+            yield pieces[0]
+            continue
+        merged = np.concatenate(pieces)
+        # stable sort is a merge of the sorted runs here
+        yield merged[np.argsort(merged['time'], kind='stable')]
+
+
+def index_file_name(file_name):
+    """Name of the sidecar time index of the dump file."""
+    return f"{file_name}.tidx.npz"
+
+
+def _map_records(file_name):
+    """
+    Read-only memory map of the complete records of the dump file.
+    A partial record at the end of a file still being written is left out.
+    """
+    n_records = os.path.getsize(file_name) // TAGFORMAT.itemsize
+    if n_records == 0:
+        return np.zeros(0, dtype=TAGFORMAT)
+    return np.memmap(file_name, dtype=TAGFORMAT, mode='r', shape=(n_records,))
+
+
+def _header_digest(records):
+    """CRC of the first records, identifies the dump file behind an index."""
+    return zlib.crc32(np.ascontiguousarray(records[:HEADER_RECORDS]).tobytes())
+
+
+def build_time_index(file_name, stride=65536, update=True):
+    """
+    Build (or extend) sparse time index of the raw dumped file (the old style).
+    Timestamp of every stride-th record is stored to the sidecar file
+    index_file_name(file_name). If the index already exists and update
+    is True, only the records appended to the dump since the last call
+    are indexed. The index is rebuilt when the file was truncated or
+    replaced (different first records or indexed timestamps).
+
+    Args:
+        file_name : path to the dump file
+        stride : number of records between indexed timestamps
+        update : reuse existing index when possible
+    Returns:
+        stride, int64 ndarray of indexed timestamps
+    """
+    times = np.zeros(0, dtype=np.int64)
+    idx_name = index_file_name(file_name)
+    records = _map_records(file_name)
+    n_records = records.size
+    header = _header_digest(records)
+    if update:
+        try:
+            with np.load(idx_name) as idx:
+                if (int(idx['stride']) == stride
+                        and int(idx['n_records']) <= n_records
+                        and 'header' in idx and int(idx['header']) == header):
+                    times = idx['times']
+        except FileNotFoundError:
+            pass
+        # the last indexed record has to be still the same
+        if times.size and records['time'][(times.size - 1)*stride] != times[-1]:
+            times = np.zeros(0, dtype=np.int64)
+    first = times.size * stride
+    if first < n_records:
+        new_times = np.array(records['time'][first::stride], dtype=np.int64)
+        times = np.concatenate((times, new_times))
+        np.savez(idx_name, stride=stride, times=times, n_records=n_records,
+                 header=header)
+    del records
+    return stride, times
+
+
+def find_record(file_name, timestamp, index=None):
+    """
+    Find the number of the first record with time >= timestamp.
+    Only one stride of records is read from the file.
+    Args:
+        file_name : path to the dump file
+        timestamp : searched tag time
+        index : (stride, times) tuple from build_time_index(), built when None
+    Returns:
+        record number (int)
+    """
+    stride, times = build_time_index(file_name) if index is None else index
+    block = int(np.searchsorted(times, timestamp, side='left')) - 1
+    if block < 0:
+        return 0
+    records = _map_records(file_name)
+    first = block * stride
+    block_times = np.array(records['time'][first:first + stride + 1])
+    del records
+    return first + int(np.searchsorted(block_times, timestamp, side='left'))
+
+
+def iterate_chunks_time_range(file_name, t_start, t_stop=None, chunk_size=1024,
+                              index=None):
+    """
+    Iterate through the records of the raw dumped file (the old style) with
+    t_start <= time < t_stop in chunks of the defined size. The sparse
+    time index is used to seek directly to t_start, so only the requested
+    window is read from the disk. Yielded chunks can be passed to
+    make_histogram() and make_pattern_histogram().
+
+    Args:
+        file_name : path to the dump file
+        t_start, t_stop : time window, t_stop=None reads until the end
+        chunk_size : number of records per chunk
+        index : (stride, times) tuple from build_time_index(), built when None
+    """
+    if index is None:
+        index = build_time_index(file_name)
+    first = find_record(file_name, t_start, index)
+    n_bytes = int(chunk_size * TAGFORMAT.itemsize)
+    with open(file_name, 'rb') as tagfile:
+        tagfile.seek(first * TAGFORMAT.itemsize, 0)
+        while True:
+            data_buffer = tagfile.read(n_bytes)
+            if len(data_buffer) < TAGFORMAT.itemsize:
+                break
+            data = np.frombuffer(
+                data_buffer[:len(data_buffer) - len(data_buffer) % TAGFORMAT.itemsize],
+                dtype=TAGFORMAT)
+            if t_stop is not None and data[-1]['time'] >= t_stop:
+                data = data[:np.searchsorted(data['time'], t_stop, side='left')]
+                if data.size > 0:
+                    yield data
+                break
+            yield data
+
+
 # example
 # if __name__ == '__main__':
 #     fn = "myfile.dat"
 #     chunk_generator = iterate_chunks(fn, 2*1024*1024)
 #     histogram = make_histogram(chunk_generator, 1000, 4)
 #     print(histogram)
+#     # histogram of 1 s window in the middle of the file
+#     index = build_time_index(fn)
+#     chunk_generator = iterate_chunks_time_range(fn, 3600e12, 3601e12, index=index)
+#     print(make_histogram(chunk_generator, 1000, 4))
+#     # the cluster coincidence definition, vectorized
+#     print(make_histogram(iterate_chunks(fn, 2*1024*1024), 1000, 4, engine='cluster'))
+#     print(benchmark_engines())
@@ -0,0 +1,139 @@
+"""
+Optional hot-path instrumentation of the custom measurements.
+
+The custom measurements call enter() at the beginning of process(),
+add_kernel_time() around the compiled kernel and leave() at the end.
+The collected numbers tell whether a backlog of tags is caused by the
+kernel itself, by the Python code around it or by the time the mutex
+is held, see get_summary().
+The tags are counted by the compiled kernels themselves into a small
+tag_counts array (COUNT_* fields), so the statistics cost no extra pass
+over the block.
+
+Example:
+    stats = ProcessStats(log_interval=10)
+    cc_meas = CustomCoincidenceOrder(tagger, [1, 2, 3, 4], 1000, stats=stats)
+    ...
+    print(cc_meas.getStats())
+"""
+
+from time import perf_counter, time
+import numpy as np
+
+# fields of the tag_counts array filled by the kernels
+COUNT_PROCESSED = 0  # time tags of the registered channels
+COUNT_SKIPPED = 1  # other tags seen by the kernel
+COUNT_SIZE = 2
+
+
+class ProcessStats():
+    """
+    Counters and timings of the process() calls.
+
+    The lag of a block is the wall clock at the end of process() minus
+    the tagger end_time of the block, taken relative to the smallest
+    such difference seen so far (the tagger clock has an unknown
+    offset). A growing lag means the measurement falls behind.
+    """
+
+    def __init__(self, log_interval=None, latency_window=4096,
+                 latency_edges=None):
+        """
+        Args:
+            log_interval : print summary every log_interval seconds,
+              None disables the log
+            latency_window : number of recent blocks kept for the
+              latency histogram
+            latency_edges : bin edges (s) of the latency histogram,
+              logarithmic from 10 us to 10 s by default
+        """
+        self.log_interval = log_interval
+        self.latencies = np.zeros(latency_window, dtype=np.float64)
+        if latency_edges is None:
+            latency_edges = np.concatenate(([0], np.logspace(-5, 1, 19)))
+        self.latency_edges = np.asarray(latency_edges, dtype=np.float64)
+        self.clear()
+
+    def clear(self):
+        self.blocks = 0
+        self.tags = 0
+        self.processed = 0
+        self.skipped = 0
+        self.max_block = 0
+        self.kernel_time = 0.0
+        self.hold_time = 0.0
+        self.min_offset = np.inf
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.n_latencies = 0
+        self._t_enter = 0.0
+        self._t_log = time()
+
+    def enter(self):
+        """Mark the beginning of process()."""
+        self._t_enter = perf_counter()
+
+    def add_kernel_time(self, duration):
+        """Add time (s) spent in the compiled kernel."""
+        self.kernel_time += duration
+
+    def leave(self, n_tags, tag_counts, end_time):
+        """
+        Mark the end of process() and account the block.
+        Args:
+            n_tags : number of incoming tags of the block
+            tag_counts : int64 ndarray (COUNT_*) with the numbers of tags
+              processed and skipped by the kernel since the clear
+            end_time : end timestamp (ps) of the block
+        """
+        self.blocks += 1
+        self.tags += n_tags
+        self.processed = int(tag_counts[COUNT_PROCESSED])
+        self.skipped = int(tag_counts[COUNT_SKIPPED])
+        self.max_block = max(self.max_block, n_tags)
+        now = time()
+        offset = now - end_time*1e-12
+        self.min_offset = min(self.min_offset, offset)
+        self.lag = offset - self.min_offset
+        self.max_lag = max(self.max_lag, self.lag)
+        self.latencies[self.n_latencies % self.latencies.size] = self.lag
+        self.n_latencies += 1
+        self.hold_time += perf_counter() - self._t_enter
+        if self.log_interval is not None and now - self._t_log > self.log_interval:
+            self._t_log = now
+            print(self.format_summary())
+
+    def get_summary(self):
+        """
+        Returns:
+            dictionary with tag counts (held are the tags not passed to
+            the kernel yet or dropped before it by the software delay
+            stage), times (s) spent in the kernel and
+            holding the mutex, current and maximum lag (s) and histogram
+            of recent lags with its bin edges
+        """
+        recent = self.latencies[:min(self.n_latencies, self.latencies.size)]
+        latency_histogram, _ = np.histogram(recent, self.latency_edges)
+        return {
+            "blocks": self.blocks,
+            "tags": self.tags,
+            "tags_per_block": self.tags/self.blocks if self.blocks else 0.0,
+            "max_block": self.max_block,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "held": self.tags - self.processed - self.skipped,
+            "kernel_time": self.kernel_time,
+            "hold_time": self.hold_time,
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "latency_histogram": latency_histogram,
+            "latency_edges": self.latency_edges.copy()
+        }
+
+    def format_summary(self):
+        """One-line readable summary."""
+        rate = self.processed/self.kernel_time if self.kernel_time > 0 else 0.0
+        return (f"ProcessStats: {self.blocks} blocks, {self.tags} tags "
+                f"({self.skipped} skipped), kernel {self.kernel_time:.3f} s "
+                f"({rate/1e6:.2f} Mtags/s), mutex {self.hold_time:.3f} s, "
+                f"lag {self.lag*1e3:.1f} ms (max {self.max_lag*1e3:.1f} ms)")
@@ -0,0 +1,141 @@
+"""
+Precision tracking for the custom coincidence measurements.
+
+The monitor watches selected bins of a histogram (or a ratio of two
+groups of bins) while the data comes in, estimates the Poisson relative
+error and the time needed to reach the requested precision. The custom
+measurements call update() at the end of each processed block and
+expose the result via getPrecision() and waitUntilPrecise().
+
+Example:
+    monitor = PrecisionMonitor(ratio=([3], [2]), target=0.01)
+    cc_meas = CustomCoincidenceOrder(tagger, [1, 2, 3, 4], 1000,
+                                     precision=monitor)
+    cc_meas.startFor(int(3600e12))
+    cc_meas.waitUntilPrecise()  # stops the measurement when precise enough
+    print(cc_meas.getPrecision())
+"""
+
+import threading
+import numpy as np
+
+
+class PrecisionMonitor():
+    """
+    Poisson relative error and ETA of chosen histogram bins.
+
+    The error of a sum of bins with N counts is 1/sqrt(N), the error
+    of a ratio A/B of two independent sums is sqrt(1/A + 1/B). Both
+    scale as 1/sqrt(T) with the acquisition time T, so the remaining
+    time is estimated as T*((error/target)**2 - 1).
+    """
+
+    def __init__(self, bins=None, ratio=None, target=0.01):
+        """
+        Args:
+            bins : list of histogram indices whose sum is watched
+            ratio : tuple (numerator bins, denominator bins), watch the
+              ratio of the two sums instead of bins
+            target : requested relative error
+        """
+        if (bins is None) == (ratio is None):
+            raise ValueError("PrecisionMonitor: specify either bins or ratio.")
+        if bins is not None:
+            self.numerator = np.array(bins, dtype=np.int64)
+            self.denominator = None
+        else:
+            self.numerator = np.array(ratio[0], dtype=np.int64)
+            self.denominator = np.array(ratio[1], dtype=np.int64)
+        self.target = target
+        self.done = threading.Event()
+        self.clear()
+
+    def clear(self):
+        self.relative_error = np.inf
+        self.elapsed = 0
+        self.eta = np.inf
+        self.counts = 0
+        self.value = np.nan
+        self.done.clear()
+
+    def update(self, histogram, elapsed):
+        """
+        Recalculate the error from the current histogram.
+        Args:
+            histogram : ndarray of counts
+            elapsed : acquisition time so far (ps)
+        Returns:
+            True if the target precision is reached
+        """
+        self.elapsed = elapsed
+        numerator = int(histogram[self.numerator].sum())
+        self.counts = numerator
+        if self.denominator is None:
+            self.value = numerator
+            inv_counts = 1/numerator if numerator > 0 else np.inf
+        else:
+            denominator = int(histogram[self.denominator].sum())
+            if numerator > 0 and denominator > 0:
+                self.value = numerator/denominator
+                inv_counts = 1/numerator + 1/denominator
+            else:
+                inv_counts = np.inf
+        self.relative_error = np.sqrt(inv_counts)
+        if self.relative_error <= self.target:
+            self.eta = 0
+            self.done.set()
+            return True
+        if np.isfinite(self.relative_error) and elapsed > 0:
+            self.eta = elapsed*((self.relative_error/self.target)**2 - 1)
+        return False
+
+    def get_summary(self):
+        """
+        Returns:
+            dictionary with value, relative error, target, elapsed time
+            and estimated remaining time (both in ps)
+        """
+        return {
+            "value": self.value,
+            "counts": self.counts,
+            "relative_error": self.relative_error,
+            "target": self.target,
+            "elapsed": self.elapsed,
+            "eta": self.eta,
+            "done": self.done.is_set()
+        }
+
+
+class PrecisionMixin():
+    """
+    getPrecision() and waitUntilPrecise() of the custom measurements.
+
+    The measurement provides self.precision (PrecisionMonitor or None),
+    self.mutex and stop(), as TimeTagger.CustomMeasurement does.
+    """
+
+    def getPrecision(self):
+        """
+        Current relative error and estimated remaining time, see
+        PrecisionMonitor.get_summary(), None without a monitor.
+        """
+        if self.precision is None:
+            return None
+        with self.mutex:
+            return self.precision.get_summary()
+
+    def waitUntilPrecise(self, timeout=None, stop=True):
+        """
+        Block until the precision target is reached.
+        Args:
+            timeout : maximum waiting time (s), None waits forever
+            stop : stop the measurement when the target is reached
+        Returns:
+            True if the target was reached
+        """
+        if self.precision is None:
+            raise ValueError("waitUntilPrecise: the measurement was created without precision monitor.")
+        reached = self.precision.done.wait(timeout)
+        if reached and stop:
+            self.stop()
+        return reached
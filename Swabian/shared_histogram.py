@@ -0,0 +1,179 @@
+"""
+Publication of live histograms to other local processes via shared memory.
+
+The measurement process owns SharedHistogramWriter and publishes the
+histogram after each processed block. Any number of processes (plots,
+feedback loops) attach SharedHistogramReader by the block name and read
+consistent snapshots without talking to the tagger process.
+
+Consistency is guaranteed by a sequence lock: the writer makes the
+sequence counter odd, writes the data and makes it even again. The
+reader copies the data and retries when the counter was odd or has
+changed during the copy.
+
+Block layout: header of HEADER_SIZE int64 values (see HDR_*), followed
+by rows*cols uint64 histogram values.
+
+Example (reader process):
+    reader = SharedHistogramReader("cc_order")
+    histogram, publications, end_time = reader.read()
+    reader.close()
+"""
+
+from multiprocessing import shared_memory
+from time import time, sleep
+import numpy as np
+
+MAGIC = 0x51_4F_4C_4F_48_49_53_54  # "QOLOHIST"
+HEADER_SIZE = 8
+# header fields
+HDR_MAGIC = 0
+HDR_SEQ = 1  # sequence lock counter, odd while writing
+HDR_ROWS = 2
+HDR_COLS = 3
+HDR_PUBLICATIONS = 4  # number of published snapshots
+HDR_END_TIME = 5  # tagger end_time (ps) of the last published block
+
+
+def _attach(name):
+    """Attach existing block without letting this process unlink it on exit."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers attached blocks to the resource tracker
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedHistogramWriter():
+    """
+    Owner of the shared memory block with a published histogram.
+    """
+
+    def __init__(self, name, shape, min_interval=0.0, replace=True):
+        """
+        Args:
+            name : name of the shared memory block
+            shape : shape of the histogram (1-D or 2-D)
+            min_interval : minimal time (s) between two publications,
+              more frequent calls of publish() are ignored
+            replace : remove an existing block of the same name, e.g.
+              left over by a crashed measurement process, False raises
+              FileExistsError instead
+        """
+        shape = tuple(int(n) for n in np.atleast_1d(shape))
+        rows, cols = (1, shape[0]) if len(shape) == 1 else shape
+        self.shape = shape
+        self.min_interval = min_interval
+        size = 8*(HEADER_SIZE + rows*cols)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            print(f"SharedHistogramWriter: replacing existing block {name}.")
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64,
+                                 buffer=self.shm.buf)
+        self.data = np.ndarray(shape, dtype=np.uint64, buffer=self.shm.buf,
+                               offset=8*HEADER_SIZE)
+        self.header[:] = 0
+        self.header[HDR_ROWS] = rows
+        self.header[HDR_COLS] = cols
+        self.data[...] = 0
+        self.header[HDR_MAGIC] = MAGIC
+        self._t_last = 0.0
+
+    def publish(self, histogram, end_time=0, force=False):
+        """
+        Copy histogram to the shared block.
+        Args:
+            histogram : ndarray of the writer's shape
+            end_time : tagger time (ps) of the data
+            force : ignore min_interval
+        Returns:
+            True if the histogram was published
+        """
+        if not force and self.min_interval > 0:
+            now = time()
+            if now - self._t_last < self.min_interval:
+                return False
+            self._t_last = now
+        self.header[HDR_SEQ] += 1
+        self.data[...] = histogram
+        self.header[HDR_PUBLICATIONS] += 1
+        self.header[HDR_END_TIME] = end_time
+        self.header[HDR_SEQ] += 1
+        return True
+
+    def close(self):
+        """Release and remove the shared block."""
+        if self.shm is None:
+            return
+        del self.header, self.data
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class SharedHistogramReader():
+    """
+    Read-only view of a histogram published by SharedHistogramWriter.
+    Meant for other processes than the one owning the writer.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name : name of the shared memory block
+        """
+        self.shm = _attach(name)
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64,
+                                 buffer=self.shm.buf)
+        if self.header[HDR_MAGIC] != MAGIC:
+            self.shm.close()
+            raise ValueError(f"SharedHistogramReader: {name} is not a histogram block.")
+        rows, cols = int(self.header[HDR_ROWS]), int(self.header[HDR_COLS])
+        shape = (cols,) if rows == 1 else (rows, cols)
+        # zero-copy view, it may change while being read, use read()
+        self.view = np.ndarray(shape, dtype=np.uint64, buffer=self.shm.buf,
+                               offset=8*HEADER_SIZE)
+
+    def read(self, out=None, timeout=1.0):
+        """
+        Consistent snapshot of the published histogram.
+        Args:
+            out : optional preallocated uint64 ndarray for the result
+            timeout : give up retrying after timeout seconds
+        Returns:
+            histogram, number of publications, tagger end_time (ps)
+        """
+        out = np.empty_like(self.view) if out is None else out
+        t0 = time()
+        while True:
+            seq = self.header[HDR_SEQ]
+            if seq % 2 == 0:
+                out[...] = self.view
+                publications = int(self.header[HDR_PUBLICATIONS])
+                end_time = int(self.header[HDR_END_TIME])
+                if self.header[HDR_SEQ] == seq:
+                    return out, publications, end_time
+            if time() - t0 > timeout:
+                raise TimeoutError("SharedHistogramReader: writer holds the lock.")
+            sleep(0)
+
+    def sequence(self):
+        """Sequence counter, changes with every publication."""
+        return int(self.header[HDR_SEQ])
+
+    def close(self):
+        if self.shm is None:
+            return
+        del self.header, self.view
+        self.shm.close()
+        self.shm = None
@@ -8,19 +8,36 @@ starek.robert@gmail.com
 V: 1.1
 """
 
+from time import perf_counter
 import numpy as np
 import numba
 import numba.typed
 import numba.types
 import TimeTagger
-
-# Timetagger format
-TAGFORMAT = np.dtype([
-    ('type', np.dtype('<u4')),
-    ('overflow', np.dtype('<u4')),
-    ('channel', np.dtype('<i4')),
-    ('time', np.dtype('int64'))
-])
+from precision_monitor import PrecisionMixin
+from measurement_stats import COUNT_PROCESSED, COUNT_SKIPPED, COUNT_SIZE
+
+# Timetagger format (layout of the tags passed to process())
+TAGFORMAT = np.dtype({
+    'names': ['type', 'missed_events', 'channel', 'time'],
+    'formats': [np.dtype('<u1'), np.dtype('<u2'), np.dtype('<i4'), np.dtype('int64')],
+    'offsets': [0, 2, 4, 8],
+    'itemsize': 16
+})
+# tag types
+TAG_TIME = 0
+TAG_ERROR = 1
+TAG_OVERFLOW_BEGIN = 2
+TAG_OVERFLOW_END = 3
+TAG_MISSED_EVENTS = 4
+# fields of the overflow_state array used by the kernels
+OVF_ACTIVE = 0  # 1 while inside overflow region
+OVF_BEGIN = 1  # time of the last OverflowBegin
+OVF_DEAD_TIME = 2  # total time spent in overflow regions
+OVF_MISSED = 3  # total number of missed events
+OVF_REGIONS = 4  # number of overflow regions
+OVF_DISCARDED = 5  # coincidence windows dropped due to overflow
+OVF_SIZE = 6
 
 HAMMING_LUT = np.array([bin(i).count("1")
                         for i in range(2**8)], dtype=np.uint8)
@@ -42,17 +59,302 @@ def numba_ham32(i):
     return bitcount
 
 
-class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
+@numba.jit(nopython=True, nogil=True)
+def overflow_tag(tag, overflow_state, valids, coincidence_registers, channels):
+    """
+    Update overflow accounting from a non-TimeTag tag. Coincidence windows
+    open at the beginning of an overflow region are discarded, because
+    some of their tags may have been lost.
+
+    Warning: it mutates passed arrays.
+
+    Args:
+        tag : record of TAGFORMAT with type != 0
+        overflow_state : int64 ndarray of size OVF_SIZE
+        valids : bool ndarray
+        coincidence_registers : uint32 ndarray
+        channels : number of channels
+    """
+    tag_type = tag['type']
+    if tag_type == TAG_OVERFLOW_BEGIN:
+        if overflow_state[OVF_ACTIVE] == 0:
+            overflow_state[OVF_ACTIVE] = 1
+            overflow_state[OVF_BEGIN] = tag['time']
+            overflow_state[OVF_REGIONS] += 1
+            for j in range(channels):
+                if valids[j]:
+                    overflow_state[OVF_DISCARDED] += 1
+                    valids[j] = False
+                    coincidence_registers[j] = 0
+    elif tag_type == TAG_OVERFLOW_END:
+        if overflow_state[OVF_ACTIVE] == 1:
+            overflow_state[OVF_ACTIVE] = 0
+            overflow_state[OVF_DEAD_TIME] += tag['time'] - overflow_state[OVF_BEGIN]
+    elif tag_type == TAG_MISSED_EVENTS:
+        overflow_state[OVF_MISSED] += tag['missed_events']
+
+
+def overflow_summary(overflow_state):
+    """
+    Readable form of the overflow_state array.
+    Returns:
+        dictionary with dead time (ps), number of missed events, number of
+        overflow regions, number of discarded windows and whether the
+        measurement is currently in overflow
+    """
+    return {
+        "dead_time": int(overflow_state[OVF_DEAD_TIME]),
+        "missed_events": int(overflow_state[OVF_MISSED]),
+        "overflow_regions": int(overflow_state[OVF_REGIONS]),
+        "discarded_windows": int(overflow_state[OVF_DISCARDED]),
+        "in_overflow": bool(overflow_state[OVF_ACTIVE])
+    }
+
+
+@numba.jit(nopython=True, nogil=True)
+def _heap_push(heap_times, heap_channels, heap_info, size,
+               timestamp, channel, info):
+    """Push (timestamp, channel, info) to the binary min-heap, return new size."""
+    i = size
+    while i > 0:
+        parent = (i - 1) >> 1
+        if heap_times[parent] <= timestamp:
+            break
+        heap_times[i] = heap_times[parent]
+        heap_channels[i] = heap_channels[parent]
+        heap_info[i] = heap_info[parent]
+        i = parent
+    heap_times[i] = timestamp
+    heap_channels[i] = channel
+    heap_info[i] = info
+    return size + 1
+
+
+@numba.jit(nopython=True, nogil=True)
+def _heap_pop(heap_times, heap_channels, heap_info, size):
+    """Remove the root of the binary min-heap, return new size."""
+    size -= 1
+    timestamp = heap_times[size]
+    channel = heap_channels[size]
+    info = heap_info[size]
+    i = 0
+    while True:
+        child = 2*i + 1
+        if child >= size:
+            break
+        if child + 1 < size and heap_times[child + 1] < heap_times[child]:
+            child += 1
+        if heap_times[child] >= timestamp:
+            break
+        heap_times[i] = heap_times[child]
+        heap_channels[i] = heap_channels[child]
+        heap_info[i] = heap_info[child]
+        i = child
+    heap_times[i] = timestamp
+    heap_channels[i] = channel
+    heap_info[i] = info
+    return size
+
+
+@numba.jit(nopython=True, nogil=True)
+def _heap_release(heap_times, heap_channels, heap_info, out, n_out):
+    """Copy the root of the heap to out[n_out] as a tag."""
+    out[n_out]['type'] = heap_info[0] & 0xff
+    out[n_out]['missed_events'] = heap_info[0] >> 8
+    out[n_out]['channel'] = heap_channels[0]
+    out[n_out]['time'] = heap_times[0]
+
+
+@numba.jit(nopython=True, nogil=True)
+def reorder_delayed_tags(tags, channel_lut, delays, min_delay, max_delay,
+                         heap_times, heap_channels, heap_info, heap_size,
+                         out, n_out):
+    """
+    Apply per-channel software delays and restore chronological order.
+
+    Tags are delayed and pushed to a bounded min-heap. A tag is released
+    to the output as soon as no later incoming tag can precede it, i.e.
+    when its delayed time is not greater than the raw time of the current
+    tag plus the smallest delay. The heap thus holds at most the tags
+    from the last (max(delays) - min(delays)) interval.
+
+    OverflowBegin tags are shifted by the smallest delay and the other
+    non-TimeTag tags by the largest one, so the overflow region covers
+    all delayed tags that could be affected.
+
+    Warning: it mutates passed arrays.
+
+    Args:
+        tags : ndarray of TAGFORMAT dtype
+        channel_lut : typed dict channel number -> channel index
+        delays : int64 ndarray of delays per channel index
+        min_delay, max_delay : int, smallest and largest value in delays
+        heap_times, heap_channels, heap_info : int64 ndarrays holding
+          the heap, heap_info is tag type + (missed events << 8)
+        heap_size : int, number of tags in the heap
+        out : ndarray of TAGFORMAT dtype receiving the sorted tags
+        n_out : int, number of tags already written to out
+    Returns:
+        number of consumed tags, heap size, number of tags in out
+    """
+    capacity = heap_times.size
+    n_in = 0
+    for tag in tags:
+        if heap_size == capacity:
+            # the caller has to grow the heap and resubmit the rest
+            break
+        n_in += 1
+        channel_num = tag['channel']
+        if tag['type'] == TAG_TIME:
+            if channel_num not in channel_lut:
+                continue
+            delayed = tag['time'] + delays[channel_lut[channel_num]]
+        elif tag['type'] == TAG_OVERFLOW_BEGIN:
+            delayed = tag['time'] + min_delay
+        else:
+            delayed = tag['time'] + max_delay
+        horizon = tag['time'] + min_delay
+        while heap_size > 0 and heap_times[0] <= horizon:
+            _heap_release(heap_times, heap_channels, heap_info, out, n_out)
+            n_out += 1
+            heap_size = _heap_pop(heap_times, heap_channels, heap_info, heap_size)
+        heap_size = _heap_push(heap_times, heap_channels, heap_info, heap_size,
+                               delayed, channel_num,
+                               tag['type'] + (np.int64(tag['missed_events']) << 8))
+    return n_in, heap_size, n_out
+
+
+@numba.jit(nopython=True, nogil=True)
+def flush_delayed_tags(heap_times, heap_channels, heap_info, heap_size, out):
+    """
+    Empty the min-heap to out in chronological order.
+    Returns:
+        number of tags in out
+    """
+    n_out = 0
+    while heap_size > 0:
+        _heap_release(heap_times, heap_channels, heap_info, out, n_out)
+        n_out += 1
+        heap_size = _heap_pop(heap_times, heap_channels, heap_info, heap_size)
+    return n_out
+
+
+class TagReorderBuffer():
+    """
+    Software delay stage for the custom measurements.
+
+    The incoming tags are shifted by per-channel delays and passed
+    through a preallocated min-heap whose horizon is the spread of
+    the delays, so the output is in chronological order again.
+
+    Example:
+        buf = TagReorderBuffer(channel_lut, delays, channels)
+        sorted_tags = buf.push(incoming_tags)
+        ...
+        remaining_tags = buf.flush()
+    """
+
+    def __init__(self, channel_lut, delays, channels, capacity=1 << 16):
+        """
+        Args:
+            channel_lut : typed dict channel number -> channel index
+            delays : dict of channel number: delay (ps), missing channels
+              have zero delay
+            channels : list of channel numbers
+            capacity : initial number of tags the heap can hold
+        """
+        self.channel_lut = channel_lut
+        self.delays = np.array([delays.get(int(ch), 0) for ch in channels],
+                               dtype=np.int64)
+        self.min_delay = int(self.delays.min())
+        self.max_delay = int(self.delays.max())
+        self.heap_times = np.zeros(capacity, dtype=np.int64)
+        self.heap_channels = np.zeros(capacity, dtype=np.int64)
+        self.heap_info = np.zeros(capacity, dtype=np.int64)
+        self.heap_size = 0
+        self.out = np.zeros(2*capacity, dtype=TAGFORMAT)
+
+    def clear(self):
+        self.heap_size = 0
+
+    def _grow(self):
+        capacity = 2*self.heap_times.size
+        heap_times = np.zeros(capacity, dtype=np.int64)
+        heap_channels = np.zeros(capacity, dtype=np.int64)
+        heap_info = np.zeros(capacity, dtype=np.int64)
+        heap_times[:self.heap_size] = self.heap_times[:self.heap_size]
+        heap_channels[:self.heap_size] = self.heap_channels[:self.heap_size]
+        heap_info[:self.heap_size] = self.heap_info[:self.heap_size]
+        self.heap_times = heap_times
+        self.heap_channels = heap_channels
+        self.heap_info = heap_info
+
+    def push(self, tags):
+        """
+        Delay tags and return those which are already in order.
+        The returned array is a view of an internal buffer, it is valid
+        until the next call.
+        """
+        n_out = 0
+        n_done = 0
+        while n_done < tags.size:
+            required = tags.size - n_done + self.heap_times.size + n_out
+            if self.out.size < required:
+                out = np.zeros(2*required, dtype=TAGFORMAT)
+                out[:n_out] = self.out[:n_out]
+                self.out = out
+            n_in, self.heap_size, n_out = reorder_delayed_tags(
+                tags[n_done:], self.channel_lut, self.delays,
+                self.min_delay, self.max_delay,
+                self.heap_times, self.heap_channels, self.heap_info,
+                self.heap_size, self.out, n_out)
+            n_done += n_in
+            if self.heap_size == self.heap_times.size:
+                self._grow()
+        return self.out[:n_out]
+
+    def flush(self):
+        """Return all remaining tags in chronological order."""
+        if self.out.size < self.heap_size:
+            self.out = np.zeros(self.heap_size, dtype=TAGFORMAT)
+        n_out = flush_delayed_tags(
+            self.heap_times, self.heap_channels, self.heap_info,
+            self.heap_size, self.out)
+        self.heap_size = 0
+        return self.out[:n_out]
+
+
+class CustomCoincidenceOrder(PrecisionMixin, TimeTagger.CustomMeasurement):
     """
     Custom measurement class for on-the-fly counting histogram of coincidence order.
     Warning: it does not support big virtual delays between channel because the
-    coincidence tag should always come in chronological order.
+    coincidence tag should always come in chronological order. Use the delays
+    argument instead, it applies the delays in software and sorts the tags
+    again with TagReorderBuffer.
     """
 
-    def __init__(self, tagger, channels, binwidth=1000):
+    def __init__(self, tagger, channels, binwidth=1000, delays=None,
+                 precision=None, stats=None, shm_name=None):
+        """
+        Args:
+            tagger : timetagger instance
+            channels : list of channel numbers
+            binwidth : coincidence window (ps), either one for all channels
+              or a list with window for each channel in channels
+            delays : optional dict of channel number: software delay (ps)
+            precision : optional PrecisionMonitor (precision_monitor.py)
+              watching the histogram, see waitUntilPrecise()
+            stats : optional ProcessStats (measurement_stats.py) collecting
+              timings of process(), see getStats()
+            shm_name : optional name of shared memory block where the
+              histogram is published for other processes, see
+              shared_histogram.SharedHistogramReader
+        """
         TimeTagger.CustomMeasurement.__init__(self, tagger)
         self.n_channels = len(channels)
-        self.binwidth = binwidth
+        self.binwidths = np.zeros(self.n_channels, dtype=np.int64) \
+            + np.asarray(binwidth, dtype=np.int64)
+        self.binwidth = int(self.binwidths.max())
         self.channels = channels
         self.channel_lut = numba.typed.Dict.empty(
             key_type=numba.types.int64,
@@ -61,6 +363,13 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
         for i, j in enumerate(self.channels):
             self.channel_lut[j] = i
         self.channels = np.array(self.channels, dtype=np.int64)
+        self.reorder_buffer = None
+        if delays:
+            self.reorder_buffer = TagReorderBuffer(
+                self.channel_lut, delays, self.channels)
+        self.precision = precision
+        self.stats = stats
+        self.publisher = None
 
         for channel_number in channels:
             self.register_channel(channel=channel_number)
@@ -68,17 +377,41 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
         self.last_timestamp = 0
 
         self.clear_impl()
+        if shm_name:
+            # optional, needs multiprocessing.shared_memory (Python >= 3.8)
+            from shared_histogram import SharedHistogramWriter
+            self.publisher = SharedHistogramWriter(shm_name, self.histogram.shape)
         self.finalize_init()
 
     def __del__(self):
         # The measurement must be stopped before deconstruction to avoid
         # concurrent process() calls.
         self.stop()
+        if self.publisher is not None:
+            self.publisher.close()
 
     def getData(self):
         with self.mutex:
             return self.histogram.copy()
 
+    def getOverflowStats(self):
+        """
+        Dead time and missed events caused by the tagger overflows,
+        see overflow_summary(). Use the dead time to correct the rates.
+        """
+        with self.mutex:
+            return overflow_summary(self.overflow_state)
+
+    def getStats(self):
+        """
+        Counters and timings of process(), see ProcessStats.get_summary(),
+        None when the measurement was created without stats.
+        """
+        if self.stats is None:
+            return None
+        with self.mutex:
+            return self.stats.get_summary()
+
     def getIndex(self):
         # This method does not depend on the internal state, so there is no
         # need for a lock.
@@ -95,34 +428,39 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
         self.coincidence_registers_filtered = 0
         self.closed = 0
         self.last_timestamp = 0
+        if self.reorder_buffer is not None:
+            self.reorder_buffer.clear()
+        self.start_time = None
+        if self.precision is not None:
+            self.precision.clear()
+        if self.stats is not None:
+            self.stats.clear()
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, force=True)
+        self.overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+        self.tag_counts = np.zeros(COUNT_SIZE, dtype=np.int64)
 
     def on_start(self):
         pass
 
     def on_stop(self):
         # The lock is already acquired within the backend.
+        # release tags held back by the software delays
+        if self.reorder_buffer is not None:
+            self._process_sorted(self.reorder_buffer.flush())
         # here maybe flush the last tag
         last_virtual_timestamp = np.array(
             [(0, 0, self.channels[0], self.last_timestamp+10*self.binwidth)], dtype=TAGFORMAT)
-        CustomCoincidenceOrder.fast_process(
-            last_virtual_timestamp,
-            self.binwidth,
-            self.n_channels,
-            self.coincidence_registers,
-            self.t0s,
-            self.t1s,
-            self.valids,
-            self.histogram,
-            self.coincidence_registers_filtered,
-            self.closed,
-            self.channel_lut)
+        self._process_sorted(last_virtual_timestamp, np.zeros(COUNT_SIZE, dtype=np.int64))
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, self.last_timestamp, force=True)
 
     @staticmethod
     @numba.jit(nopython=True, nogil=True)
-    def fast_process(tags, binwidth, channels,
+    def fast_process(tags, binwidths, channels,
                      coincidence_registers, t0s, t1s, valids,
                      histogram, coincidence_registers_filtered,
-                     closed, channel_lut
+                     closed, channel_lut, overflow_state, tag_counts
                      ):
         """
         A precompiled version of the histogram algorithm for better performance
@@ -136,22 +474,39 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
 
         Args:
             TAGFORMAT: ndarray of tagformat dtype holding timestamps
+            binwidths : int64 ndarray, window length opened by a tag of
+              each channel
             coincidence_registers : uint32 ndarray holding coincidence marks
             t0s, t1s : int64 ndarray holding register times
             valids : bool ndarray
             histogram : uint32 ndarray
             coincidence_registers_filtered : int32
             closed : int32
+            channel_lut : typed dict channel number -> channel index
+            overflow_state : int64 ndarray with overflow accounting (OVF_*)
+            tag_counts : int64 ndarray of size COUNT_SIZE, numbers of
+              processed and skipped tags are added to it
         Returns:
             last processed time stamp
         """
         for tag in tags:
             # tag.type can be: 0 - TimeTag, 1- Error, 2 - OverflowBegin, 3 -
             # OverflowEnd, 4 - MissedEvents
-            if tag['type'] != 0:
+            if tag['type'] != TAG_TIME:
+                tag_counts[COUNT_SKIPPED] += 1
+                overflow_tag(tag, overflow_state, valids,
+                             coincidence_registers, channels)
+                continue
+            if overflow_state[OVF_ACTIVE]:
+                # delayed tags from the overflow region
+                tag_counts[COUNT_SKIPPED] += 1
                 continue
             timestamp = tag['time']
             channel_num = tag['channel']
+            if channel_num not in channel_lut:
+                tag_counts[COUNT_SKIPPED] += 1
+                continue
+            tag_counts[COUNT_PROCESSED] += 1
 
             channel_id = channel_lut[channel_num]
 
@@ -174,7 +529,7 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
                 if idx > 0:
                     histogram[idx] += 1
             t0s[channel_id] = timestamp
-            t1s[channel_id] = timestamp + binwidth
+            t1s[channel_id] = timestamp + binwidths[channel_id]
             coincidence_registers[channel_id] = (1 << channel_id)
             valids[channel_id] = True
         return timestamp
@@ -200,9 +555,36 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
         end_time
             End timestamp of the of the current data block.
         """
+        if self.stats is not None:
+            self.stats.enter()
+        tags = incoming_tags
+        if self.reorder_buffer is not None:
+            tags = self.reorder_buffer.push(incoming_tags)
+        self._process_sorted(tags)
+        if self.precision is not None:
+            if self.start_time is None:
+                self.start_time = begin_time
+            self.precision.update(self.histogram, end_time - self.start_time)
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, end_time)
+        if self.stats is not None:
+            self.stats.leave(incoming_tags.size, self.tag_counts, end_time)
+
+    def _process_sorted(self, tags, tag_counts=None):
+        """
+        Pass chronologically ordered tags to the compiled kernel.
+        Tags are counted to self.tag_counts unless other tag_counts
+        array is given (virtual tags).
+        """
+        if tags.size == 0:
+            return
+        if tag_counts is None:
+            tag_counts = self.tag_counts
+        if self.stats is not None:
+            t_kernel = perf_counter()
         self.last_timestamp = CustomCoincidenceOrder.fast_process(
-            incoming_tags,
-            self.binwidth,
+            tags,
+            self.binwidths,
             self.n_channels,
             self.coincidence_registers,
             self.t0s,
@@ -211,23 +593,46 @@ class CustomCoincidenceOrder(TimeTagger.CustomMeasurement):
             self.histogram,
             self.coincidence_registers_filtered,
             self.closed,
-            self.channel_lut
+            self.channel_lut,
+            self.overflow_state,
+            tag_counts
         )
+        if self.stats is not None:
+            self.stats.add_kernel_time(perf_counter() - t_kernel)
 
 
-class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
+class CustomCoincidencePattern(PrecisionMixin, TimeTagger.CustomMeasurement):
     """
     Custom measurement class for on-the-fly counting histogram of coincidence order.
     Warning: it should not support big virtual delays between channel because the
     coincidence tag should always come in chronological order. But it seems that
     TimeTagger has some internal sorting mechanism, because when tested,
-    it works even with virtual delays.
+    it works even with virtual delays. Use the delays argument to apply the
+    delays in software with guaranteed chronological order.
     """
 
-    def __init__(self, tagger, channels, binwidth=1000):
+    def __init__(self, tagger, channels, binwidth=1000, delays=None,
+                 precision=None, stats=None, shm_name=None):
+        """
+        Args:
+            tagger : timetagger instance
+            channels : list of channel numbers
+            binwidth : coincidence window (ps), either one for all channels
+              or a list with window for each channel in channels
+            delays : optional dict of channel number: software delay (ps)
+            precision : optional PrecisionMonitor (precision_monitor.py)
+              watching the histogram, see waitUntilPrecise()
+            stats : optional ProcessStats (measurement_stats.py) collecting
+              timings of process(), see getStats()
+            shm_name : optional name of shared memory block where the
+              histogram is published for other processes, see
+              shared_histogram.SharedHistogramReader
+        """
         TimeTagger.CustomMeasurement.__init__(self, tagger)
         self.n_channels = len(channels)
-        self.binwidth = binwidth
+        self.binwidths = np.zeros(self.n_channels, dtype=np.int64) \
+            + np.asarray(binwidth, dtype=np.int64)
+        self.binwidth = int(self.binwidths.max())
         for channel_number in channels:
             self.register_channel(channel=channel_number)
         self.channels = channels
@@ -239,19 +644,50 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
             self.channel_lut[j] = i
 
         self.channels = np.array(self.channels, dtype=np.int64)
+        self.reorder_buffer = None
+        if delays:
+            self.reorder_buffer = TagReorderBuffer(
+                self.channel_lut, delays, self.channels)
+        self.precision = precision
+        self.stats = stats
+        self.publisher = None
 
         self.last_timestamp = 0
 
         self.clear_impl()
+        if shm_name:
+            # optional, needs multiprocessing.shared_memory (Python >= 3.8)
+            from shared_histogram import SharedHistogramWriter
+            self.publisher = SharedHistogramWriter(shm_name, self.histogram.shape)
         self.finalize_init()
 
     def __del__(self):
         self.stop()
+        if self.publisher is not None:
+            self.publisher.close()
 
     def getData(self):
         with self.mutex:
             return self.histogram.copy()
 
+    def getOverflowStats(self):
+        """
+        Dead time and missed events caused by the tagger overflows,
+        see overflow_summary(). Use the dead time to correct the rates.
+        """
+        with self.mutex:
+            return overflow_summary(self.overflow_state)
+
+    def getStats(self):
+        """
+        Counters and timings of process(), see ProcessStats.get_summary(),
+        None when the measurement was created without stats.
+        """
+        if self.stats is None:
+            return None
+        with self.mutex:
+            return self.stats.get_summary()
+
     def getIndex(self):
         """Binary representation of index number specifies the coincidence pattern."""
         arr = np.arange(0, int(2**self.n_channels))
@@ -267,6 +703,17 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
         self.coincidence_registers_filtered = 0
         self.closed = 0
         self.last_timestamp = 0
+        if self.reorder_buffer is not None:
+            self.reorder_buffer.clear()
+        self.start_time = None
+        if self.precision is not None:
+            self.precision.clear()
+        if self.stats is not None:
+            self.stats.clear()
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, force=True)
+        self.overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+        self.tag_counts = np.zeros(COUNT_SIZE, dtype=np.int64)
 
     def on_start(self):
         # The lock is already acquired within the backend.
@@ -274,28 +721,22 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
 
     def on_stop(self):
         # The lock is already acquired within the backend.
+        # release tags held back by the software delays
+        if self.reorder_buffer is not None:
+            self._process_sorted(self.reorder_buffer.flush())
         # here maybe flush the last tag
         last_virtual_timestamp = np.array(
             [(0, 0, self.channels[0], self.last_timestamp+10*self.binwidth)], dtype=TAGFORMAT)
-        CustomCoincidenceOrder.fast_process(
-            last_virtual_timestamp,
-            self.binwidth,
-            self.n_channels,
-            self.coincidence_registers,
-            self.t0s,
-            self.t1s,
-            self.valids,
-            self.histogram,
-            self.coincidence_registers_filtered,
-            self.closed,
-            self.channel_lut)
+        self._process_sorted(last_virtual_timestamp, np.zeros(COUNT_SIZE, dtype=np.int64))
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, self.last_timestamp, force=True)
 
     @staticmethod
     @numba.jit(nopython=True, nogil=True)
-    def fast_process(tags, binwidth, channels,
+    def fast_process(tags, binwidths, channels,
                      coincidence_registers, t0s, t1s, valids,
                      histogram, coincidence_registers_filtered,
-                     closed, channel_lut
+                     closed, channel_lut, overflow_state, tag_counts
                      ):
         """
         A precompiled version of the histogram algorithm for better performance
@@ -309,22 +750,39 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
 
         Args:
             TAGFORMAT: ndarray of tagformat dtype holding timestamps
+            binwidths : int64 ndarray, window length opened by a tag of
+              each channel
             coincidence_registers : uint32 ndarray holding coincidence marks
             t0s, t1s : int64 ndarray holding register times
             valids : bool ndarray
             histogram : uint32 ndarray
             coincidence_registers_filtered : int32
             closed : int32
+            channel_lut : typed dict channel number -> channel index
+            overflow_state : int64 ndarray with overflow accounting (OVF_*)
+            tag_counts : int64 ndarray of size COUNT_SIZE, numbers of
+              processed and skipped tags are added to it
         Returns:
             last processed time stamp
         """
         for tag in tags:
             # tag.type can be: 0 - TimeTag, 1- Error, 2 - OverflowBegin, 3 -
             # OverflowEnd, 4 - MissedEvents
-            if tag['type'] != 0:
+            if tag['type'] != TAG_TIME:
+                tag_counts[COUNT_SKIPPED] += 1
+                overflow_tag(tag, overflow_state, valids,
+                             coincidence_registers, channels)
+                continue
+            if overflow_state[OVF_ACTIVE]:
+                # delayed tags from the overflow region
+                tag_counts[COUNT_SKIPPED] += 1
                 continue
             timestamp = tag['time']
             channel_num = tag['channel']
+            if channel_num not in channel_lut:
+                tag_counts[COUNT_SKIPPED] += 1
+                continue
+            tag_counts[COUNT_PROCESSED] += 1
             channel_id = channel_lut[channel_num]
             timestamp = tag['time']
             coincidence_registers_filtered = 0
@@ -345,7 +803,7 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
                 if idx > 0:
                     histogram[idx] += 1
             t0s[channel_id] = timestamp
-            t1s[channel_id] = timestamp + binwidth
+            t1s[channel_id] = timestamp + binwidths[channel_id]
             coincidence_registers[channel_id] = (1 << channel_id)
             valids[channel_id] = True
         return timestamp
@@ -371,9 +829,36 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
         end_time
             End timestamp of the of the current data block.
         """
+        if self.stats is not None:
+            self.stats.enter()
+        tags = incoming_tags
+        if self.reorder_buffer is not None:
+            tags = self.reorder_buffer.push(incoming_tags)
+        self._process_sorted(tags)
+        if self.precision is not None:
+            if self.start_time is None:
+                self.start_time = begin_time
+            self.precision.update(self.histogram, end_time - self.start_time)
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, end_time)
+        if self.stats is not None:
+            self.stats.leave(incoming_tags.size, self.tag_counts, end_time)
+
+    def _process_sorted(self, tags, tag_counts=None):
+        """
+        Pass chronologically ordered tags to the compiled kernel.
+        Tags are counted to self.tag_counts unless other tag_counts
+        array is given (virtual tags).
+        """
+        if tags.size == 0:
+            return
+        if tag_counts is None:
+            tag_counts = self.tag_counts
+        if self.stats is not None:
+            t_kernel = perf_counter()
         self.last_timestamp = CustomCoincidencePattern.fast_process(
-            incoming_tags,
-            self.binwidth,
+            tags,
+            self.binwidths,
             self.n_channels,
             self.coincidence_registers,
             self.t0s,
@@ -382,8 +867,12 @@ class CustomCoincidencePattern(TimeTagger.CustomMeasurement):
             self.histogram,
             self.coincidence_registers_filtered,
             self.closed,
-            self.channel_lut
+            self.channel_lut,
+            self.overflow_state,
+            tag_counts
         )
+        if self.stats is not None:
+            self.stats.add_kernel_time(perf_counter() - t_kernel)
 
 # Example:
 # if __name__ == '__main__':
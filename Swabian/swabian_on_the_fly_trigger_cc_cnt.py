@@ -3,21 +3,22 @@ Subclass of TimeTagger.CustomMeasurement() class for counting the
 histogram of coincidence order from time tags.
 """
 
+from time import perf_counter
 import numpy as np
 import numba
 import TimeTagger
+from precision_monitor import PrecisionMixin
+from measurement_stats import COUNT_PROCESSED, COUNT_SKIPPED, COUNT_SIZE
+from swabian_on_the_fly_coincidence_counting import (
+    TAGFORMAT, TAG_TIME, OVF_ACTIVE, OVF_SIZE, overflow_tag, overflow_summary)
 
 #set this to true if the we want to create an artificial SW start trigger signal
 #and allow sensing tags even before first real trigger timestamp is registered
 OPT_TRIG_1ST_SW = True 
 
-# Timetagger format
-TAGFORMAT = np.dtype([
-    ('type', np.dtype('<u4')),
-    ('overflow', np.dtype('<u4')),
-    ('channel', np.dtype('<i4')),
-    ('time', np.dtype('int64'))
-])
+# maximum number of tags in one trigger window kept for the per-order
+# arrival histograms
+ARRIVAL_WINDOW_CAPACITY = 256
 
 HAMMING_LUT = np.array([bin(i).count("1")
                         for i in range(2**8)], dtype=np.uint8)
@@ -35,23 +36,39 @@ def numba_ham32(i):
     return bitcount
 
 
-class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
+class CustomTrigCoincidenceOrder(PrecisionMixin, TimeTagger.CustomMeasurement):
     """
     Custom measurement class for on-the-fly counting histogram of coincidence order.
     Warning: it does not support big virtual delays between channel because the
     coincidence tag should always come in chronological order.
     """
 
-    def __init__(self, tagger, trig_channel, channels, binwidth=1000):
+    def __init__(self, tagger, trig_channel, channels, binwidth=1000,
+                 precision=None, arrival_binwidth=None, arrival_bins=1000,
+                 stats=None, shm_name=None):
         """
         Args:
             tagger : timetagger instance
             trigger_c : channel number of trigger
             channels : list of channel numbers
+            binwidth : window after trigger (ps), either one for all
+              channels or a list with window for each channel in channels
+            precision : optional PrecisionMonitor (precision_monitor.py)
+              watching the histogram, see waitUntilPrecise()
+            arrival_binwidth : bin width (ps) of the arrival-time histograms
+              relative to the latest trigger, None disables them
+            arrival_bins : number of bins of the arrival-time histograms
+            stats : optional ProcessStats (measurement_stats.py) collecting
+              timings of process(), see getStats()
+            shm_name : optional name of shared memory block where the
+              histogram is published for other processes, see
+              shared_histogram.SharedHistogramReader
         """
         TimeTagger.CustomMeasurement.__init__(self, tagger)
         self.n_channels = len(channels)
-        self.binwidth = binwidth
+        self.binwidths = np.zeros(self.n_channels, dtype=np.int64) \
+            + np.asarray(binwidth, dtype=np.int64)
+        self.binwidth = int(self.binwidths.max())
         # The method register_channel(channel) activates
         # that data from the respective channels is transferred
         # from the Time Tagger to the PC.
@@ -59,11 +76,20 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         if trig_channel not in channels:
             raise ValueError
         self.trig_channel = trig_channel
+        self.precision = precision
+        self.stats = stats
+        self.publisher = None
+        self.arrival_binwidth = 1 if arrival_binwidth is None else int(arrival_binwidth)
+        self.arrival_bins = 0 if arrival_binwidth is None else int(arrival_bins)
 
         for channel_number in channels:
             self.register_channel(channel=channel_number)
 
         self.clear_impl()
+        if shm_name:
+            # optional, needs multiprocessing.shared_memory (Python >= 3.8)
+            from shared_histogram import SharedHistogramWriter
+            self.publisher = SharedHistogramWriter(shm_name, self.histogram.shape)
 
         # At the end of a CustomMeasurement construction,
         # we must indicate that we have finished.
@@ -73,6 +99,8 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         # The measurement must be stopped before deconstruction to avoid
         # concurrent process() calls.
         self.stop()
+        if self.publisher is not None:
+            self.publisher.close()
 
     def getData(self):
         # Acquire a lock this instance to guarantee that process() is not running in parallel
@@ -80,6 +108,42 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         with self.mutex:
             return self.histogram.copy()
 
+    def getArrivalData(self):
+        """
+        Arrival-time histograms relative to the latest trigger.
+        Returns:
+            arrival_histogram : uint32 ndarray (channel index, time bin)
+              of all tags following a trigger
+            order_arrival_histogram : uint32 ndarray (order, time bin)
+              of tags inside the coincidence window, sorted by the order
+              of the window they belong to
+        """
+        with self.mutex:
+            return self.arrival_histogram.copy(), self.order_arrival_histogram.copy()
+
+    def getArrivalIndex(self):
+        """Left edges (ps) of the arrival-time histogram bins."""
+        return np.arange(self.arrival_bins, dtype=np.int64)*self.arrival_binwidth
+
+    def getOverflowStats(self):
+        """
+        Dead time (ps) and missed events caused by the tagger overflows,
+        see overflow_summary(). Discarded windows are trigger windows.
+        Use the dead time to correct the rates.
+        """
+        with self.mutex:
+            return overflow_summary(self.overflow_state)
+
+    def getStats(self):
+        """
+        Counters and timings of process(), see ProcessStats.get_summary(),
+        None when the measurement was created without stats.
+        """
+        if self.stats is None:
+            return None
+        with self.mutex:
+            return self.stats.get_summary()
+
     def getIndex(self):
         # This method does not depend on the internal state, so there is no
         # need for a lock.
@@ -94,6 +158,21 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         self.valid = False
         self.histogram = np.zeros(self.n_channels+1, dtype=np.uint32)
         self.last_timestamp = np.int64(0)
+        self.overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+        self.arrival_histogram = np.zeros(
+            (self.n_channels, self.arrival_bins), dtype=np.uint32)
+        self.order_arrival_histogram = np.zeros(
+            (self.n_channels+1, self.arrival_bins), dtype=np.uint32)
+        self.window_bins = np.zeros(ARRIVAL_WINDOW_CAPACITY, dtype=np.int64)
+        self.window_fill = np.zeros(1, dtype=np.int64)
+        self.tag_counts = np.zeros(COUNT_SIZE, dtype=np.int64)
+        self.start_time = None
+        if self.precision is not None:
+            self.precision.clear()
+        if self.stats is not None:
+            self.stats.clear()
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, force=True)
 
     def on_start(self):
         # The lock is already acquired within the backend.
@@ -102,17 +181,7 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
             print("Trig...")
             first_virtual_timestamp = np.array(
                 [(0, 0, self.trig_channel, 0)], dtype=TAGFORMAT)
-            self.last_timestamp, self.t0, self.t1, self.coincidence_register, self.valid =\
-                CustomTrigCoincidenceOrder.fast_process(
-                    first_virtual_timestamp,
-                    self.trig_channel,
-                    self.binwidth,
-                    self.coincidence_register,
-                    self.t0,
-                    self.t1,
-                    self.valid,
-                    self.histogram,
-                    self.channels)
+            self._process_tags(first_virtual_timestamp, np.zeros(COUNT_SIZE, dtype=np.int64))
             self.histogram[1] = self.histogram[1] - 1
 
     def on_stop(self):
@@ -120,53 +189,81 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         # here maybe flush the last tag
         last_virtual_timestamp = np.array(
             [(0, 0, self.trig_channel, self.last_timestamp+10*self.binwidth)], dtype=TAGFORMAT)
-        CustomTrigCoincidenceOrder.fast_process(
-            last_virtual_timestamp,
-            self.trig_channel,
-            self.binwidth,
-            self.coincidence_register,
-            self.t0,
-            self.t1,
-            self.valid,
-            self.histogram,
-            self.channels)
+        self._process_tags(last_virtual_timestamp, np.zeros(COUNT_SIZE, dtype=np.int64))
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, self.last_timestamp, force=True)
 
     @staticmethod
     @numba.jit(nopython=True, nogil=True)
-    def fast_process(tags, trig_channel, binwidth,
+    def fast_process(tags, trig_channel, binwidths,
                      coincidence_register, t0, t1, valid,
                      histogram,
-                     channels_list
+                     channels_list,
+                     overflow_state,
+                     arrival_binwidth,
+                     arrival_histogram,
+                     order_arrival_histogram,
+                     window_bins,
+                     window_fill,
+                     tag_counts
                      ):
         """
         Warning: it mutates the numpy arrays.
         Args:
             TAGFORMAT: ndarray of tagformat dtype holding timestamps
             trig_channel : int
-            binwiddth: int
+            binwidths: int64 ndarray, window after trigger for each channel
             channels : list
             coincidence_register : uint32
             t0, t1 : int64
             valids : bool ndarray
             histogram : uint32 ndarray    
+            overflow_state : int64 ndarray with overflow accounting (OVF_*),
+              the trigger window open at OverflowBegin is discarded and
+              tags until OverflowEnd are skipped
+            arrival_binwidth : int, bin width of arrival histograms
+            arrival_histogram : uint32 2-D ndarray (channel, bin)
+            order_arrival_histogram : uint32 2-D ndarray (order, bin),
+              arrival histograms are disabled when they have zero bins
+            window_bins : int64 ndarray, arrival bins of the tags in the
+              current window
+            window_fill : int64 ndarray of size 1, used part of window_bins
+            tag_counts : int64 ndarray of size COUNT_SIZE, numbers of
+              processed and skipped tags are added to it
         Returns:
             last timestamp, t0, t1, coincidence_register, valid
         """
         trigger_channel_id = channels_list.index(trig_channel)
+        n_arrival_bins = arrival_histogram.shape[1]
+        max_binwidth = binwidths.max()
+        # the trigger window as one-channel state of overflow_tag()
+        valids = np.zeros(1, dtype=np.bool_)
+        registers = np.zeros(1, dtype=np.uint32)
         for tag in tags:
+            timestamp = tag['time']
             # tag.type can be: 0 - TimeTag, 1- Error, 2 - OverflowBegin, 3 -
             # OverflowEnd, 4 - MissedEvents
-            if tag['type'] != 0:
+            if tag['type'] != TAG_TIME:
+                tag_counts[COUNT_SKIPPED] += 1
+                valids[0] = valid
+                overflow_tag(tag, overflow_state, valids, registers, 1)
+                if valid and not valids[0]:
+                    valid = False
+                    window_fill[0] = 0
+                continue
+            if overflow_state[OVF_ACTIVE]:
+                # delayed tags from the overflow region
+                tag_counts[COUNT_SKIPPED] += 1
                 continue
-            timestamp = tag['time']
             channel_num = tag['channel']
             # there has to be a better way, maybe lookup table?
             # or dynamically precompile mapping function?
             if channel_num in channels_list:
                 channel_id = channels_list.index(channel_num)
             else:
+                tag_counts[COUNT_SKIPPED] += 1
                 continue
-            timestamp = tag['time']
+            tag_counts[COUNT_PROCESSED] += 1
 
             if (channel_id == trigger_channel_id):
                 if valid:
@@ -174,20 +271,64 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
                     #
                     idx = numba_ham32(coincidence_register)                    
                     histogram[idx] += 1
+                    for k in range(window_fill[0]):
+                        order_arrival_histogram[idx, window_bins[k]] += 1
                 else:
                     valid = True
+                window_fill[0] = 0
                 # update registers
                 t0 = timestamp
-                t1 = timestamp + binwidth
+                t1 = timestamp + max_binwidth
                 coincidence_register = (1 << trigger_channel_id)
-            elif (t0 < timestamp <= t1) and valid:
+                continue
+            in_window = t0 < timestamp <= t0 + binwidths[channel_id]
+            if valid and n_arrival_bins > 0:
+                arrival_bin = (timestamp - t0) // arrival_binwidth
+                if 0 <= arrival_bin < n_arrival_bins:
+                    arrival_histogram[channel_id, arrival_bin] += 1
+                    if in_window and window_fill[0] < window_bins.size:
+                        window_bins[window_fill[0]] = arrival_bin
+                        window_fill[0] += 1
+            if in_window and valid:
                 coincidence_register = coincidence_register | (1 << channel_id)
-            elif timestamp > t1 and valid:
+            elif timestamp > t0 and valid:
                 # count timestamps outside valid cc window
                 histogram[0] += 1
 
         return timestamp, t0, t1, coincidence_register, valid
 
+    def _process_tags(self, tags, tag_counts=None):
+        """
+        Pass tags to the compiled kernel and keep its state.
+        Tags are counted to self.tag_counts unless other tag_counts
+        array is given (virtual tags).
+        """
+        if tag_counts is None:
+            tag_counts = self.tag_counts
+        if self.stats is not None:
+            t_kernel = perf_counter()
+        self.last_timestamp, self.t0, self.t1, self.coincidence_register, self.valid =\
+            CustomTrigCoincidenceOrder.fast_process(
+                tags,
+                self.trig_channel,
+                self.binwidths,
+                self.coincidence_register,
+                self.t0,
+                self.t1,
+                self.valid,
+                self.histogram,
+                self.channels,
+                self.overflow_state,
+                self.arrival_binwidth,
+                self.arrival_histogram,
+                self.order_arrival_histogram,
+                self.window_bins,
+                self.window_fill,
+                tag_counts
+            )
+        if self.stats is not None:
+            self.stats.add_kernel_time(perf_counter() - t_kernel)
+
     def process(self, incoming_tags, begin_time, end_time):
         """
         Main processing method for the incoming raw time-tags.
@@ -209,18 +350,17 @@ class CustomTrigCoincidenceOrder(TimeTagger.CustomMeasurement):
         end_time
             End timestamp of the of the current data block.
         """
-        self.last_timestamp, self.t0, self.t1, self.coincidence_register, self.valid =\
-            CustomTrigCoincidenceOrder.fast_process(
-                incoming_tags,
-                self.trig_channel,
-                self.binwidth,
-                self.coincidence_register,
-                self.t0,
-                self.t1,
-                self.valid,
-                self.histogram,
-                self.channels
-            )
+        if self.stats is not None:
+            self.stats.enter()
+        self._process_tags(incoming_tags)
+        if self.precision is not None:
+            if self.start_time is None:
+                self.start_time = begin_time
+            self.precision.update(self.histogram, end_time - self.start_time)
+        if self.publisher is not None:
+            self.publisher.publish(self.histogram, end_time)
+        if self.stats is not None:
+            self.stats.leave(incoming_tags.size, self.tag_counts, end_time)
 
 
 #Basic examples
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from coincidence_order_counting_saved_tags import (
+    TAGFORMAT, make_histogram, make_pattern_histogram)
+
+BINWIDTH = 1000
+CHANNELS = 4
+
+
+def chunked(tags, size):
+    return [tags[i:i + size] for i in range(0, tags.size, size)]
+
+
+def separated_events(n_events=2000, seed=0):
+    """Events far apart, each with distinct channels spread below binwidth."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for k in range(n_events):
+        n = rng.integers(1, CHANNELS + 1)
+        channels = rng.permutation(CHANNELS)[:n] + 1
+        offsets = np.sort(rng.choice(BINWIDTH // 2, n, replace=False))
+        records += [(0, ch, 10*BINWIDTH*(k + 1) + dt) for ch, dt in zip(channels, offsets)]
+    return np.array(records, dtype=TAGFORMAT)
+
+
+def dense_tags(n_tags=20000, seed=1):
+    rng = np.random.default_rng(seed)
+    tags = np.zeros(n_tags, dtype=TAGFORMAT)
+    tags['channel'] = rng.integers(1, CHANNELS + 1, n_tags)
+    tags['time'] = np.cumsum(rng.integers(1, 2*BINWIDTH, n_tags))
+    return tags
+
+
+def brute_force_clusters(tags):
+    """Patterns of clusters anchored at their first tag."""
+    histogram = np.zeros(2**CHANNELS, dtype=np.int64)
+    anchor, pattern = None, 0
+    for tag in tags:
+        if anchor is not None and tag['time'] - anchor > BINWIDTH:
+            histogram[pattern] += 1
+            anchor, pattern = None, 0
+        if anchor is None:
+            anchor = tag['time']
+        pattern |= 1 << (int(tag['channel']) - 1)
+    histogram[pattern] += 1
+    return histogram
+
+
+def test_engines_agree_on_separated_events():
+    tags = separated_events()
+    for make in (make_histogram, make_pattern_histogram):
+        state = make(chunked(tags, 1024), BINWIDTH, CHANNELS, engine='state')
+        cluster = make(chunked(tags, 1024), BINWIDTH, CHANNELS, engine='cluster')
+        np.testing.assert_array_equal(state, cluster)
+
+
+def test_cluster_engine_matches_brute_force():
+    tags = dense_tags()
+    np.testing.assert_array_equal(
+        make_pattern_histogram([tags], BINWIDTH, CHANNELS, engine='cluster'),
+        brute_force_clusters(tags))
+
+
+@pytest.mark.parametrize("engine", ['state', 'cluster'])
+def test_chunk_invariance(engine):
+    tags = dense_tags()
+    reference = make_pattern_histogram([tags], BINWIDTH, CHANNELS, engine=engine)
+    for size in (1, 13, 4096):
+        np.testing.assert_array_equal(
+            make_pattern_histogram(chunked(tags, size), BINWIDTH, CHANNELS, engine=engine),
+            reference)
+    np.testing.assert_array_equal(
+        make_histogram(chunked(tags, 13), BINWIDTH, CHANNELS, engine=engine),
+        make_histogram([tags], BINWIDTH, CHANNELS, engine=engine))
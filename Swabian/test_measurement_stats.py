@@ -0,0 +1,21 @@
+import numpy as np
+from measurement_stats import ProcessStats, COUNT_PROCESSED, COUNT_SKIPPED, COUNT_SIZE
+
+
+def test_counts_from_kernel():
+    stats = ProcessStats()
+    tag_counts = np.zeros(COUNT_SIZE, dtype=np.int64)
+    for block in range(3):
+        stats.enter()
+        # kernel saw 90 tags of the block, 10 are held by the delay stage
+        tag_counts[COUNT_PROCESSED] += 80
+        tag_counts[COUNT_SKIPPED] += 10
+        stats.leave(100, tag_counts, (block + 1)*int(1e9))
+    summary = stats.get_summary()
+    assert summary["blocks"] == 3
+    assert summary["tags"] == 300
+    assert summary["processed"] == 240
+    assert summary["skipped"] == 30
+    assert summary["held"] == 30
+    stats.clear()
+    assert stats.get_summary()["tags_per_block"] == 0.0
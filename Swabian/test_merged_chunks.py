@@ -0,0 +1,47 @@
+import numpy as np
+from coincidence_order_counting_saved_tags import TAGFORMAT, iterate_merged_chunks
+
+
+def source(rng, n, channels, chunk_size):
+    tags = np.zeros(n, dtype=TAGFORMAT)
+    tags['channel'] = rng.integers(1, channels + 1, n)
+    tags['time'] = np.cumsum(rng.integers(0, 500, n))
+    chunks = [tags[i:i + chunk_size] for i in range(0, n, chunk_size)]
+    # empty chunks are skipped
+    chunks.insert(1, tags[:0])
+    return tags, chunks
+
+
+def test_merged_chunks_are_ordered_and_complete():
+    rng = np.random.default_rng(3)
+    a, chunks_a = source(rng, 5000, 4, 97)
+    b, chunks_b = source(rng, 3000, 4, 1024)
+    c, chunks_c = source(rng, 10, 2, 3)
+    merged = list(iterate_merged_chunks([chunks_a, chunks_b, chunks_c],
+                                        [0, 4, 8], [0, 1250, -100]))
+    assert all(chunk.size > 0 for chunk in merged)
+    merged = np.concatenate(merged)
+    assert np.all(np.diff(merged['time']) >= 0)
+
+    shifted_b = b.copy()
+    shifted_b['channel'] += 4
+    shifted_b['time'] += 1250
+    shifted_c = c.copy()
+    shifted_c['channel'] += 8
+    shifted_c['time'] -= 100
+    expected = np.concatenate((a, shifted_b, shifted_c))
+    assert sorted(merged.tolist()) == sorted(expected.tolist())
+    # tags of one source keep their order
+    for low, tags in ((1, a), (5, shifted_b), (9, shifted_c)):
+        part = merged[(merged['channel'] >= low) & (merged['channel'] < low + 4)]
+        np.testing.assert_array_equal(part, tags)
+    # source chunks are not modified by the offsets
+    assert chunks_b[0]['channel'].max() <= 4
+
+
+def test_single_and_empty_sources():
+    rng = np.random.default_rng(4)
+    a, chunks_a = source(rng, 100, 2, 7)
+    np.testing.assert_array_equal(
+        np.concatenate(list(iterate_merged_chunks([chunks_a, []]))), a)
+    assert list(iterate_merged_chunks([[], []])) == []
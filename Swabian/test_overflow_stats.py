@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from coincidence_order_counting_saved_tags import (
+    TAGFORMAT, TAG_OVERFLOW_BEGIN, TAG_OVERFLOW_END, TAG_MISSED_EVENTS, make_histogram)
+
+
+def overflow_tags():
+    # pair in coincidence, overflow region 200-5000 with a tag and
+    # 7 missed events inside it, single tag and pair after it
+    return np.array([(0, 1, 0), (0, 2, 100), (TAG_OVERFLOW_BEGIN, 0, 200), (0, 2, 300),
+                     (TAG_MISSED_EVENTS | (7 << 16), 0, 400), (TAG_OVERFLOW_END, 0, 5000),
+                     (0, 1, 6000), (0, 1, 20000), (0, 2, 20010)], dtype=TAGFORMAT)
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 9])
+def test_offline_overflow_stats(chunk):
+    tags = overflow_tags()
+    chunks = [tags[i:i + chunk] for i in range(0, tags.size, chunk)]
+    histogram, stats = make_histogram(chunks, 1000, 2, return_stats=True)
+    assert stats == {"dead_time": 4800, "missed_events": 7, "overflow_regions": 1,
+                     "discarded_windows": 2, "in_overflow": False}
+    # the pair open at the overflow and the tag inside it are dropped,
+    # the later single and pair are counted
+    np.testing.assert_array_equal(histogram, [0, 1, 1])
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 9])
+def test_offline_overflow_stats_cluster(chunk):
+    tags = overflow_tags()
+    chunks = [tags[i:i + chunk] for i in range(0, tags.size, chunk)]
+    histogram, stats = make_histogram(chunks, 1000, 2, return_stats=True, engine='cluster')
+    assert stats == {"dead_time": 4800, "missed_events": 7, "overflow_regions": 1,
+                     "discarded_windows": 1, "in_overflow": False}
+    np.testing.assert_array_equal(histogram, [0, 1, 1])
+
+
+def test_missed_events_without_region():
+    tags = np.array([(TAG_MISSED_EVENTS | (7 << 16), 0, 150), (TAG_OVERFLOW_END, 0, 300),
+                     (0, 1, 5000)], dtype=TAGFORMAT)
+    _, stats = make_histogram([tags], 1000, 2, return_stats=True)
+    assert stats == {"dead_time": 0, "missed_events": 7, "overflow_regions": 0,
+                     "discarded_windows": 0, "in_overflow": False}
+
+
+def test_live_overflow_tag():
+    pytest.importorskip("TimeTagger")
+    from swabian_on_the_fly_coincidence_counting import (
+        TAGFORMAT as LIVE_TAGFORMAT, OVF_SIZE, TAG_OVERFLOW_BEGIN,
+        TAG_OVERFLOW_END, TAG_MISSED_EVENTS, overflow_tag, overflow_summary)
+    tags = np.array([(TAG_OVERFLOW_BEGIN, 0, 0, 1000), (TAG_OVERFLOW_BEGIN, 0, 0, 1500),
+                     (TAG_MISSED_EVENTS, 7, 1, 1600), (TAG_OVERFLOW_END, 0, 0, 4000)],
+                    dtype=LIVE_TAGFORMAT)
+    overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+    valids = np.array([True, False, True])
+    registers = np.array([1, 0, 4], dtype=np.uint32)
+    for tag in tags:
+        overflow_tag(tag, overflow_state, valids, registers, 3)
+    assert overflow_summary(overflow_state) == {
+        "dead_time": 3000, "missed_events": 7, "overflow_regions": 1,
+        "discarded_windows": 2, "in_overflow": False}
+    assert not valids.any() and not registers.any()
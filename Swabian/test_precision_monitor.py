@@ -0,0 +1,30 @@
+import threading
+import numpy as np
+import pytest
+from precision_monitor import PrecisionMonitor, PrecisionMixin
+
+
+class Measurement(PrecisionMixin):
+    def __init__(self, precision):
+        self.precision = precision
+        self.mutex = threading.Lock()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_without_monitor():
+    meas = Measurement(None)
+    assert meas.getPrecision() is None
+    with pytest.raises(ValueError):
+        meas.waitUntilPrecise(timeout=0)
+
+
+def test_wait_until_precise_stops():
+    meas = Measurement(PrecisionMonitor(bins=[1], target=0.1))
+    assert not meas.waitUntilPrecise(timeout=0)
+    meas.precision.update(np.array([0, 100]), 10)
+    assert meas.getPrecision()["done"]
+    assert meas.waitUntilPrecise(timeout=0)
+    assert meas.stopped
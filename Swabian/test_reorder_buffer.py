@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("TimeTagger")
+import numba.typed
+import numba.types
+from swabian_on_the_fly_coincidence_counting import TAGFORMAT, TAG_TIME, TagReorderBuffer
+
+
+def make_buffer(channels, delays, capacity):
+    channel_lut = numba.typed.Dict.empty(
+        key_type=numba.types.int64, value_type=numba.types.int64)
+    for i, ch in enumerate(channels):
+        channel_lut[ch] = i
+    return TagReorderBuffer(channel_lut, delays, channels, capacity)
+
+
+@pytest.mark.parametrize("chunk", [1, 17, 1000])
+def test_delayed_tags_are_sorted(chunk):
+    rng = np.random.default_rng(chunk)
+    channels = [1, 2, 3]
+    delays = {1: 0, 2: 5000, 3: -2000}
+    tags = np.zeros(5000, dtype=TAGFORMAT)
+    tags['type'] = TAG_TIME
+    tags['channel'] = rng.choice([1, 2, 3, 7], tags.size)
+    tags['time'] = np.cumsum(rng.integers(1, 300, tags.size))
+    # small capacity forces the heap to grow
+    buf = make_buffer(channels, delays, capacity=8)
+    out = [buf.push(tags[i:i + chunk]).copy() for i in range(0, tags.size, chunk)]
+    out.append(buf.flush().copy())
+    out = np.concatenate(out)
+
+    kept = tags[tags['channel'] != 7]
+    expected = kept['time'] + np.array([delays[ch] for ch in kept['channel']])
+    assert np.all(np.diff(out['time']) >= 0)
+    assert sorted(zip(out['channel'], out['time'])) == \
+        sorted(zip(kept['channel'], expected))
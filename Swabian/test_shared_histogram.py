@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from shared_histogram import SharedHistogramWriter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_in_other_process(name):
+    """Readers are meant for other processes than the writer."""
+    code = ("from shared_histogram import SharedHistogramReader\n"
+            f"reader = SharedHistogramReader({name!r})\n"
+            "histogram, publications, end_time = reader.read()\n"
+            "print(histogram.tolist(), publications, end_time)\n"
+            "reader.close()\n")
+    result = subprocess.run([sys.executable, "-c", code], cwd=HERE,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+@pytest.fixture
+def name():
+    return f"test_hist_{os.getpid()}"
+
+
+def test_publish_and_read(name):
+    writer = SharedHistogramWriter(name, (2, 3))
+    try:
+        writer.publish(np.arange(6).reshape(2, 3), end_time=123)
+        assert read_in_other_process(name) == "[[0, 1, 2], [3, 4, 5]] 1 123"
+    finally:
+        writer.close()
+
+
+def test_leftover_block(name):
+    leftover = SharedHistogramWriter(name, 4)
+    try:
+        with pytest.raises(FileExistsError):
+            SharedHistogramWriter(name, 4, replace=False)
+        writer = SharedHistogramWriter(name, 3)
+        writer.publish(np.ones(3))
+        assert read_in_other_process(name) == "[1, 1, 1] 1 0"
+        writer.close()
+    finally:
+        # the leftover block is already unlinked by the new writer
+        leftover.shm.close()
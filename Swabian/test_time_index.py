@@ -0,0 +1,52 @@
+import numpy as np
+from coincidence_order_counting_saved_tags import (
+    TAGFORMAT, build_time_index, find_record, iterate_chunks_time_range)
+
+
+def write_dump(path, times, channel=1):
+    tags = np.zeros(len(times), dtype=TAGFORMAT)
+    tags['channel'] = channel
+    tags['time'] = times
+    path.write_bytes(tags.tobytes())
+    return tags
+
+
+def test_lookup_and_time_range(tmp_path):
+    fn = tmp_path / "dump.dat"
+    times = np.cumsum(np.random.default_rng(1).integers(1, 100, 10_000))
+    write_dump(fn, times)
+    index = build_time_index(str(fn), stride=128)
+    for t in (0, times[0], times[500], times[500] + 1, times[-1], times[-1] + 1):
+        assert find_record(str(fn), t, index) == np.searchsorted(times, t)
+    chunks = iterate_chunks_time_range(str(fn), times[1000], times[7000],
+                                       chunk_size=333, index=index)
+    np.testing.assert_array_equal(np.concatenate(list(chunks))['time'],
+                                  times[1000:7000])
+
+
+def test_empty_and_partial_file(tmp_path):
+    fn = tmp_path / "dump.dat"
+    fn.write_bytes(b"")
+    stride, times = build_time_index(str(fn), stride=16)
+    assert times.size == 0
+    assert list(iterate_chunks_time_range(str(fn), 0)) == []
+    # a record being written is not indexed
+    tags = write_dump(fn, np.arange(100))
+    with open(fn, 'ab') as f:
+        f.write(tags[:1].tobytes()[:TAGFORMAT.itemsize // 2])
+    stride, times = build_time_index(str(fn), stride=16)
+    np.testing.assert_array_equal(times, np.arange(0, 100, 16))
+
+
+def test_index_follows_appended_and_replaced_file(tmp_path):
+    fn = tmp_path / "dump.dat"
+    write_dump(fn, np.arange(100))
+    build_time_index(str(fn), stride=16)
+    with open(fn, 'ab') as f:
+        f.write(np.array([(0, 1, t) for t in range(100, 200)], dtype=TAGFORMAT).tobytes())
+    _, times = build_time_index(str(fn), stride=16)
+    np.testing.assert_array_equal(times, np.arange(0, 200, 16))
+    # a different, larger file under the same name
+    write_dump(fn, 10*np.arange(300))
+    _, times = build_time_index(str(fn), stride=16)
+    np.testing.assert_array_equal(times, 10*np.arange(0, 300, 16))
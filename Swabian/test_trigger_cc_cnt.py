@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("TimeTagger")
+from measurement_stats import COUNT_SIZE
+from swabian_on_the_fly_coincidence_counting import (
+    TAGFORMAT, TAG_TIME, TAG_OVERFLOW_BEGIN, TAG_OVERFLOW_END, OVF_SIZE, overflow_summary)
+from swabian_on_the_fly_trigger_cc_cnt import CustomTrigCoincidenceOrder, ARRIVAL_WINDOW_CAPACITY
+
+
+class TriggerKernel():
+    """State of CustomTrigCoincidenceOrder without a tagger."""
+
+    def __init__(self, channels, binwidth, arrival_binwidth=1, arrival_bins=0):
+        self.channels = channels
+        self.binwidths = np.full(len(channels), binwidth, dtype=np.int64)
+        self.histogram = np.zeros(len(channels) + 1, dtype=np.uint32)
+        self.overflow_state = np.zeros(OVF_SIZE, dtype=np.int64)
+        self.arrival_binwidth = arrival_binwidth
+        self.arrival_histogram = np.zeros((len(channels), arrival_bins), dtype=np.uint32)
+        self.order_arrival_histogram = np.zeros((len(channels) + 1, arrival_bins),
+                                                dtype=np.uint32)
+        self.window_bins = np.zeros(ARRIVAL_WINDOW_CAPACITY, dtype=np.int64)
+        self.window_fill = np.zeros(1, dtype=np.int64)
+        self.tag_counts = np.zeros(COUNT_SIZE, dtype=np.int64)
+        self.state = (np.uint32(0), np.int64(0), np.int64(0), False)
+
+    def process(self, tags):
+        register, t0, t1, valid = self.state
+        _, t0, t1, register, valid = CustomTrigCoincidenceOrder.fast_process(
+            np.array(tags, dtype=TAGFORMAT), self.channels[0], self.binwidths,
+            register, t0, t1, valid, self.histogram, self.channels,
+            self.overflow_state, self.arrival_binwidth, self.arrival_histogram,
+            self.order_arrival_histogram, self.window_bins, self.window_fill,
+            self.tag_counts)
+        self.state = (register, t0, t1, valid)
+
+
+def test_trigger_inside_overflow_is_skipped():
+    kernel = TriggerKernel([1, 2], 1000)
+    kernel.process([(TAG_TIME, 0, 1, 100), (TAG_OVERFLOW_BEGIN, 0, 0, 150),
+                    (TAG_TIME, 0, 1, 200), (TAG_TIME, 0, 2, 250),
+                    (TAG_OVERFLOW_END, 0, 0, 300), (TAG_TIME, 0, 1, 5000)])
+    # the window of the first trigger is discarded, the second trigger
+    # and its tag are inside the region
+    np.testing.assert_array_equal(kernel.histogram, [0, 0, 0])
+    assert overflow_summary(kernel.overflow_state) == {
+        "dead_time": 150, "missed_events": 0, "overflow_regions": 1,
+        "discarded_windows": 1, "in_overflow": False}
+
+
+def test_arrival_histograms():
+    kernel = TriggerKernel([1, 2, 3], 100, arrival_binwidth=10, arrival_bins=20)
+    kernel.process([(TAG_TIME, 0, 1, 1000), (TAG_TIME, 0, 2, 1025), (TAG_TIME, 0, 3, 1090),
+                    (TAG_TIME, 0, 2, 1150),  # after the window, still in the histogram
+                    (TAG_TIME, 0, 1, 2000), (TAG_TIME, 0, 3, 2005),
+                    (TAG_TIME, 0, 1, 3000)])
+    expected = np.zeros((3, 20), dtype=np.uint32)
+    expected[1, [2, 15]] = 1
+    expected[2, [9, 0]] = 1
+    np.testing.assert_array_equal(kernel.arrival_histogram, expected)
+    # tags in windows by the order of the window: triple, then double
+    expected_order = np.zeros((4, 20), dtype=np.uint32)
+    expected_order[3, [2, 9]] = 1
+    expected_order[2, 0] = 1
+    np.testing.assert_array_equal(kernel.order_arrival_histogram, expected_order)
+
+
+def test_tag_before_trigger_is_not_wrapped():
+    kernel = TriggerKernel([1, 2], 100, arrival_binwidth=10, arrival_bins=20)
+    # the tag 10 ps before the trigger gives negative bin
+    kernel.process([(TAG_TIME, 0, 1, 1000), (TAG_TIME, 0, 1, 2000), (TAG_TIME, 0, 2, 1990)])
+    assert not kernel.arrival_histogram.any()